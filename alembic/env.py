@@ -10,22 +10,26 @@ from sqlalchemy import engine_from_config, pool
 # access to the values within the .ini file in use.
 config = context.config
 
-# Interpret the config file for Python logging.
-# This line sets up loggers basically.
-if config.config_file_name is not None:
-    fileConfig(config.config_file_name)
-
-# add project directory to path and import the Flask app
-sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-try:
+# Migrations started by the app itself (gamestore/schema.py) hand over an open
+# connection; the app is already configured then and must not be imported again.
+connection = config.attributes.get('connection')
+
+if connection is None:
+    # Interpret the config file for Python logging.
+    # This line sets up loggers basically.
+    if config.config_file_name is not None:
+        fileConfig(config.config_file_name)
+
+    # add project directory to path and import the Flask app (the import does not touch the database)
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
     from app import app, db
-except Exception as e:
-    raise
 
-# set sqlalchemy.url dynamically from Flask config
-config.set_main_option('sqlalchemy.url', app.config.get('SQLALCHEMY_DATABASE_URI'))
+    # set sqlalchemy.url dynamically from Flask config
+    config.set_main_option('sqlalchemy.url', app.config.get('SQLALCHEMY_DATABASE_URI'))
 
-target_metadata = db.metadata
+    target_metadata = db.metadata
+else:
+    target_metadata = config.attributes.get('target_metadata')
 
 
 def run_migrations_offline():
@@ -40,15 +44,30 @@ def run_migrations_offline():
         context.run_migrations()
 
 
+def _configure(connection):
+    context.configure(
+        connection=connection,
+        target_metadata=target_metadata,
+        # SQLite can only ALTER TABLE through copy-and-move batches
+        render_as_batch=connection.dialect.name == 'sqlite',
+    )
+
+
 def run_migrations_online():
+    if connection is not None:
+        _configure(connection)
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     connectable = engine_from_config(
         config.get_section(config.config_ini_section),
         prefix='sqlalchemy.',
         poolclass=pool.NullPool,
     )
 
-    with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+    with connectable.connect() as conn:
+        _configure(conn)
 
         with context.begin_transaction():
             context.run_migrations()
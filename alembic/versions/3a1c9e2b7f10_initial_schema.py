@@ -0,0 +1,91 @@
+"""initial schema
+
+Tables as created by db.create_all() before migrations were introduced.
+Each table is only created when missing, so databases bootstrapped by the
+old init_db_and_seed() can be upgraded in place.
+
+Revision ID: 3a1c9e2b7f10
+Revises:
+Create Date: 2026-10-17 09:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3a1c9e2b7f10'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _has_table(name):
+    return sa.inspect(op.get_bind()).has_table(name)
+
+
+def upgrade():
+    if not _has_table('users'):
+        op.create_table(
+            'users',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('username', sa.String(length=120), nullable=False, unique=True),
+            sa.Column('password_hash', sa.String(length=200), nullable=False),
+            sa.Column('is_admin', sa.Boolean(), nullable=True),
+        )
+    if not _has_table('products'):
+        op.create_table(
+            'products',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('title', sa.String(length=200), nullable=False),
+            sa.Column('price', sa.Float(), nullable=False),
+            sa.Column('img', sa.String(length=400), nullable=True),
+            sa.Column('image_data', sa.LargeBinary(), nullable=True),
+            sa.Column('image_mime', sa.String(length=120), nullable=True),
+            sa.Column('category', sa.String(length=120), nullable=True),
+        )
+    if not _has_table('categories'):
+        op.create_table(
+            'categories',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('name', sa.String(length=120), nullable=False, unique=True),
+        )
+    if not _has_table('product_images'):
+        op.create_table(
+            'product_images',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='CASCADE'), nullable=True),
+            sa.Column('url', sa.String(length=400), nullable=False),
+        )
+    if not _has_table('orders'):
+        op.create_table(
+            'orders',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('total', sa.Float(), nullable=True),
+            sa.Column('status', sa.String(length=50), nullable=True),
+            sa.Column('created_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        )
+    if not _has_table('order_items'):
+        op.create_table(
+            'order_items',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='CASCADE'), nullable=True),
+            sa.Column('product_id', sa.Integer(), sa.ForeignKey('products.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('quantity', sa.Integer(), nullable=True),
+            sa.Column('price', sa.Float(), nullable=True),
+        )
+    if not _has_table('payments'):
+        op.create_table(
+            'payments',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('order_id', sa.Integer(), sa.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True),
+            sa.Column('amount', sa.Float(), nullable=False),
+            sa.Column('method', sa.String(length=80), nullable=True),
+            sa.Column('status', sa.String(length=50), nullable=True),
+        )
+
+
+def downgrade():
+    for name in ('payments', 'order_items', 'orders', 'product_images', 'categories', 'products', 'users'):
+        op.drop_table(name)
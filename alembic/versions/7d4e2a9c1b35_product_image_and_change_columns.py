@@ -0,0 +1,44 @@
+"""product image store and change-tracking columns
+
+Adds the columns previously patched in at request time by
+ensure_product_image_columns()/ensure_product_category_column(), plus
+image_hash (content-addressed image store) and updated_at (HTTP validators).
+
+Revision ID: 7d4e2a9c1b35
+Revises: 3a1c9e2b7f10
+Create Date: 2026-10-17 09:05:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4e2a9c1b35'
+down_revision = '3a1c9e2b7f10'
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = [
+    ('image_data', sa.LargeBinary()),
+    ('image_mime', sa.String(length=120)),
+    ('category', sa.String(length=120)),
+    ('image_hash', sa.String(length=64)),
+    ('updated_at', sa.DateTime()),
+]
+
+
+def upgrade():
+    existing = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('products')}
+    missing = [(name, type_) for name, type_ in NEW_COLUMNS if name not in existing]
+    if not missing:
+        return
+    with op.batch_alter_table('products') as batch:
+        for name, type_ in missing:
+            batch.add_column(sa.Column(name, type_, nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('products') as batch:
+        batch.drop_column('updated_at')
+        batch.drop_column('image_hash')
@@ -0,0 +1,73 @@
+"""sales rollup tables for reports
+
+Daily, per-product and per-category sales figures maintained by checkout
+(gamestore/reporting.py). Existing orders are aggregated once here; later
+backfills use "flask --app app gamestore rebuild-reports".
+
+Revision ID: a4f2d8c61e57
+Revises: c7a1f4d9e203
+Create Date: 2026-10-17 11:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4f2d8c61e57'
+down_revision = 'c7a1f4d9e203'
+branch_labels = None
+depends_on = None
+
+
+def _counters():
+    return [
+        sa.Column('units', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('revenue', sa.Float(), nullable=False, server_default='0'),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        'sales_daily',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('orders', sa.Integer(), nullable=False, server_default='0'),
+        *_counters(),
+    )
+    op.create_table(
+        'sales_product_daily',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('product_id', sa.Integer(), primary_key=True),
+        *_counters(),
+    )
+    op.create_table(
+        'sales_category_daily',
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('category_id', sa.Integer(), primary_key=True),
+        *_counters(),
+    )
+
+    op.execute(sa.text(
+        'INSERT INTO sales_daily (day, orders, units, revenue) '
+        'SELECT date(o.created_at), count(DISTINCT o.id), coalesce(sum(i.quantity), 0), '
+        'coalesce(sum(i.quantity * i.price), 0) '
+        'FROM orders o LEFT JOIN order_items i ON i.order_id = o.id '
+        'WHERE o.created_at IS NOT NULL GROUP BY date(o.created_at)'))
+    op.execute(sa.text(
+        'INSERT INTO sales_product_daily (day, product_id, units, revenue) '
+        'SELECT date(o.created_at), i.product_id, sum(i.quantity), sum(i.quantity * i.price) '
+        'FROM order_items i JOIN orders o ON o.id = i.order_id '
+        'WHERE o.created_at IS NOT NULL AND i.product_id IS NOT NULL '
+        'GROUP BY date(o.created_at), i.product_id'))
+    op.execute(sa.text(
+        'INSERT INTO sales_category_daily (day, category_id, units, revenue) '
+        'SELECT date(o.created_at), p.category_id, sum(i.quantity), sum(i.quantity * i.price) '
+        'FROM order_items i JOIN orders o ON o.id = i.order_id JOIN products p ON p.id = i.product_id '
+        'WHERE o.created_at IS NOT NULL AND p.category_id IS NOT NULL '
+        'GROUP BY date(o.created_at), p.category_id'))
+
+
+def downgrade():
+    op.drop_table('sales_category_daily')
+    op.drop_table('sales_product_daily')
+    op.drop_table('sales_daily')
@@ -0,0 +1,25 @@
+"""cart_states.updated_at index
+
+flask gamestore purge-carts deletes anonymous carts by updated_at.
+
+Revision ID: a9d3f6b2e418
+Revises: c4e8a1f7b390
+Create Date: 2026-10-17 18:00:00
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9d3f6b2e418'
+down_revision = 'c4e8a1f7b390'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_cart_states_updated_at', 'cart_states', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('idx_cart_states_updated_at', table_name='cart_states')
@@ -0,0 +1,40 @@
+"""catalog version and server-side carts
+
+Revision ID: b52f0e8a6c47
+Revises: 7d4e2a9c1b35
+Create Date: 2026-10-17 09:10:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b52f0e8a6c47'
+down_revision = '7d4e2a9c1b35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    insp = sa.inspect(op.get_bind())
+    if not insp.has_table('catalog_state'):
+        catalog_state = op.create_table(
+            'catalog_state',
+            sa.Column('id', sa.Integer(), primary_key=True),
+            sa.Column('version', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        op.bulk_insert(catalog_state, [{'id': 1, 'version': 0}])
+    if not insp.has_table('cart_states'):
+        op.create_table(
+            'cart_states',
+            sa.Column('key', sa.String(length=80), primary_key=True),
+            sa.Column('data', sa.Text(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), server_default=sa.func.now(), nullable=True),
+        )
+
+
+def downgrade():
+    op.drop_table('cart_states')
+    op.drop_table('catalog_state')
@@ -0,0 +1,48 @@
+"""background jobs table
+
+Durable queue for gamestore/jobs.py: workers claim rows by status/run_at,
+enqueue() deduplicates on (name, dedupe_key) and purging uses finished_at.
+
+Revision ID: b6c2e7f1a935
+Revises: d81e5a3c7b24
+Create Date: 2026-10-17 14:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6c2e7f1a935'
+down_revision = 'd81e5a3c7b24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'jobs',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(length=80), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=True),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('max_attempts', sa.Integer(), nullable=False, server_default='5'),
+        sa.Column('run_at', sa.DateTime(), nullable=False),
+        sa.Column('locked_by', sa.String(length=120), nullable=True),
+        sa.Column('locked_at', sa.DateTime(), nullable=True),
+        sa.Column('last_error', sa.Text(), nullable=True),
+        sa.Column('dedupe_key', sa.String(length=200), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('idx_jobs_status_run_at', 'jobs', ['status', 'run_at'])
+    op.create_index('idx_jobs_name_dedupe_key', 'jobs', ['name', 'dedupe_key'])
+    op.create_index('idx_jobs_finished_at', 'jobs', ['finished_at'])
+
+
+def downgrade():
+    op.drop_index('idx_jobs_finished_at', table_name='jobs')
+    op.drop_index('idx_jobs_name_dedupe_key', table_name='jobs')
+    op.drop_index('idx_jobs_status_run_at', table_name='jobs')
+    op.drop_table('jobs')
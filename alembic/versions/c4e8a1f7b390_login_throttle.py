@@ -0,0 +1,35 @@
+"""login throttle buckets
+
+Token buckets of gamestore/auth.SqlThrottleStore (LOGIN_THROTTLE_STORE=sql):
+one row per 'ip:...' / 'user:...' key, shared by every web process.
+purge-login-throttle deletes refilled rows by updated_at.
+
+Revision ID: c4e8a1f7b390
+Revises: e2a7c5d9f614
+Create Date: 2026-10-17 16:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1f7b390'
+down_revision = 'e2a7c5d9f614'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'login_throttle',
+        sa.Column('key', sa.String(length=200), primary_key=True),
+        sa.Column('tokens', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.Float(), nullable=False),
+    )
+    op.create_index('idx_login_throttle_updated_at', 'login_throttle', ['updated_at'])
+
+
+def downgrade():
+    op.drop_index('idx_login_throttle_updated_at', table_name='login_throttle')
+    op.drop_table('login_throttle')
@@ -0,0 +1,91 @@
+"""category foreign key and listing/history indexes
+
+Moves products onto ``category_id`` -> categories.id (the ``category`` name is
+kept as a denormalised label for display and full-text search) and adds the
+indexes behind the hot queries:
+
+* products (category_id, id DESC)    -- category pages / API ?category=
+* orders (user_id, created_at DESC)  -- pedidos / perfil
+* order_items (order_id), (product_id)
+
+Index names follow scripts/create_schema_*.sql; existing ones are kept.
+
+Revision ID: c7a1f4d9e203
+Revises: e8c13d6f2a90
+Create Date: 2026-10-17 10:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a1f4d9e203'
+down_revision = 'e8c13d6f2a90'
+branch_labels = None
+depends_on = None
+
+DEFAULT_CATEGORIES = ('Consolas', 'Juegos', 'Accesorios', 'Controles')
+
+INDEXES = [
+    ('idx_products_category_id_id', 'products', ['category_id', sa.text('id DESC')]),
+    ('idx_orders_user_id_created_at', 'orders', ['user_id', sa.text('created_at DESC')]),
+    ('idx_order_items_order_id', 'order_items', ['order_id']),
+    ('idx_order_items_product_id', 'order_items', ['product_id']),
+]
+# superseded by the composite indexes above
+OBSOLETE_INDEXES = [
+    ('idx_products_category', 'products'),
+    ('idx_orders_user_id', 'orders'),
+]
+
+
+def _index_names(insp, table):
+    return {ix['name'] for ix in insp.get_indexes(table)}
+
+
+def upgrade():
+    bind = op.get_bind()
+    insp = sa.inspect(bind)
+
+    categories = sa.table('categories', sa.column('id', sa.Integer), sa.column('name', sa.String))
+    existing = set(bind.execute(sa.select(categories.c.name)).scalars())
+    used = bind.execute(sa.text(
+        "SELECT DISTINCT category FROM products WHERE category IS NOT NULL AND category <> ''")).scalars()
+    missing = [name for name in dict.fromkeys([*DEFAULT_CATEGORIES, *used]) if name not in existing]
+    if missing:
+        op.bulk_insert(categories, [{'name': name} for name in missing])
+
+    if 'category_id' not in {c['name'] for c in insp.get_columns('products')}:
+        if bind.dialect.name == 'sqlite':
+            # ADD COLUMN ... REFERENCES keeps the table (a batch copy would drop the FTS triggers)
+            op.execute(sa.text(
+                'ALTER TABLE products ADD COLUMN category_id INTEGER '
+                'REFERENCES categories (id) ON DELETE SET NULL'))
+        else:
+            op.add_column('products', sa.Column('category_id', sa.Integer(), nullable=True))
+            op.create_foreign_key('fk_products_category_id', 'products', 'categories',
+                                  ['category_id'], ['id'], ondelete='SET NULL')
+    op.execute(sa.text(
+        'UPDATE products SET category_id = '
+        '(SELECT categories.id FROM categories WHERE categories.name = products.category) '
+        'WHERE category_id IS NULL AND category IS NOT NULL'))
+
+    for name, table, columns in INDEXES:
+        if name not in _index_names(insp, table):
+            op.create_index(name, table, columns)
+    for name, table in OBSOLETE_INDEXES:
+        if name in _index_names(insp, table):
+            op.drop_index(name, table_name=table)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
+    if op.get_bind().dialect.name == 'sqlite':
+        # SQLite cannot drop a column used by a foreign key without rebuilding the
+        # table; the column is left in place (upgrade() accepts it as existing).
+        pass
+    else:
+        op.drop_constraint('fk_products_category_id', 'products', type_='foreignkey')
+        op.drop_column('products', 'category_id')
@@ -0,0 +1,43 @@
+"""payment pipeline columns
+
+Adds what the asynchronous payment worker (gamestore/payments.py) records:
+the gateway reference, the failure reason and timestamps, plus the
+payments(order_id) index used by the status endpoint.
+
+Revision ID: d81e5a3c7b24
+Revises: f3b9e1c4a872
+Create Date: 2026-10-17 13:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd81e5a3c7b24'
+down_revision = 'f3b9e1c4a872'
+branch_labels = None
+depends_on = None
+
+COLUMNS = [
+    sa.Column('gateway_ref', sa.String(length=120), nullable=True),
+    sa.Column('error', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+]
+
+
+def upgrade():
+    insp = sa.inspect(op.get_bind())
+    existing = {c['name'] for c in insp.get_columns('payments')}
+    for column in COLUMNS:
+        if column.name not in existing:
+            op.add_column('payments', column)
+    if 'idx_payments_order_id' not in {ix['name'] for ix in insp.get_indexes('payments')}:
+        op.create_index('idx_payments_order_id', 'payments', ['order_id'])
+
+
+def downgrade():
+    op.drop_index('idx_payments_order_id', table_name='payments')
+    for column in reversed(COLUMNS):
+        op.execute(sa.text(f'ALTER TABLE payments DROP COLUMN {column.name}'))
@@ -0,0 +1,31 @@
+"""products.sku for catalog imports
+
+Supplier catalogs identify products by SKU, not by our ids; the unique
+index lets bulk imports upsert on it (ON CONFLICT (sku)). Existing products
+keep a NULL sku, which the unique index allows any number of times.
+
+Revision ID: e2a7c5d9f614
+Revises: b6c2e7f1a935
+Create Date: 2026-10-17 15:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2a7c5d9f614'
+down_revision = 'b6c2e7f1a935'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # plain ADD COLUMN: a batch rebuild of products would drop the FTS triggers
+    op.add_column('products', sa.Column('sku', sa.String(length=64), nullable=True))
+    op.create_index('uq_products_sku', 'products', ['sku'], unique=True)
+
+
+def downgrade():
+    op.drop_index('uq_products_sku', table_name='products')
+    op.execute(sa.text('ALTER TABLE products DROP COLUMN sku'))
@@ -0,0 +1,26 @@
+"""payments(status, updated_at) index
+
+The job worker looks for unfinished (pending/authorised) payments every
+minute to expire them or queue them again.
+
+Revision ID: e2b7c9d4a615
+Revises: a9d3f6b2e418
+Create Date: 2026-10-17 19:00:00
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2b7c9d4a615'
+down_revision = 'a9d3f6b2e418'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('idx_payments_status_updated_at', 'payments', ['status', 'updated_at'])
+
+
+def downgrade():
+    op.drop_index('idx_payments_status_updated_at', table_name='payments')
@@ -0,0 +1,88 @@
+"""full-text product search index
+
+SQLite: FTS5 external-content table kept in sync by triggers (skipped when
+SQLite is built without FTS5).
+PostgreSQL: generated tsvector column (Spanish, unaccented) with a GIN index.
+Must match the queries in gamestore/search.py.
+
+Revision ID: e8c13d6f2a90
+Revises: b52f0e8a6c47
+Create Date: 2026-10-17 09:15:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8c13d6f2a90'
+down_revision = 'b52f0e8a6c47'
+branch_labels = None
+depends_on = None
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+    "title, category, content='products', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+    "INSERT INTO products_fts(rowid, title, category) VALUES (new.id, new.title, new.category); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, title, category) "
+    "VALUES ('delete', old.id, old.title, old.category); END",
+    "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF title, category ON products BEGIN "
+    "INSERT INTO products_fts(products_fts, rowid, title, category) "
+    "VALUES ('delete', old.id, old.title, old.category); "
+    "INSERT INTO products_fts(rowid, title, category) VALUES (new.id, new.title, new.category); END",
+    "INSERT INTO products_fts(products_fts) VALUES ('rebuild')",
+]
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS products_fts_au",
+    "DROP TRIGGER IF EXISTS products_fts_ad",
+    "DROP TRIGGER IF EXISTS products_fts_ai",
+    "DROP TABLE IF EXISTS products_fts",
+]
+# Postgres has no accent-stripping function without the unaccent extension;
+# translate() is immutable, so it can be used in a generated column.
+POSTGRES_UPGRADE = [
+    "ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector "
+    "GENERATED ALWAYS AS (to_tsvector('spanish', translate(lower("
+    "coalesce(title, '') || ' ' || coalesce(category, '')), "
+    "'áàâäãéèêëíìîïóòôöõúùûüñç', 'aaaaaeeeeiiiiooooouuuunc'))) STORED",
+    "CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector)",
+]
+POSTGRES_DOWNGRADE = [
+    "DROP INDEX IF EXISTS idx_products_search",
+    "ALTER TABLE products DROP COLUMN IF EXISTS search_vector",
+]
+
+
+def _run(statements):
+    for stmt in statements:
+        op.execute(sa.text(stmt))
+
+
+def _sqlite_has_fts5():
+    try:
+        op.execute(sa.text('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)'))
+        op.execute(sa.text('DROP TABLE temp._fts5_probe'))
+        return True
+    except Exception:
+        return False
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # without FTS5 the app falls back to LIKE search (gamestore.search.LikeSearch)
+        if _sqlite_has_fts5():
+            _run(SQLITE_UPGRADE)
+    elif dialect == 'postgresql':
+        _run(POSTGRES_UPGRADE)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        _run(SQLITE_DOWNGRADE)
+    elif dialect == 'postgresql':
+        _run(POSTGRES_DOWNGRADE)
@@ -0,0 +1,41 @@
+"""product stock and checkout idempotency keys
+
+products.stock is nullable: NULL means the product's inventory is not
+tracked, so existing products stay sellable after the upgrade.
+
+Revision ID: f3b9e1c4a872
+Revises: a4f2d8c61e57
+Create Date: 2026-10-17 12:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9e1c4a872'
+down_revision = 'a4f2d8c61e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # plain ADD COLUMN: a batch rebuild of products would drop the FTS triggers
+    op.add_column('products', sa.Column('stock', sa.Integer(), nullable=True))
+    op.create_table(
+        'idempotency_keys',
+        sa.Column('scope', sa.String(length=80), primary_key=True),
+        sa.Column('key', sa.String(length=100), primary_key=True),
+        sa.Column('order_id', sa.Integer(), nullable=True),
+        sa.Column('status_code', sa.Integer(), nullable=False, server_default='200'),
+        sa.Column('response', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_idempotency_keys_created_at', 'idempotency_keys', ['created_at'])
+
+
+def downgrade():
+    op.drop_index('ix_idempotency_keys_created_at', table_name='idempotency_keys')
+    op.drop_table('idempotency_keys')
+    # plain DROP COLUMN (SQLite >= 3.35) for the same reason as above
+    op.execute(sa.text('ALTER TABLE products DROP COLUMN stock'))
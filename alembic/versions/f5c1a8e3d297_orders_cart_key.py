@@ -0,0 +1,28 @@
+"""orders.cart_key
+
+The cart an order was placed from ('user:<id>' or 'anon:<token>'), so a
+declined or expired payment can put the order's lines back in it.
+
+Revision ID: f5c1a8e3d297
+Revises: e2b7c9d4a615
+Create Date: 2026-10-17 20:00:00
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f5c1a8e3d297'
+down_revision = 'e2b7c9d4a615'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    if 'cart_key' not in {c['name'] for c in sa.inspect(op.get_bind()).get_columns('orders')}:
+        op.add_column('orders', sa.Column('cart_key', sa.String(length=80), nullable=True))
+
+
+def downgrade():
+    op.execute(sa.text('ALTER TABLE orders DROP COLUMN cart_key'))
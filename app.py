@@ -1,9 +1,27 @@
-from flask import Flask, render_template, send_from_directory, jsonify, request, abort, redirect, url_for, session, flash, get_flashed_messages
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, send_from_directory, jsonify, request, abort, redirect, url_for, session, flash, get_flashed_messages, Response, stream_with_context, g, make_response, request_started
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
+import click
+from flask.cli import AppGroup
 from flask_sqlalchemy import SQLAlchemy
 import os
-from sqlalchemy.exc import OperationalError, IntegrityError
+import json
+import time
+import threading
+import base64
+from datetime import date, datetime, timedelta
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
+from gamestore.image_store import ImageStore, extension_for, parse_name
+from gamestore import image_variants, search, db_config, schema
+from gamestore.reporting import SalesRollup, GRANULARITIES
+from gamestore import payments, jobs, bulk, auth, metrics
+from gamestore.query_profiler import QueryProfiler
+from gamestore.cart_store import MemoryCartStore, SqlCartStore, empty_state, merge_states
+from gamestore.fragment_cache import FragmentCache
+from gamestore.http_cache import weak_etag, not_modified, set_cache_headers
+from markupsafe import Markup
 
 # Configuración de Flask con carpetas existentes
 app = Flask(__name__, template_folder=os.path.join('app', 'templates'), static_folder=os.path.join('app', 'static'))
@@ -17,8 +35,52 @@ default_sqlite = f'sqlite:///{db_path}'
 DATABASE_URL = os.environ.get('DATABASE_URL') or default_sqlite
 app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-db = SQLAlchemy(app)
+# Pool, timeouts y pragmas de SQLite configurables por entorno (ver gamestore/db_config.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_config.engine_options(DATABASE_URL)
+
+# La extensión se enlaza en init_extensions() (al final del módulo). Importar este módulo
+# no abre conexiones ni consulta la base de datos: alembic, los scripts, los
+# comandos CLI y cada proceso worker lo importan.
+db = SQLAlchemy()
+
+# El esquema lo gestionan las migraciones de Alembic (alembic/versions). Cada proceso
+# lo comprueba en su primera petición pero nunca migra: mientras esté atrasado responde
+# 503 (también /readyz). Migra una sola vez "flask --app app gamestore init-db" (paso
+# del despliegue) o, con SCHEMA_AUTO_UPGRADE=1 (por defecto en SQLite), el master de
+# gunicorn al arrancar (gunicorn.conf.py) y python app.py.
+# SCHEMA_CHECK=0 omite la comprobación (p. ej. cuando el despliegue ya migró).
+app.config['SCHEMA_CHECK'] = os.environ.get('SCHEMA_CHECK', '1') == '1'
+app.config['SCHEMA_AUTO_UPGRADE'] = os.environ.get(
+    'SCHEMA_AUTO_UPGRADE', '1' if DATABASE_URL.startswith('sqlite') else '0') == '1'
+
+# Imágenes de productos: almacén en disco direccionado por contenido (sha256).
+# Se puede mover a un volumen compartido con IMAGE_STORE_DIR.
+app.config['IMAGE_STORE_DIR'] = os.environ.get('IMAGE_STORE_DIR') or os.path.join(os.path.dirname(__file__), 'instance', 'images')
+image_store = ImageStore(app.config['IMAGE_STORE_DIR'])
+# Las variantes redimensionadas (thumb/card/detail) las genera el job 'images.variants'.
+
+# Búsqueda de productos: FTS5 en SQLite, tsvector + GIN en Postgres (ver gamestore/search.py)
+app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', '24'))
+_search_index = None
+
+# Historial de pedidos paginado (pedidos y perfil)
+app.config['ORDER_HISTORY_PAGE_SIZE'] = int(os.environ.get('ORDER_HISTORY_PAGE_SIZE', '20'))
+
+
+# Caché de fragmentos HTML del catálogo (grids de inicio/categorías y búsquedas).
+# Se invalida desde las rutas que modifican productos (catalog_changed).
+fragment_cache = FragmentCache(
+    max_entries=int(os.environ.get('FRAGMENT_CACHE_SIZE', '256')),
+    ttl=int(os.environ.get('FRAGMENT_CACHE_TTL', '300')),
+)
+
+
+def get_search_index():
+    """Search backend for the configured database (created on first use)."""
+    global _search_index
+    if _search_index is None:
+        _search_index = search.for_database(db)
+    return _search_index
 
 
 # Simple CSRF helpers (no external deps)
@@ -63,23 +125,58 @@ class Product(db.Model):
     __tablename__ = 'products'
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
+    # supplier SKU (optional, unique): key for catalog imports (gamestore/bulk.py)
+    sku = db.Column(db.String(64), nullable=True)
     price = db.Column(db.Float, nullable=False)
     img = db.Column(db.String(400), nullable=True)
-    # binary image stored in DB (optional)
-    image_data = db.Column(db.LargeBinary, nullable=True)
+    # legacy binary image stored in DB; deferred so listing queries never load it.
+    # New uploads go to the image store (see migrate_product_blobs_to_store).
+    image_data = db.deferred(db.Column(db.LargeBinary, nullable=True))
     image_mime = db.Column(db.String(120), nullable=True)
-    # category (simple string for now)
+    # sha256 of the image in the on-disk image store
+    image_hash = db.Column(db.String(64), nullable=True)
+    # category name: denormalised copy of categories.name kept for display and
+    # full-text search; filters go through category_id (see _sync_category_id)
     category = db.Column(db.String(120), nullable=True)
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id', ondelete='SET NULL'), nullable=True)
+    # units available; NULL = not tracked (never runs out). Checkout decrements it
+    # with a conditional UPDATE (reserve_stock), so concurrent buyers cannot oversell.
+    stock = db.Column(db.Integer, nullable=True)
+    # last change, used as Last-Modified/ETag validator by the API
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     def to_dict(self):
         return {
             'id': self.id,
+            'sku': self.sku,
             'title': self.title,
             'price': self.price,
             'img': self.img,
-            'image_url': url_for('product_image', pid=self.id) if self.image_data else (self.img or None)
+            'image_url': api_image_url(self.image_hash, self.image_mime, self.img),
+            'category': self.category,
+            'stock': self.stock,
         }
 
+    @property
+    def image_url(self):
+        """Cache-friendly URL for the product image (immutable when stored by hash)."""
+        if self.image_hash:
+            return url_for('image_file', name=f'{self.image_hash}.{extension_for(self.image_mime)}')
+        return self.img or url_for('static', filename='img/Imagenes/placeholder.svg')
+
+    def variant_url(self, size, fmt='jpg'):
+        """URL of a resized variant ('thumb', 'card', 'detail') in 'webp' or 'jpg'."""
+        if self.image_hash:
+            return url_for('image_file', name=f'{self.image_hash}_{size}.{fmt}')
+        return self.image_url
+
+
+def api_image_url(image_hash, image_mime, img):
+    """Image URL as exposed by the JSON API (None when the product has no image)."""
+    if image_hash:
+        return url_for('image_file', name=f'{image_hash}.{extension_for(image_mime)}')
+    return img or None
+
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -89,10 +186,11 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # hashing runs on the bounded pool of gamestore/auth.py (may raise auth.HasherBusy)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return password_hasher.verify(self.password_hash, password)
 
 
 # Additional models for the project: categories, product_images, orders, order_items, payments
@@ -116,6 +214,8 @@ class Order(db.Model):
     total = db.Column(db.Float, default=0.0)
     status = db.Column(db.String(50), default='pending')
     created_at = db.Column(db.DateTime, server_default=db.func.now())
+    # cart the order came from: a failed payment puts the lines back in it (payment_finished)
+    cart_key = db.Column(db.String(80))
     # relationship for convenience
     order_items = db.relationship('OrderItem', backref='order', cascade='all, delete-orphan', lazy='select')
 
@@ -127,8 +227,8 @@ class OrderItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='SET NULL'))
     quantity = db.Column(db.Integer, default=1)
     price = db.Column(db.Float, default=0.0)
-    # convenience relation to product
-    product = db.relationship('Product', backref='order_items', lazy='joined')
+    # convenience relation to product; loaded on demand (order_history() batches it)
+    product = db.relationship('Product', backref='order_items', lazy='select')
 
 
 class Payment(db.Model):
@@ -138,35 +238,468 @@ class Payment(db.Model):
     amount = db.Column(db.Float, nullable=False)
     method = db.Column(db.String(80))
     status = db.Column(db.String(50), default='pending')
+    # pending -> authorised -> captured/failed (gamestore/payments.py)
+    gateway_ref = db.Column(db.String(120))
+    error = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# Índices de las consultas de listado e historial (migración c7a1f4d9e203)
+db.Index('idx_products_category_id_id', Product.category_id, Product.id.desc())
+db.Index('uq_products_sku', Product.sku, unique=True)
+db.Index('idx_orders_user_id_created_at', Order.user_id, Order.created_at.desc())
+db.Index('idx_order_items_order_id', OrderItem.order_id)
+db.Index('idx_order_items_product_id', OrderItem.product_id)
+db.Index('idx_payments_order_id', Payment.order_id)
+# Pagos sin terminar que el worker expira o vuelve a encolar (migración e2b7c9d4a615)
+db.Index('idx_payments_status_updated_at', Payment.status, Payment.updated_at)
+
+
+def category_id_for(connection, name):
+    """Id of the Category called ``name``, created on first use."""
+    categories = Category.__table__
+    cid = connection.execute(db.select(categories.c.id).where(categories.c.name == name)).scalar()
+    if cid is None:
+        cid = connection.execute(db.insert(categories).values(name=name)).inserted_primary_key[0]
+    return cid
+
+
+@event.listens_for(Product, 'before_insert')
+@event.listens_for(Product, 'before_update')
+def _sync_category_id(mapper, connection, target):
+    # every ORM write path sets the category by name; keep the FK in step with it
+    if target.category_id is not None and not inspect(target).attrs.category.history.has_changes():
+        return
+    target.category_id = category_id_for(connection, target.category) if target.category else None
+
+
+def in_category(name):
+    """Filter on products in the category called ``name`` (uses idx_products_category_id_id)."""
+    return Product.category_id == db.select(Category.id).where(Category.name == name).scalar_subquery()
+
+
+def in_categories_like(fragment):
+    """Filter on products whose category name contains ``fragment`` (any case)."""
+    return Product.category_id.in_(db.select(Category.id).where(Category.name.ilike(f'%{fragment}%')))
+
+
+class CatalogState(db.Model):
+    """Single-row table holding the global catalog version.
+
+    Bumped by every product write (catalog_changed) and shared by all worker
+    processes; used for HTTP validators and to invalidate cached fragments.
+    """
+    __tablename__ = 'catalog_state'
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+
+
+class CartState(db.Model):
+    """Server-side cart/favorites document (see gamestore/cart_store.py)."""
+    __tablename__ = 'cart_states'
+    # 'user:<id>' for logged-in users, 'anon:<token>' for anonymous visitors
+    key = db.Column(db.String(80), primary_key=True)
+    data = db.Column(db.Text, nullable=False, default='{}')
+    updated_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
+# purge-carts borra los carritos anónimos por antigüedad
+db.Index('idx_cart_states_updated_at', CartState.updated_at)
+
+
+class IdempotencyKey(db.Model):
+    """Result of a checkout submitted with an Idempotency-Key.
+
+    The row is written in the same transaction as the order, so a repeated
+    submit (double click, client retry) either waits for the first one and
+    replays its response or, if the first failed, runs normally.
+    """
+    __tablename__ = 'idempotency_keys'
+    # cart key of the visitor ('user:<id>' / 'anon:<token>'): keys are per client
+    scope = db.Column(db.String(80), primary_key=True)
+    key = db.Column(db.String(100), primary_key=True)
+    order_id = db.Column(db.Integer, nullable=True)
+    status_code = db.Column(db.Integer, nullable=False, default=200)
+    response = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+class Job(db.Model):
+    """Background job (gamestore/jobs.py): queued -> running -> done/dead."""
+    __tablename__ = 'jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(80), nullable=False)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(120))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    dedupe_key = db.Column(db.String(200))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+
+db.Index('idx_jobs_status_run_at', Job.status, Job.run_at)
+db.Index('idx_jobs_name_dedupe_key', Job.name, Job.dedupe_key)
+db.Index('idx_jobs_finished_at', Job.finished_at)
+
+
+# Resúmenes de ventas precalculados para reportes y dashboard (gamestore/reporting.py).
+# Los actualiza el job 'sales.record_order', encolado cuando se captura el pago del pedido.
+class SalesDaily(db.Model):
+    __tablename__ = 'sales_daily'
+    day = db.Column(db.Date, primary_key=True)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class SalesProductDaily(db.Model):
+    __tablename__ = 'sales_product_daily'
+    day = db.Column(db.Date, primary_key=True)
+    # no FK: the figures survive deleting the product
+    product_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class SalesCategoryDaily(db.Model):
+    __tablename__ = 'sales_category_daily'
+    day = db.Column(db.Date, primary_key=True)
+    category_id = db.Column(db.Integer, primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+
+
+# Carrito y favoritos en el servidor; la cookie solo guarda un id opaco.
+# CART_STORE=sql (por defecto, compartido y persistente) o memory (LRU en proceso).
+app.config['CART_STORE'] = os.environ.get('CART_STORE', 'sql')
+if app.config['CART_STORE'] == 'memory':
+    cart_store = MemoryCartStore(max_entries=int(os.environ.get('CART_STORE_MAX_ENTRIES', '10000')))
+else:
+    cart_store = SqlCartStore(db, CartState)
+
+sales_rollup = SalesRollup(db, SalesDaily, SalesProductDaily, SalesCategoryDaily)
+
+
+class LoginThrottleState(db.Model):
+    """Token bucket of the login throttle when LOGIN_THROTTLE_STORE=sql (see gamestore/auth.py)."""
+    __tablename__ = 'login_throttle'
+    # 'ip:<address>' o 'user:<username>'
+    key = db.Column(db.String(200), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # epoch seconds
+
+
+db.Index('idx_login_throttle_updated_at', LoginThrottleState.updated_at)
+
+# Autenticación (gamestore/auth.py): los hashes de contraseñas se calculan en un pool
+# acotado (PASSWORD_HASH_WORKERS hilos o procesos, PASSWORD_HASH_QUEUE en espera; si
+# está lleno el login responde 503) y los intentos se limitan por IP y por usuario con
+# token buckets (ráfaga + intentos por minuto). LOGIN_THROTTLE_STORE=memory (por
+# proceso) o sql (compartido entre procesos y máquinas).
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', '2'))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', '8'))
+app.config['PASSWORD_HASH_POOL'] = os.environ.get('PASSWORD_HASH_POOL', 'thread')
+app.config['LOGIN_THROTTLE_STORE'] = os.environ.get('LOGIN_THROTTLE_STORE', 'memory')
+app.config['LOGIN_USER_BURST'] = int(os.environ.get('LOGIN_USER_BURST', '5'))
+app.config['LOGIN_USER_PER_MINUTE'] = float(os.environ.get('LOGIN_USER_PER_MINUTE', '5'))
+app.config['LOGIN_IP_BURST'] = int(os.environ.get('LOGIN_IP_BURST', '20'))
+app.config['LOGIN_IP_PER_MINUTE'] = float(os.environ.get('LOGIN_IP_PER_MINUTE', '30'))
+# Detrás de N proxies de confianza la IP del cliente viene en X-Forwarded-For
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', '0'))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'],
+                            x_proto=app.config['TRUSTED_PROXIES'])
+
+# Métricas en formato Prometheus en /metrics (gamestore/metrics.py). Con varios workers
+# (gunicorn) cada proceso escribe sus números en METRICS_MULTIPROC_DIR y /metrics los suma.
+# METRICS_TOKEN: si se define, /metrics exige "Authorization: Bearer <token>".
+app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+app.config['METRICS_MULTIPROC_DIR'] = os.environ.get('METRICS_MULTIPROC_DIR') or None
+app.config['METRICS_FLUSH_SECONDS'] = float(os.environ.get('METRICS_FLUSH_SECONDS', '5'))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None
+request_metrics = metrics.RequestMetrics(
+    enabled=app.config['METRICS_ENABLED'],
+    multiproc_dir=app.config['METRICS_MULTIPROC_DIR'],
+    flush_seconds=app.config['METRICS_FLUSH_SECONDS'],
+)
+app.wsgi_app = request_metrics.middleware(app.wsgi_app)
+
+
+# Perfilador de consultas para desarrollo y staging (gamestore/query_profiler.py):
+# registra en el logger gamestore.sql las consultas lentas (con su EXPLAIN) y las
+# sentencias repetidas en una misma petición (N+1). QUERY_BUDGET: máximo de sentencias
+# por petición (0 = sin límite); con QUERY_BUDGET_RAISE=1 superarlo es un error (tests).
+# QUERY_DEBUG_HEADERS añade X-DB-Queries y X-DB-Time (ms) a cada respuesta.
+app.config['QUERY_PROFILER'] = os.environ.get('QUERY_PROFILER', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', '100'))
+app.config['SLOW_QUERY_EXPLAIN'] = os.environ.get('SLOW_QUERY_EXPLAIN', '1') == '1'
+app.config['N_PLUS_ONE_THRESHOLD'] = int(os.environ.get('N_PLUS_ONE_THRESHOLD', '5'))
+app.config['QUERY_BUDGET'] = int(os.environ.get('QUERY_BUDGET', '0'))
+app.config['QUERY_BUDGET_RAISE'] = os.environ.get('QUERY_BUDGET_RAISE', '0') == '1'
+app.config['QUERY_DEBUG_HEADERS'] = os.environ.get('QUERY_DEBUG_HEADERS', '1') == '1'
+query_profiler = QueryProfiler(
+    slow_ms=app.config['SLOW_QUERY_MS'],
+    explain=app.config['SLOW_QUERY_EXPLAIN'],
+    n_plus_one=app.config['N_PLUS_ONE_THRESHOLD'],
+    request_budget=app.config['QUERY_BUDGET'],
+    raise_on_budget=app.config['QUERY_BUDGET_RAISE'],
+)
+
+
+@request_started.connect_via(app)
+def on_request_started(sender, **extra):
+    # la URL ya está resuelta: las métricas se agrupan por endpoint de Flask
+    request_metrics.label(request.endpoint)
+    if app.config['QUERY_PROFILER']:
+        query_profiler.begin(f'{request.method} {request.endpoint or request.path}')
+
+
+@app.after_request
+def query_profiler_headers(response):
+    if app.config['QUERY_PROFILER']:
+        queries, seconds = query_profiler.end()
+        if app.config['QUERY_DEBUG_HEADERS']:
+            response.headers['X-DB-Queries'] = str(queries)
+            response.headers['X-DB-Time'] = f'{seconds * 1000:.1f}'
+    return response
+
+password_hasher = auth.PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_queue=app.config['PASSWORD_HASH_QUEUE'],
+    pool=app.config['PASSWORD_HASH_POOL'],
+)
+login_throttle = auth.LoginThrottle(
+    auth.SqlThrottleStore(db, LoginThrottleState) if app.config['LOGIN_THROTTLE_STORE'] == 'sql'
+    else auth.MemoryThrottleStore(),
+    per_user=auth.Bucket.per_minute(app.config['LOGIN_USER_BURST'], app.config['LOGIN_USER_PER_MINUTE']),
+    per_ip=auth.Bucket.per_minute(app.config['LOGIN_IP_BURST'], app.config['LOGIN_IP_PER_MINUTE']),
+)
+
+
+# Pagos asíncronos: el checkout solo crea el pago 'pending' y encola el job
+# payments.process, que lo pasa por la pasarela (PAYMENT_GATEWAY=fake o
+# 'modulo:Clase') en los hilos del worker de jobs; el navegador consulta
+# /payments/<id> (long-poll hasta PAYMENT_POLL_MAX_WAIT segundos). Los pagos sin
+# terminar tras PAYMENT_EXPIRE_MINUTES se dan por fallidos y devuelven el stock.
+app.config['PAYMENT_GATEWAY'] = os.environ.get('PAYMENT_GATEWAY', 'fake')
+app.config['PAYMENT_POLL_MAX_WAIT'] = float(os.environ.get('PAYMENT_POLL_MAX_WAIT', '20'))
+app.config['PAYMENT_EXPIRE_MINUTES'] = float(os.environ.get('PAYMENT_EXPIRE_MINUTES', '30'))
+
+
+def payment_finished(payment):
+    """Worker callback: mark the order paid (and count the sale), or undo it when the payment failed.
+
+    Undoing releases the stock and puts the lines back in the cart the order
+    came from, so the customer can try again.
+    """
+    order = db.session.get(Order, payment.order_id) if payment.order_id else None
+    if order is None:
+        return
+    if payment.status == payments.CAPTURED:
+        order.status = 'paid'
+        # only captured payments are sales; the job commits with this transaction
+        lines = db.session.execute(
+            db.select(OrderItem.product_id, Product.category_id, OrderItem.quantity, OrderItem.price)
+            .outerjoin(Product, Product.id == OrderItem.product_id)
+            .where(OrderItem.order_id == order.id)).all()
+        job_queue.enqueue('sales.record_order', {'day': order.created_at.date().isoformat(), 'lines': [
+            {'product_id': pid, 'category_id': cid, 'qty': qty, 'price': price} for pid, cid, qty, price in lines
+        ]})
+        return
+    order.status = 'payment_failed'
+    if order.cart_key:
+        # give the lines back so the customer can try again (checkout emptied the cart)
+        state = cart_store.load(order.cart_key) or empty_state()
+        merge_states(state, {'cart': {str(item.product_id): item.quantity
+                                      for item in order.order_items if item.product_id}})
+        cart_store.save(order.cart_key, state)
+    released = 0
+    for item in order.order_items:
+        released += db.session.execute(
+            db.update(Product)
+            .where(Product.id == item.product_id, Product.stock.isnot(None))
+            .values(stock=Product.stock + item.quantity)
+            .execution_options(synchronize_session=False)).rowcount
+    if released:
+        # stock is part of the catalog (/api/products ETag)
+        catalog_changed(commit=False)
+
+
+payment_processor = payments.PaymentProcessor(
+    app, db, Payment, payments.gateway_from_config(app.config['PAYMENT_GATEWAY'], os.environ),
+    on_final=payment_finished)
+
+
+# Cola de trabajos en la tabla jobs (gamestore/jobs.py): las rutas encolan en su
+# transacción y responden; los ejecuta "flask gamestore worker" (proceso aparte)
+# o, con JOB_EMBEDDED_WORKER=1 (por defecto en SQLite), un hilo del servidor web.
+app.config['JOB_WORKER_THREADS'] = int(os.environ.get('JOB_WORKER_THREADS', '4'))
+app.config['JOB_POLL_INTERVAL'] = float(os.environ.get('JOB_POLL_INTERVAL', '1.0'))
+app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+app.config['JOB_EMBEDDED_WORKER'] = os.environ.get(
+    'JOB_EMBEDDED_WORKER', '1' if DATABASE_URL.startswith('sqlite') else '0') == '1'
+job_queue = jobs.JobQueue(db, Job, max_attempts=app.config['JOB_MAX_ATTEMPTS'],
+                          visibility_timeout=int(os.environ.get('JOB_VISIBILITY_TIMEOUT', '300')))
+
+
+@job_queue.task('sales.record_order')
+def record_order_job(payload):
+    # same transaction as marking the job done: each order is counted exactly once
+    sales_rollup.record_order(date.fromisoformat(payload['day']), payload['lines'])
+
+
+@job_queue.task('payments.process')
+def process_payment_job(payload):
+    # gateway errors raise: the job is retried with backoff (expire_payments is the backstop)
+    payment_processor.process(payload['payment_id'], payload.get('details'))
+
+
+def recover_payments():
+    """Fail payments unfinished for PAYMENT_EXPIRE_MINUTES and queue the rest again.
+
+    Runs when a job worker starts and then every minute in it. A payment whose
+    job is still queued or running is skipped (dedupe key); the others (the job
+    died, e.g. with max attempts) get a new one, without the card details.
+    Returns (expired, requeued).
+    """
+    now = datetime.utcnow()
+    expired = payment_processor.expire(now - timedelta(minutes=app.config['PAYMENT_EXPIRE_MINUTES']))
+    requeued = 0
+    for payment_id in payment_processor.unfinished(updated_before=now - timedelta(minutes=1)):
+        requeued += job_queue.enqueue('payments.process', {'payment_id': payment_id},
+                                      dedupe_key=f'payment:{payment_id}') is not None
+    db.session.commit()
+    if requeued:
+        app.logger.warning('%d unfinished payments queued again', requeued)
+    return expired, requeued
+
+
+@job_queue.task('sales.rebuild')
+def rebuild_sales_job(payload):
+    start, end = payload.get('start'), payload.get('end')
+    sales_rollup.rebuild(Order.__table__, OrderItem.__table__, Product.__table__,
+                         start=date.fromisoformat(start) if start else None,
+                         end=date.fromisoformat(end) if end else None)
+
+
+@job_queue.task('images.variants')
+def image_variants_job(payload):
+    image_variants.render_variants(image_store, payload['digest'], payload['ext'])
+
+
+@job_queue.task('images.migrate_blobs')
+def migrate_blobs_job(payload):
+    migrate_product_blobs_to_store()
+
+
+@job_queue.task('images.fix_paths')
+def fix_image_paths_job(payload):
+    fix_product_images_on_disk()
 
 
-def init_db_and_seed():
-    # Asegura que las tablas existan y agrega algunos productos de ejemplo si la tabla está vacía
-    db.create_all()
+def enqueue_image_variants(digest, mime):
+    """Queue variant rendering for a stored original (caller commits)."""
+    if image_variants.available():
+        job_queue.enqueue('images.variants', {'digest': digest, 'ext': extension_for(mime)}, dedupe_key=digest)
+
+
+_embedded_worker = {'thread': None}
+_startup = {'done': False}
+_startup_lock = threading.Lock()
+# Las sondas del balanceador no disparan la inicialización (ver /healthz y /readyz)
+PROBE_ENDPOINTS = ('healthz', 'readyz', 'metrics')
+
+
+@app.before_request
+def init_on_first_request():
+    # Inicialización perezosa, una vez por proceso: comprobar el esquema y arrancar el
+    # worker de jobs embebido. Los comandos CLI, alembic y los scripts nunca lo hacen.
+    if _startup['done'] or request.endpoint in PROBE_ENDPOINTS:
+        return
+    with _startup_lock:
+        if _startup['done']:
+            return
+        if not ensure_schema():
+            # an outdated schema is never served; checked again on the next request
+            resp = Response('Service unavailable: the database schema is not up to date.\n', status=503,
+                            mimetype='text/plain')
+            resp.headers['Retry-After'] = '5'
+            return resp
+        if app.config['JOB_EMBEDDED_WORKER']:
+            worker = jobs.Worker(app, job_queue, threads=app.config['JOB_WORKER_THREADS'],
+                                 poll_interval=app.config['JOB_POLL_INTERVAL'], periodic=(recover_payments,))
+            _embedded_worker['worker'] = worker
+            _embedded_worker['thread'] = worker.start_in_background()
+        _startup['done'] = True
+
+
+def shutdown_background(timeout=10.0):
+    """Stop the embedded job worker, letting running jobs (payments) finish (server worker exit)."""
+    worker, thread = _embedded_worker.get('worker'), _embedded_worker.get('thread')
+    if worker is not None:
+        worker.stop()
+        thread.join(timeout)
+    password_hasher.shutdown()
+    request_metrics.flush()
+
+
+def ensure_schema():
+    """True once the schema is at the Alembic head (cached then).
+
+    Never upgrades: several worker processes would race on the migration.
+    init_db() does it, once, before the server starts.
+    """
+    if not app.config['SCHEMA_CHECK']:
+        return True
     try:
-        count = Product.query.count()
-    except Exception:
-        count = 0
+        schema.check_schema(db.engine)
+    except schema.SchemaNotReady as e:
+        app.logger.error('%s', e)
+        return False
+    return True
+
+
+def init_db():
+    """Upgrade the schema to the Alembic head and create the rows the app needs (gamestore init-db)."""
+    status = schema.check_schema(db.engine, upgrade=True)
+    if db.session.get(CatalogState, 1) is None:
+        db.session.add(CatalogState(id=1, version=0))
+        db.session.commit()
+    queue_blob_migration()
+    return status
+
 
-    if count == 0:
+def seed_sample_data():
+    """Sample products and an admin/admin user when those tables are empty (gamestore seed)."""
+    added = {'products': 0, 'users': 0}
+    if db.session.query(Product.id).first() is None:
         sample = [
             Product(title='XBOX SERIES X 2TB', price=17000, img='/static/img/Imagenes/series x especial.png'),
             Product(title='ZOMBIES GAME', price=450, img='/static/img/Imagenes/gta6.png'),
             Product(title='AUDÍFONOS GAMER', price=760, img='/static/img/Imagenes/Audifonos_Gamer.jpg')
         ]
         db.session.add_all(sample)
-        db.session.commit()
+        added['products'] = len(sample)
     # Ensure there's at least one user (development convenience). Create an admin if no users exist.
-    try:
-        ucount = User.query.count()
-    except Exception:
-        ucount = 0
-    if ucount == 0:
+    if db.session.query(User.id).first() is None:
         admin = User(username='admin')
         admin.set_password('admin')
         admin.is_admin = True
         db.session.add(admin)
-        db.session.commit()
+        added['users'] = 1
+    db.session.commit()
+    if added['products']:
+        catalog_changed()
+    return added
 
 
 def fix_product_images_on_disk():
@@ -201,23 +734,198 @@ def fix_product_images_on_disk():
         db.session.commit()
 
 
+def migrate_product_blobs_to_store(batch_size=20):
+    """Move legacy Product.image_data blobs into the on-disk image store.
+
+    Works in small batches so only a few blobs are in memory at a time.
+    """
+    moved = 0
+    while True:
+        rows = (db.session.query(Product.id, Product.image_data, Product.image_mime)
+                .filter(Product.image_data.isnot(None))
+                .order_by(Product.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            break
+        for pid, data, mime in rows:
+            digest = image_store.put(data, mime)
+            enqueue_image_variants(digest, mime)
+            Product.query.filter_by(id=pid).update({'image_hash': digest, 'image_data': None}, synchronize_session=False)
+        db.session.commit()
+        moved += len(rows)
+    if moved:
+        app.logger.info('Moved %d product images to the image store', moved)
+    return moved
+
+
+def queue_blob_migration():
+    """Hand legacy image blobs to the 'images.migrate_blobs' job instead of moving them at startup."""
+    if db.session.query(Product.id).filter(Product.image_data.isnot(None)).first() is None:
+        return
+    job_queue.enqueue('images.migrate_blobs', dedupe_key='all')
+    db.session.commit()
+
+
 @app.route('/')
 def root():
     # Renderiza la plantilla Jinja index.html en app/templates
     # Pasar los productos desde la base de datos para que la vista sea dinámica
-    try:
-        q = request.args.get('q', '').strip()
-        if q:
-            products = Product.query.filter((Product.title.ilike(f"%{q}%")) | (Product.category.ilike(f"%{q}%"))).order_by(Product.id.desc()).all()
-        else:
-            products = Product.query.order_by(Product.id.desc()).all()
-    except Exception:
-        products = []
-    return render_template('index.html', products=products)
+    q = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int) or 1
+
+    def build():
+        result = None
+        try:
+            if q:
+                # ranked, paginated full-text search; only the ids of one page come back
+                result = get_search_index().search(q, page=page, per_page=app.config['SEARCH_PAGE_SIZE'])
+                products = products_by_ids(result.ids)
+            else:
+                products = Product.query.order_by(Product.id.desc()).all()
+        except Exception:
+            app.logger.exception('Product listing failed')
+            products = []
+        return render_grid_html(products, empty_message='No hay productos disponibles.'), result
+
+    get_catalog_version()  # picks up catalog changes made by other workers
+    key = ('home', ' '.join(search.terms(q)), page if q else 1)
+    html, result = fragment_cache.get_or_set(key, build)
+    return render_template('index.html', product_grid=with_favorites(html), q=q, search=result)
+
 
+def render_grid_html(products, default_category='General', empty_message=None):
+    """Render the shared product-card markup (no per-visitor data)."""
+    return render_template('_product_grid.html', products=products,
+                           default_category=default_category, empty_message=empty_message).strip()
 
-def _cart_from_session():
-    return session.setdefault('cart', {})
+
+def with_favorites(html):
+    """Mark the visitor's favorites in a cached grid fragment."""
+    for pid in get_cart_state()['favorites']:
+        html = html.replace(f'class="btn_fav" data-pid="{pid}"', f'class="btn_fav fav-active" data-pid="{pid}"')
+    return Markup(html)
+
+
+# Caché HTTP del catálogo: max-age y ventana stale-while-revalidate (segundos)
+app.config['CATALOG_MAX_AGE'] = int(os.environ.get('CATALOG_MAX_AGE', '0'))
+app.config['CATALOG_STALE_WHILE_REVALIDATE'] = int(os.environ.get('CATALOG_STALE_WHILE_REVALIDATE', '60'))
+# how long a worker trusts its last read of the catalog version
+app.config['CATALOG_VERSION_TTL'] = float(os.environ.get('CATALOG_VERSION_TTL', '1.0'))
+_catalog_version = {'value': None, 'checked': 0.0}
+
+
+def get_catalog_version():
+    """Current (version, updated_at) of the catalog.
+
+    Read from the catalog_state row at most once per CATALOG_VERSION_TTL per
+    process. A version change made by another worker also resets the local
+    fragment cache.
+    """
+    now = time.monotonic()
+    cached = _catalog_version['value']
+    if cached is None or now - _catalog_version['checked'] > app.config['CATALOG_VERSION_TTL']:
+        row = db.session.query(CatalogState.version, CatalogState.updated_at).filter(CatalogState.id == 1).first()
+        cached = (row[0], row[1]) if row else (0, None)
+        _catalog_version.update(value=cached, checked=now)
+        fragment_cache.sync(cached[0])
+    return cached
+
+
+def catalog_changed(commit=True):
+    """Called by every product write path (stock changes included): bumps the shared catalog version.
+
+    ``commit=False`` leaves the bump in the caller's transaction (e.g. a job
+    that commits it together with the stock it puts back).
+    """
+    updated = CatalogState.query.filter_by(id=1).update(
+        {'version': CatalogState.version + 1, 'updated_at': datetime.utcnow()}, synchronize_session=False)
+    if not updated:
+        db.session.add(CatalogState(id=1, version=1))
+    _catalog_version['value'] = None
+    if commit:
+        db.session.commit()
+        get_catalog_version()
+
+
+def catalog_cache_options(private=False):
+    return {
+        'max_age': app.config['CATALOG_MAX_AGE'],
+        'stale_while_revalidate': app.config['CATALOG_STALE_WHILE_REVALIDATE'],
+        'private': private,
+    }
+
+
+def visitor_etag_parts():
+    """Per-visitor inputs of a rendered page (it embeds the CSRF token, favorites...)."""
+    state = get_cart_state()
+    return (session.get('user_id'), session.get('csrf_token'), len(state['cart']),
+            ','.join(state['favorites']), session.get('_flashes'))
+
+
+def products_by_ids(ids):
+    """Load products for ``ids`` with one query, keeping the order of ``ids``."""
+    if not ids:
+        return []
+    found = {p.id: p for p in Product.query.filter(Product.id.in_(ids)).all()}
+    return [found[i] for i in ids if i in found]
+
+
+def _cart_key(create=False):
+    uid = session.get('user_id')
+    if uid:
+        return f'user:{uid}'
+    cid = session.get('cart_id')
+    if not cid and create:
+        cid = secrets.token_urlsafe(16)
+        session['cart_id'] = cid
+    return f'anon:{cid}' if cid else None
+
+
+def get_cart_state():
+    """Cart and favorites of the current visitor, loaded once per request."""
+    if 'cart_state' not in g:
+        key = _cart_key()
+        g.cart_state = (cart_store.load(key) if key else None) or empty_state()
+    return g.cart_state
+
+
+def save_cart_state(state):
+    """Store the visitor's cart in the request's transaction: the route commits."""
+    g.cart_state = state
+    cart_store.save(_cart_key(create=True), state)
+
+
+@app.before_request
+def migrate_cookie_cart():
+    # carts from before the server-side store still live in the cookie: moved
+    # once, at the start of the request, in their own transaction
+    if request.endpoint in ('static', *PROBE_ENDPOINTS) or ('cart' not in session and 'favorites' not in session):
+        return
+    legacy = {'cart': session.pop('cart', None) or {}, 'favorites': session.pop('favorites', None) or []}
+    if legacy['cart'] or legacy['favorites']:
+        save_cart_state(merge_states(get_cart_state(), legacy))
+        db.session.commit()
+
+
+def merge_anonymous_cart(uid):
+    """On login, fold the anonymous cart/favorites into the user's stored ones (the caller commits)."""
+    cid = session.pop('cart_id', None)
+    if not cid:
+        return
+    anon_key = f'anon:{cid}'
+    anon = cart_store.load(anon_key)
+    if anon:
+        user_key = f'user:{uid}'
+        cart_store.save(user_key, merge_states(cart_store.load(user_key) or empty_state(), anon))
+    cart_store.delete(anon_key)
+    g.pop('cart_state', None)
+
+
+@app.context_processor
+def inject_cart_state():
+    state = get_cart_state()
+    return {'cart_count': len(state['cart']), 'favorite_ids': state['favorites']}
 
 
 @app.route('/cart/add', methods=['POST'])
@@ -237,30 +945,139 @@ def cart_add():
     p = Product.query.get(pid)
     if not p:
         return jsonify({'error': 'product not found'}), 404
-    cart = _cart_from_session()
+    state = get_cart_state()
+    cart = state['cart']
     cart[str(pid)] = cart.get(str(pid), 0) + max(1, qty)
-    session['cart'] = cart
+    save_cart_state(state)
+    db.session.commit()
     # return JSON so frontend can update without reload
     total_items = sum(cart.values())
     return jsonify({'ok': True, 'total_items': total_items, 'product_id': pid})
 
 
-@app.route('/cart')
-def view_cart():
-    cart = session.get('cart', {})
-    items = []
-    total = 0.0
-    for pid_str, qty in cart.items():
+def price_cart(cart):
+    """Resolve a session cart ({pid: qty}) into line items and a total.
+
+    All products are loaded with a single IN query; unknown products and
+    malformed entries are skipped. Used by the cart, payment and checkout views.
+    """
+    quantities = {}
+    for pid_str, qty in (cart or {}).items():
         try:
             pid = int(pid_str)
+            qty = int(qty)
         except Exception:
             continue
-        p = Product.query.get(pid)
+        if qty > 0:
+            quantities[pid] = qty
+    if not quantities:
+        return [], 0.0
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(list(quantities))).all()}
+    items = []
+    total = 0.0
+    for pid, qty in quantities.items():
+        p = products.get(pid)
         if not p:
             continue
-        subtotal = (p.price or 0.0) * qty
-        items.append({'id': p.id, 'title': p.title, 'price': p.price, 'img': p.img, 'qty': qty, 'subtotal': subtotal, 'category': getattr(p, 'category', None)})
+        price = float(p.price or 0.0)
+        subtotal = price * qty
+        items.append({'id': p.id, 'title': p.title, 'price': price, 'img': p.img, 'qty': qty, 'subtotal': subtotal,
+                      'category': p.category, 'category_id': p.category_id})
         total += subtotal
+    return items, total
+
+
+def reserve_stock(items):
+    """Take the cart quantities out of stock; returns the ids that were short.
+
+    One conditional UPDATE per line (``stock >= qty``): the check and the
+    decrement are a single statement, so concurrent checkouts cannot both take
+    the last unit. Lines are processed in product id order so two checkouts
+    never wait on each other's rows in opposite order. The caller rolls back
+    when anything is short.
+    """
+    short = []
+    for it in sorted(items, key=lambda it: it['id']):
+        result = db.session.execute(
+            db.update(Product)
+            .where(Product.id == it['id'], db.or_(Product.stock.is_(None), Product.stock >= it['qty']))
+            .values(stock=Product.stock - it['qty'])
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            short.append(it['id'])
+    return short
+
+
+def parse_stock(value):
+    """Stock from a form/JSON value: '' or None = not tracked, else a non-negative int."""
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    stock = int(value)
+    if stock < 0:
+        raise ValueError('stock must not be negative')
+    return stock
+
+
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+
+def checkout_idempotency_key():
+    """Idempotency-Key header (or idempotency_key form/JSON field for the form fallback)."""
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not key and request.is_json:
+        key = (request.get_json(silent=True) or {}).get('idempotency_key')
+    key = (key or '').strip()
+    if len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise ValueError(f'Idempotency-Key longer than {IDEMPOTENCY_KEY_MAX_LENGTH} characters')
+    return key or None
+
+
+def replay_checkout(record, as_json):
+    """Answer a repeated checkout with the stored result of the first one."""
+    if as_json:
+        resp = Response(record.response or '{}', status=record.status_code, mimetype='application/json')
+    else:
+        order = db.session.get(Order, record.order_id) if record.order_id else None
+        if order is None:
+            return redirect(url_for('pedidos_page'))
+        payment = db.session.execute(db.select(Payment).filter_by(order_id=order.id)).scalars().first()
+        resp = make_response(render_template('CompraFinalizada.html', order=order, payment=payment))
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+
+def checkout_payment_details():
+    """Payment method and gateway details from the checkout request.
+
+    Only the last four card digits are accepted. They reach the gateway through
+    the payments.process job payload, so they are stored in ``jobs`` until
+    purge-jobs deletes the finished job (never in orders or payments).
+    """
+    data = (request.get_json(silent=True) or {}) if request.is_json else request.form
+    method = (data.get('payment_method') or 'card').strip()[:80]
+    last4 = ''.join(ch for ch in str(data.get('card_last4') or '') if ch.isdigit())[-4:]
+    return method, {'card_last4': last4} if last4 else {}
+
+
+RECENT_ORDERS_IN_SESSION = 20
+
+
+def remember_order(order_id):
+    """Keep the last orders of this browser in the session (payment status of anonymous buyers)."""
+    recent = [oid for oid in session.get('recent_orders', []) if oid != order_id]
+    session['recent_orders'] = (recent + [order_id])[-RECENT_ORDERS_IN_SESSION:]
+
+
+def can_view_order(order):
+    uid = session.get('user_id')
+    if uid is not None and order.user_id == uid:
+        return True
+    return order.id in session.get('recent_orders', [])
+
+
+@app.route('/cart')
+def view_cart():
+    items, total = price_cart(get_cart_state()['cart'])
     return render_template('Carrito.html', cart_items=items, subtotal=total, total=total)
 
 
@@ -275,15 +1092,17 @@ def cart_remove():
         pid = int(pid)
     except Exception:
         return jsonify({'error': 'invalid pid'}), 400
-    cart = session.get('cart', {})
+    state = get_cart_state()
+    cart = state['cart']
     if str(pid) in cart:
         cart.pop(str(pid), None)
-        session['cart'] = cart
+        save_cart_state(state)
+        db.session.commit()
     return jsonify({'ok': True, 'total_items': sum(cart.values())})
 
 @app.route('/favorites', methods=['GET'])
 def view_favorites():
-    favs = session.get('favorites', [])
+    favs = get_cart_state()['favorites']
     return jsonify({'favorites': list(favs)})
 
 @app.route('/favorites/toggle', methods=['POST'])
@@ -297,14 +1116,16 @@ def favorites_toggle():
         pid = int(pid)
     except Exception:
         return jsonify({'error': 'invalid pid'}), 400
-    favs = set(session.get('favorites', []))
+    state = get_cart_state()
+    favs = state['favorites']
     if str(pid) in favs:
-        favs.discard(str(pid))
+        favs.remove(str(pid))
         action = 'removed'
     else:
-        favs.add(str(pid))
+        favs.append(str(pid))
         action = 'added'
-    session['favorites'] = list(favs)
+    save_cart_state(state)
+    db.session.commit()
     return jsonify({'ok': True, 'action': action, 'pid': pid, 'total': len(favs)})
 
 @app.route('/templates/<path:name>')
@@ -318,8 +1139,14 @@ def template_view(name):
 
 @app.route('/favoritos')
 def favoritos_page():
-    # Render the favoritos page dynamically using session favorites
-    favs = session.get('favorites', []) or []
+    # Render the favoritos page dynamically using the stored favorites
+    favs = get_cart_state()['favorites']
+    version, updated_at = get_catalog_version()
+    etag = weak_etag('favoritos', version, *visitor_etag_parts())
+    cache_opts = catalog_cache_options(private=True)
+    resp = not_modified(etag, **cache_opts)
+    if resp is not None:
+        return resp
     ids = []
     try:
         ids = [int(x) for x in favs]
@@ -328,7 +1155,8 @@ def favoritos_page():
     products = []
     if ids:
         products = Product.query.filter(Product.id.in_(ids)).all()
-    return render_template('favoritos.html', products=products)
+    resp = make_response(render_template('favoritos.html', products=products))
+    return set_cache_headers(resp, etag, **cache_opts)
 
 
 @app.route('/pedidos')
@@ -337,11 +1165,32 @@ def pedidos_page():
     if not session.get('user_id'):
         return redirect(url_for('login'))
     uid = session.get('user_id')
+    page = request.args.get('page', 1, type=int) or 1
     try:
-        orders = Order.query.filter_by(user_id=uid).order_by(Order.created_at.desc()).all()
+        orders = order_history(uid, page=page)
     except Exception:
-        orders = []
-    return render_template('pedidos.html', orders=orders)
+        app.logger.exception('Could not load order history')
+        orders = None
+    return render_template('pedidos.html', orders=orders.items if orders else [], pagination=orders)
+
+
+# product columns shown in the order history (never the legacy image blob)
+ORDER_HISTORY_PRODUCT_COLUMNS = (Product.id, Product.title, Product.img, Product.image_hash, Product.image_mime)
+
+
+def order_history(uid, page=1, per_page=None, with_items=True):
+    """One page of the user's orders, newest first.
+
+    Items and their products are fetched with one extra query each
+    (selectinload) for the whole page, limited to the columns the templates
+    use. Served by idx_orders_user_id_created_at.
+    """
+    query = db.select(Order).filter_by(user_id=uid).order_by(Order.created_at.desc(), Order.id.desc())
+    if with_items:
+        query = query.options(
+            selectinload(Order.order_items).selectinload(OrderItem.product).load_only(*ORDER_HISTORY_PRODUCT_COLUMNS))
+    return db.paginate(query, page=page, per_page=per_page or app.config['ORDER_HISTORY_PAGE_SIZE'],
+                       error_out=False)
 
 
 @app.route('/juegos')
@@ -375,19 +1224,40 @@ def category_page(slug):
         'controles': 'Controles'
     }
     cat_name = mapping.get(slug.lower(), None)
-    try:
-        if cat_name:
-            products = Product.query.filter_by(category=cat_name).order_by(Product.id.desc()).all()
-        else:
-            # fallback: try case-insensitive match
-            products = Product.query.filter(Product.category.ilike(f"%{slug}%")).order_by(Product.id.desc()).all()
-    except Exception:
-        products = []
     # Prefer templates named after the slug if present, otherwise fallback to a generic template
     tpl_name = f"{slug}.html"
-    if os.path.exists(os.path.join(app.template_folder, tpl_name)):
-        return render_template(tpl_name, products=products)
-    return render_template('juegos.html', products=products)
+    if not os.path.exists(os.path.join(app.template_folder, tpl_name)):
+        tpl_name = 'juegos.html'
+
+    version, updated_at = get_catalog_version()
+    etag = weak_etag('category', version, slug.lower(), tpl_name, *visitor_etag_parts())
+    cache_opts = catalog_cache_options(private=True)
+    resp = not_modified(etag, **cache_opts)
+    if resp is not None:
+        return resp
+
+    def build():
+        try:
+            if cat_name:
+                products = Product.query.filter(in_category(cat_name)).order_by(Product.id.desc()).all()
+            else:
+                # fallback: try case-insensitive match
+                products = Product.query.filter(in_categories_like(slug)).order_by(Product.id.desc()).all()
+        except Exception:
+            products = []
+        return render_grid_html(products, default_category=CATEGORY_DEFAULT_LABELS.get(tpl_name, 'General'))
+
+    html = fragment_cache.get_or_set(('category', slug.lower(), tpl_name), build)
+    resp = make_response(render_template(tpl_name, product_grid=with_favorites(html)))
+    return set_cache_headers(resp, etag, **cache_opts)
+
+
+# label shown on cards without a category, per category template
+CATEGORY_DEFAULT_LABELS = {
+    'consolas.html': 'Hardware',
+    'controles.html': 'Controles',
+    'accesorios.html': 'Accesorios',
+}
 
 
 @app.route('/app/static/<path:filename>')
@@ -400,6 +1270,26 @@ def app_static(filename):
 # The previous placeholder route was removed to avoid duplicate registrations.
 
 
+def auth_error(template, message, status, wait):
+    # 429 (límite de intentos) o 503 (pool de hashes lleno) con Retry-After
+    resp = make_response(render_template(template, error=message), status)
+    resp.headers['Retry-After'] = auth.retry_after(wait)
+    return resp
+
+
+def rehash_password(user_id, stored_hash, password):
+    """Store the password again when its hash predates PASSWORD_HASH_METHOD (after a good login)."""
+    if not password_hasher.needs_rehash(stored_hash):
+        return
+    try:
+        new_hash = password_hasher.hash(password)
+    except auth.HasherBusy:
+        return  # next login
+    User.query.filter_by(id=user_id, password_hash=stored_hash).update(
+        {'password_hash': new_hash}, synchronize_session=False)
+    db.session.commit()
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     # GET -> mostrar formulario (ya existe en templates/login.html)
@@ -412,9 +1302,24 @@ def login():
     username = (data.get('username') or '').strip()
     password = (data.get('password') or '').strip()
 
-    # Intentar autenticar contra la tabla users
-    user = User.query.filter_by(username=username).first()
-    if user and user.check_password(password):
+    # Límite de intentos por IP y por usuario, antes de calcular ningún hash
+    wait = login_throttle.check(username=username, ip=request.remote_addr)
+    if wait:
+        return auth_error('login.html', 'Demasiados intentos. Inténtalo de nuevo más tarde.', 429, wait)
+
+    # Intentar autenticar contra la tabla users; la conexión vuelve al pool
+    # antes de calcular el hash
+    user = (db.session.query(User.id, User.username, User.is_admin, User.password_hash)
+            .filter_by(username=username).first())
+    db.session.rollback()
+    try:
+        valid = password_hasher.verify(user.password_hash if user else None, password)
+    except auth.HasherBusy:
+        return auth_error('login.html', 'Servidor ocupado, inténtalo de nuevo en unos segundos.', 503, 1)
+    if valid:
+        rehash_password(user.id, user.password_hash, password)
+        merge_anonymous_cart(user.id)
+        db.session.commit()
         session['user_id'] = user.id
         session['username'] = user.username
         session['is_admin'] = bool(user.is_admin)
@@ -439,13 +1344,24 @@ def registro():
         abort(400, 'CSRF token missing or invalid')
     if not username or not password:
         return render_template('registro.html', error='Username y password requeridos')
-    if User.query.filter_by(username=username).first():
+    # cada registro también calcula un hash: mismo límite por IP que el login
+    wait = login_throttle.check(ip=request.remote_addr)
+    if wait:
+        return auth_error('registro.html', 'Demasiados intentos. Inténtalo de nuevo más tarde.', 429, wait)
+    exists = db.session.query(User.id).filter_by(username=username).first() is not None
+    db.session.rollback()
+    if exists:
         return render_template('registro.html', error='Usuario ya existe')
     u = User(username=username)
-    u.set_password(password)
+    try:
+        u.set_password(password)
+    except auth.HasherBusy:
+        return auth_error('registro.html', 'Servidor ocupado, inténtalo de nuevo en unos segundos.', 503, 1)
     db.session.add(u)
     db.session.commit()
     # auto-login
+    merge_anonymous_cart(u.id)
+    db.session.commit()
     session['user_id'] = u.id
     session['username'] = u.username
     session['is_admin'] = bool(u.is_admin)
@@ -458,9 +1374,11 @@ def perfiluser():
     if not uid:
         return redirect(url_for('login'))
     user = User.query.get(uid)
-    orders = Order.query.filter_by(user_id=uid).order_by(Order.created_at.desc()).all()
-    favorites = session.get('favorites', [])
-    return render_template('perfiluser.html', user=user, orders=orders, favorites_count=len(favorites))
+    # latest orders only (no items); the total comes from the pagination count
+    orders = order_history(uid, per_page=5, with_items=False)
+    favorites = get_cart_state()['favorites']
+    return render_template('perfiluser.html', user=user, orders=orders.items, orders_total=orders.total,
+                           favorites_count=len(favorites))
 
 
 
@@ -475,16 +1393,143 @@ def serve_admin_template_static(filename):
     return send_from_directory(os.path.join('app', 'admin_templates'), filename)
 
 
+# Campos que puede pedir ?fields= y las columnas que necesita cada uno
+API_PRODUCT_FIELDS = {
+    'id': ('id',),
+    'sku': ('sku',),
+    'title': ('title',),
+    'price': ('price',),
+    'img': ('img',),
+    'image_url': ('image_hash', 'image_mime', 'img'),
+    'category': ('category',),
+    'stock': ('stock',),
+}
+API_PAGE_DEFAULT = 100
+API_PAGE_MAX = 500
+
+
+def _float_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+
+def _int_arg(args, name):
+    value = args.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f'{name} must be an integer')
+
+
+def api_product_listing(args):
+    """Parse /api/products query args into (filtered query, fields, after, limit).
+
+    Only the columns needed by the requested fields are selected, so rows come
+    back as plain tuples instead of full ORM objects. Raises ValueError on bad input.
+    """
+    fields = [f.strip() for f in (args.get('fields') or '').split(',') if f.strip()] or list(API_PRODUCT_FIELDS)
+    unknown = [f for f in fields if f not in API_PRODUCT_FIELDS]
+    if unknown:
+        raise ValueError('unknown fields: ' + ', '.join(unknown))
+    columns = ['id']
+    for f in fields:
+        columns.extend(c for c in API_PRODUCT_FIELDS[f] if c not in columns)
+
+    query = db.session.query(*[getattr(Product, c) for c in columns])
+    category = (args.get('category') or '').strip()
+    if category:
+        query = query.filter(in_category(category))
+    min_price = _float_arg(args, 'min_price')
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    max_price = _float_arg(args, 'max_price')
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+
+    after = _int_arg(args, 'after')
+    limit = _int_arg(args, 'limit')
+    if limit is not None and limit < 1:
+        raise ValueError('limit must be positive')
+    return query, fields, after, limit
+
+
+def api_product_row(row, fields):
+    data = row._mapping
+    out = {}
+    for f in fields:
+        if f == 'image_url':
+            out[f] = api_image_url(data['image_hash'], data['image_mime'], data['img'])
+        else:
+            out[f] = data[f]
+    return out
+
+
+def wants_ndjson():
+    if request.args.get('format') == 'ndjson':
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson'])
+    return best == 'application/x-ndjson'
+
+
 @app.route('/api/products')
 def api_products():
+    """List products using keyset pagination.
+
+    Query args: after=<id>, limit=<n> (default 100, max 500), category=,
+    min_price=, max_price=, fields=id,title,... and format=ndjson (or
+    Accept: application/x-ndjson) to stream every matching row.
+    """
     try:
-        products = Product.query.all()
-        return jsonify([p.to_dict() for p in products])
-    except OperationalError:
-        # Si la BD no está inicializada, intenta crearla y devolver la lista vacía
-        init_db_and_seed()
-        products = Product.query.all()
-        return jsonify([p.to_dict() for p in products])
+        query, fields, after, limit = api_product_listing(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    version, updated_at = get_catalog_version()
+    etag = weak_etag('products', version, sorted(request.args.items(multi=True)), wants_ndjson())
+    cache_opts = catalog_cache_options()
+    resp = not_modified(etag, updated_at, **cache_opts)
+    if resp is not None:
+        resp.vary.add('Accept')
+        return resp
+    total = query.with_entities(db.func.count(Product.id)).scalar()
+
+    if after is not None:
+        query = query.filter(Product.id > after)
+    query = query.order_by(Product.id.asc())
+
+    if wants_ndjson():
+        if limit is not None:
+            query = query.limit(limit)
+        # server-side cursor where the driver supports it; rows are fetched in batches
+        rows = query.yield_per(500)
+
+        def generate():
+            for row in rows:
+                yield json.dumps(api_product_row(row, fields)) + '\n'
+
+        resp = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+        resp.headers['X-Total-Count'] = str(total)
+        resp.vary.add('Accept')
+        return set_cache_headers(resp, etag, updated_at, **cache_opts)
+
+    limit = min(limit or API_PAGE_DEFAULT, API_PAGE_MAX)
+    rows = query.limit(limit).all()
+    resp = jsonify([api_product_row(r, fields) for r in rows])
+    resp.headers['X-Total-Count'] = str(total)
+    if len(rows) == limit:
+        next_after = rows[-1]._mapping['id']
+        args = request.args.to_dict()
+        args.update({'after': next_after, 'limit': limit})
+        resp.headers['X-Next-Cursor'] = str(next_after)
+        resp.headers['Link'] = f'<{url_for("api_products", **args)}>; rel="next"'
+    resp.vary.add('Accept')
+    return set_cache_headers(resp, etag, updated_at, **cache_opts)
 
 
 def admin_required(f):
@@ -503,6 +1548,7 @@ def logout():
     session.pop('user_id', None)
     session.pop('username', None)
     session.pop('is_admin', None)
+    session.pop('cart_id', None)
     return redirect(url_for('root'))
 
 
@@ -532,66 +1578,6 @@ def admin_inventario_new():
     return render_template('admin/add_product.html')
 
 
-def ensure_product_category_column():
-    """Ensure the 'category' column exists in products table. If not, add it."""
-    from sqlalchemy import inspect, text
-    insp = inspect(db.engine)
-    try:
-        cols = [c['name'] for c in insp.get_columns('products')]
-    except Exception:
-        cols = []
-    if 'category' not in cols:
-        # Add column (use IF NOT EXISTS where supported)
-        dialect = db.engine.dialect.name
-        if dialect == 'postgresql':
-            stmt = "ALTER TABLE products ADD COLUMN IF NOT EXISTS category VARCHAR(120);"
-        else:
-            # SQLite: simple ALTER ADD COLUMN works (no IF NOT EXISTS prior to 3.35)
-            stmt = "ALTER TABLE products ADD COLUMN category VARCHAR(120);"
-        try:
-            with db.engine.begin() as conn:
-                conn.execute(text(stmt))
-            app.logger.info('Ensured category column with DDL: %s', stmt)
-        except Exception as e:
-            app.logger.warning('Could not add category column: %s', e)
-
-
-def ensure_product_image_columns():
-    """Ensure the 'image_data' and 'image_mime' columns exist in products table."""
-    from sqlalchemy import inspect, text
-    insp = inspect(db.engine)
-    try:
-        cols = [c['name'] for c in insp.get_columns('products')]
-    except Exception:
-        cols = []
-
-    stmts = []
-    if 'image_data' not in cols:
-        # choose proper binary type per dialect
-        dialect = db.engine.dialect.name
-        if dialect == 'postgresql':
-            stmts.append("ALTER TABLE products ADD COLUMN IF NOT EXISTS image_data BYTEA;")
-        else:
-            # SQLite and others: BLOB works for binary
-            stmts.append("ALTER TABLE products ADD COLUMN image_data BLOB;")
-    if 'image_mime' not in cols:
-        dialect = db.engine.dialect.name
-        if dialect == 'postgresql':
-            stmts.append("ALTER TABLE products ADD COLUMN IF NOT EXISTS image_mime VARCHAR(120);")
-        else:
-            stmts.append("ALTER TABLE products ADD COLUMN image_mime VARCHAR(120);")
-
-    # Execute DDL statements using SQLAlchemy 2.0 style (connection/transaction)
-    for s in stmts:
-        try:
-            with db.engine.begin() as conn:
-                conn.execute(text(s))
-            app.logger.info('Executed DDL: %s', s)
-        except Exception as e:
-            # Log error so it's visible during startup; don't crash the app here
-            app.logger.warning('Could not execute DDL (%s): %s', s, e)
-
-
 @app.route('/admin/inventario/add', methods=['POST'])
 @admin_required
 def admin_inventario_add():
@@ -601,10 +1587,6 @@ def admin_inventario_add():
     # handle uploaded image file (prefer upload over URL)
     img = None
     file = request.files.get('img_file')
-    try:
-        ensure_product_image_columns()
-    except Exception:
-        pass
     category = (request.form.get('category') or '').strip()
     # server-side validation for allowed categories
     allowed_categories = ['Consolas', 'Juegos', 'Accesorios', 'Controles']
@@ -627,18 +1609,17 @@ def admin_inventario_add():
         price_val = float(price)
     except Exception:
         price_val = 0.0
-
-    # ensure category column exists before inserting
     try:
-        ensure_product_category_column()
-    except Exception:
-        pass
+        stock_val = parse_stock(request.form.get('stock'))
+    except ValueError:
+        flash('Stock inválido: use un número entero mayor o igual a 0, o déjelo vacío.')
+        return redirect(url_for('admin_inventario'))
 
     # image validation: only allow common image types and limit size to 2MB
     ALLOWED_MIMES = {'image/png', 'image/jpeg', 'image/jpg', 'image/webp'}
     MAX_IMAGE_BYTES = 2 * 1024 * 1024
 
-    p = Product(title=title, price=price_val, img='/static/img/Imagenes/placeholder.svg')
+    p = Product(title=title, price=price_val, stock=stock_val, img='/static/img/Imagenes/placeholder.svg')
     if file and file.filename:
         data = file.read()
         # validate size
@@ -650,7 +1631,8 @@ def admin_inventario_add():
         if mim not in ALLOWED_MIMES:
             flash('Tipo de imagen no permitido. Use PNG, JPG o WEBP.')
             return redirect(url_for('admin_inventario'))
-        p.image_data = data
+        p.image_hash = image_store.put(data, mim)
+        enqueue_image_variants(p.image_hash, mim)
         p.image_mime = mim or 'application/octet-stream'
     # set category if the model has that attribute
     try:
@@ -659,6 +1641,7 @@ def admin_inventario_add():
         pass
     db.session.add(p)
     db.session.commit()
+    catalog_changed()
     flash('Producto creado correctamente.')
     return redirect(url_for('admin_inventario'))
 
@@ -682,13 +1665,15 @@ def admin_inventario_edit(pid):
     category = (request.form.get('category') or '').strip()
     # handle uploaded image
     file = request.files.get('img_file')
-    try:
-        ensure_product_image_columns()
-    except Exception:
-        pass
     if title:
         p.title = title
     p.price = price_val
+    if 'stock' in request.form:
+        try:
+            p.stock = parse_stock(request.form.get('stock'))
+        except ValueError:
+            flash('Stock inválido: use un número entero mayor o igual a 0, o déjelo vacío.')
+            return redirect(url_for('admin_inventario_edit', pid=pid))
     # if file uploaded, replace binary image; otherwise keep existing
     if file and file.filename:
         data = file.read()
@@ -702,7 +1687,9 @@ def admin_inventario_edit(pid):
         if mim not in ALLOWED_MIMES:
             flash('Tipo de imagen no permitido. Use PNG, JPG o WEBP.')
             return redirect(url_for('admin_inventario_edit', pid=pid))
-        p.image_data = data
+        p.image_hash = image_store.put(data, mim)
+        enqueue_image_variants(p.image_hash, mim)
+        p.image_data = None
         p.image_mime = mim or 'application/octet-stream'
         # clear legacy img path
         p.img = '/static/img/Imagenes/placeholder.svg'
@@ -722,6 +1709,7 @@ def admin_inventario_edit(pid):
     except Exception:
         pass
     db.session.commit()
+    catalog_changed()
     flash('Producto actualizado correctamente.')
     return redirect(url_for('admin_inventario'))
 
@@ -735,10 +1723,151 @@ def admin_inventario_delete(pid):
     p = Product.query.get_or_404(pid)
     db.session.delete(p)
     db.session.commit()
+    catalog_changed()
     flash('Producto eliminado.')
     return redirect(url_for('admin_inventario'))
 
 
+@app.route('/admin/cache/stats')
+@admin_required
+def admin_cache_stats():
+    # hit/miss counters of the catalog fragment cache
+    return jsonify(fragment_cache.stats())
+
+
+@app.route('/admin/db/pool')
+@admin_required
+def admin_db_pool_stats():
+    # connection pool checkouts, wait times and current usage
+    return jsonify(db_config.pool_metrics.snapshot(db.engine.pool))
+
+
+@app.route('/admin/jobs/stats')
+@admin_required
+def admin_job_stats():
+    # queue depth per job and status, recent run/wait times; embedded worker counters if running
+    stats = job_queue.stats()
+    worker = _embedded_worker.get('worker')
+    if worker is not None:
+        stats['embedded_worker'] = {name: dict(m) for name, m in worker.metrics.items()}
+    return jsonify(stats)
+
+
+@app.route('/admin/auth/stats')
+@admin_required
+def admin_auth_stats():
+    # password hashing pool (in flight, rejected, average time) and throttle decisions
+    return jsonify({'hasher': password_hasher.stats(), 'throttle': dict(login_throttle.metrics)})
+
+
+@app.route('/healthz')
+def healthz():
+    # liveness: the process answers requests; no database access
+    resp = jsonify({'status': 'ok', 'pid': os.getpid()})
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    # Prometheus scrape: every worker process (METRICS_MULTIPROC_DIR), no session needed
+    if not app.config['METRICS_ENABLED']:
+        abort(404)
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(401)
+    resp = Response(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+@app.route('/readyz')
+def readyz():
+    # readiness: the database answers and the schema is at the Alembic head;
+    # 503 takes the worker out of the load balancer until it recovers
+    t0 = time.perf_counter()
+    body = {'pid': os.getpid(), 'database': 'ok', 'schema': 'ok'}
+    try:
+        db.session.execute(db.text('SELECT 1'))
+        if not ensure_schema():
+            body['schema'] = 'behind'
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning('Readiness check failed: %s', e)
+        body['database'] = f'{type(e).__name__}'
+    body['database_ms'] = round((time.perf_counter() - t0) * 1000, 1)
+    ready = body['database'] == 'ok' and body['schema'] == 'ok'
+    body['status'] = 'ok' if ready else 'unavailable'
+    resp = jsonify(body)
+    resp.status_code = 200 if ready else 503
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+REPORT_MAX_DAYS = 3660
+
+
+def report_range(args, default_days=30):
+    """(start, end) dates from ?from=YYYY-MM-DD&to=YYYY-MM-DD (default: last 30 days)."""
+    end = date.fromisoformat(args['to']) if args.get('to') else datetime.utcnow().date()
+    start = date.fromisoformat(args['from']) if args.get('from') else end - timedelta(days=default_days - 1)
+    if start > end:
+        raise ValueError('from must not be after to')
+    if (end - start).days > REPORT_MAX_DAYS:
+        raise ValueError(f'range longer than {REPORT_MAX_DAYS} days')
+    return start, end
+
+
+@app.route('/admin/api/reports/revenue')
+@admin_required
+def admin_report_revenue():
+    # ?from=&to=&granularity=day|week|month
+    granularity = request.args.get('granularity', 'day')
+    try:
+        start, end = report_range(request.args)
+        if granularity not in GRANULARITIES:
+            raise ValueError('granularity must be one of ' + ', '.join(GRANULARITIES))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    series = sales_rollup.revenue(start, end, granularity)
+    return jsonify({
+        'from': start.isoformat(), 'to': end.isoformat(), 'granularity': granularity,
+        'totals': {
+            'orders': sum(p['orders'] for p in series),
+            'units': sum(p['units'] for p in series),
+            'revenue': round(sum(p['revenue'] for p in series), 2),
+        },
+        'series': series,
+    })
+
+
+@app.route('/admin/api/reports/top-products')
+@admin_required
+def admin_report_top_products():
+    # ?from=&to=&limit=10&by=units|revenue
+    by = request.args.get('by', 'units')
+    try:
+        start, end = report_range(request.args)
+        limit = min(max(_int_arg(request.args, 'limit') or 10, 1), 100)
+        if by not in ('units', 'revenue'):
+            raise ValueError('by must be units or revenue')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    products = sales_rollup.top_products(Product.__table__, start, end, limit=limit, by=by)
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'by': by, 'products': products})
+
+
+@app.route('/admin/api/reports/categories')
+@admin_required
+def admin_report_categories():
+    try:
+        start, end = report_range(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    categories = sales_rollup.categories(Category.__table__, start, end)
+    return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'categories': categories})
+
+
 @app.route('/admin/<path:name>')
 @admin_required
 def admin_render(name):
@@ -757,23 +1886,65 @@ def admin_render(name):
 
 @app.route('/product_image/<int:pid>')
 def product_image(pid):
-    p = Product.query.get(pid)
-    if not p:
+    # ?size=thumb|card|detail selects a resized variant; the format comes from Accept.
+    size = request.args.get('size')
+    if size not in image_variants.SIZES:
+        size = None
+    # Only the small image columns are fetched; the legacy blob column is never read here.
+    row = db.session.query(Product.image_hash, Product.image_mime, Product.img).filter(Product.id == pid).first()
+    if not row:
         return send_from_directory(os.path.join(app.static_folder, 'img/Imagenes'), 'placeholder.svg')
-    if p.image_data:
-        from flask import make_response
-        resp = make_response(p.image_data)
-        resp.headers.set('Content-Type', p.image_mime or 'application/octet-stream')
-        return resp
+    image_hash, image_mime, img = row
+    if image_hash:
+        # the URL is per product and the image may change: clients revalidate (ETag -> 304)
+        resp = None
+        if size:
+            fmt = image_variants.negotiate_format(request.accept_mimetypes)
+            resp = image_store.send(image_hash, fmt, size=size, max_age=0, immutable=False)
+            if resp is None:
+                # variant not rendered yet (or Pillow missing): serve the original meanwhile
+                enqueue_image_variants(image_hash, image_mime)
+                db.session.commit()
+            else:
+                resp.vary.add('Accept')
+        if resp is None:
+            resp = image_store.send(image_hash, extension_for(image_mime), max_age=0, immutable=False)
+        if resp is not None:
+            return resp
     # fallback to legacy path if present
-    if p.img:
-        # if p.img is a static path like /static/..., redirect
-        if p.img.startswith('/'):
-            return redirect(p.img)
-        return send_from_directory(app.static_folder, p.img)
+    if img:
+        # if img is a static path like /static/..., redirect
+        if img.startswith('/'):
+            return redirect(img)
+        return send_from_directory(app.static_folder, img)
     return send_from_directory(os.path.join(app.static_folder, 'img/Imagenes'), 'placeholder.svg')
 
 
+@app.route('/images/<name>')
+def image_file(name):
+    """Serve an image from the content-addressed store ('<sha256>[_<size>].<ext>')."""
+    parsed = parse_name(name)
+    if not parsed:
+        abort(404)
+    digest, size, ext = parsed
+    if size and size not in image_variants.SIZES:
+        abort(404)
+    resp = image_store.send(digest, ext, size=size)
+    if resp is not None:
+        return resp
+    if size:
+        # Variant still being rendered: temporary redirect to the original, never cached.
+        row = db.session.query(Product.image_mime).filter(Product.image_hash == digest).first()
+        if row:
+            original_ext = extension_for(row[0])
+            enqueue_image_variants(digest, row[0])
+            db.session.commit()
+            resp = redirect(url_for('image_file', name=f'{digest}.{original_ext}'))
+            resp.headers['Cache-Control'] = 'no-store'
+            return resp
+    abort(404)
+
+
 @app.errorhandler(IntegrityError)
 def handle_integrity_error(e):
     # Roll back the failed transaction and return a friendly message
@@ -789,31 +1960,249 @@ def handle_integrity_error(e):
     return redirect(url_for('root'))
 
 
-if __name__ == '__main__':
-    # Inicializa BD si es necesario y arranca el servidor
+# Comandos de mantenimiento: flask --app app gamestore <comando>
+gamestore_cli = AppGroup('gamestore', help='GameStore maintenance commands.')
+app.cli.add_command(gamestore_cli)
+
+
+@gamestore_cli.command('init-db')
+@click.option('--auto', is_flag=True, help='only when SCHEMA_AUTO_UPGRADE is on (gunicorn start)')
+def init_db_command(auto):
+    """Upgrade the schema to the Alembic head (deploy step; also queues legacy image moves)."""
+    if auto and not app.config['SCHEMA_AUTO_UPGRADE']:
+        click.echo('SCHEMA_AUTO_UPGRADE=0: schema not upgraded (run init-db as a deploy step)')
+        return
+    status = init_db()
+    state = 'upgraded to' if status.upgraded else 'already at'
+    click.echo(f'database schema {state} {", ".join(status.current)}')
+
+
+@gamestore_cli.command('seed')
+def seed_command():
+    """Add sample products and an admin/admin user to empty tables (development)."""
+    added = seed_sample_data()
+    click.echo(f"{added['products']} sample products and {added['users']} users added")
+
+
+@gamestore_cli.command('rebuild-reports')
+@click.option('--from', 'start', type=click.DateTime(['%Y-%m-%d']), help='first day (default: all history)')
+@click.option('--to', 'end', type=click.DateTime(['%Y-%m-%d']), help='last day (default: today)')
+@click.option('--chunk-size', default=50000, show_default=True, help='order items per fetched chunk')
+def rebuild_reports_command(start, end, chunk_size):
+    """Recompute the sales rollups from orders/order_items (backfills)."""
+    t0 = time.perf_counter()
+    count = sales_rollup.rebuild(Order.__table__, OrderItem.__table__, Product.__table__,
+                                 start=start.date() if start else None, end=end.date() if end else None,
+                                 chunk_size=chunk_size)
+    elapsed = time.perf_counter() - t0
+    click.echo(f'{count} order items aggregated in {elapsed:.1f}s '
+               f'({count / elapsed if elapsed else 0:,.0f} rows/s)')
+
+
+
+@gamestore_cli.command('purge-idempotency-keys')
+@click.option('--older-than-hours', default=24, show_default=True, help='age of the keys to delete')
+def purge_idempotency_keys_command(older_than_hours):
+    """Delete stored checkout results older than the given age."""
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'{deleted} idempotency keys deleted')
+
+
+@gamestore_cli.command('purge-carts')
+@click.option('--older-than-hours', default=24 * 30, show_default=True, help='age of the anonymous carts to delete')
+def purge_carts_command(older_than_hours):
+    """Delete anonymous carts nobody touched for the given age (logged-in users' carts are kept)."""
+    deleted = cart_store.purge(datetime.utcnow() - timedelta(hours=older_than_hours))
+    click.echo(f'{deleted} carts deleted')
+
+
+@gamestore_cli.command('expire-payments')
+def expire_payments_command():
+    """Fail payments unfinished for PAYMENT_EXPIRE_MINUTES (stock back) and queue the others again."""
+    expired, requeued = recover_payments()
+    click.echo(f'{expired} payments expired, {requeued} queued again')
+
+
+@gamestore_cli.command('tune-password-hash')
+@click.option('--target-ms', default=100, show_default=True, help='time one hash may take on this machine')
+def tune_password_hash_command(target_ms):
+    """Print the scrypt parameters for PASSWORD_HASH_METHOD that hash within the target time."""
+    method = auth.tune_scrypt(target_ms)
+    t0 = time.perf_counter()
+    auth.generate_password_hash('tune-password', method)
+    click.echo(f'PASSWORD_HASH_METHOD={method}  ({(time.perf_counter() - t0) * 1000:.0f} ms per hash here)')
+    click.echo('existing passwords are rehashed with it on their next successful login')
+
+
+@gamestore_cli.command('purge-login-throttle')
+def purge_login_throttle_command():
+    """Delete login throttle buckets that have refilled (LOGIN_THROTTLE_STORE=sql)."""
+    store = login_throttle.store
+    if not isinstance(store, auth.SqlThrottleStore):
+        raise click.UsageError('LOGIN_THROTTLE_STORE is not sql')
+    click.echo(f'{store.purge(login_throttle.buckets())} buckets deleted')
+
+
+@gamestore_cli.command('worker')
+@click.option('--threads', type=int, default=None, help='job threads per process [default: JOB_WORKER_THREADS]')
+@click.option('--processes', type=int, default=1, show_default=True, help='worker processes (forked)')
+def worker_command(threads, processes):
+    """Run the background job worker until SIGTERM/SIGINT."""
+    threads = threads or app.config['JOB_WORKER_THREADS']
+
+    def make_worker():
+        # every process needs its own connections
+        db.engine.dispose()
+        return jobs.Worker(app, job_queue, threads=threads, poll_interval=app.config['JOB_POLL_INTERVAL'],
+                           periodic=(recover_payments,))
+
+    click.echo(f'job worker: {processes} process(es) x {threads} threads, jobs: {", ".join(sorted(job_queue.handlers))}')
+    jobs.run_processes(make_worker, processes)
+
+
+@gamestore_cli.command('enqueue')
+@click.argument('name')
+@click.option('--payload', default='{}', help='JSON payload')
+def enqueue_command(name, payload):
+    """Queue a job by name (e.g. images.fix_paths, images.migrate_blobs)."""
     try:
-        init_db_and_seed()
-        try:
-            ensure_product_image_columns()
-            ensure_product_category_column()
-        except Exception:
-            pass
-    except Exception:
-        pass
-
-    app.run(debug=True, host='0.0.0.0', port=5000)
-try:
-    with app.app_context():
-        init_db_and_seed()
-        try:
-            ensure_product_image_columns()
-            ensure_product_category_column()
-        except Exception:
-            pass
-except Exception:
-    # Ignora errores en entornos donde la DB no se puede crear ahora
-    pass
-
+        job = job_queue.enqueue(name, json.loads(payload))
+    except jobs.UnknownJob:
+        raise click.BadParameter(f'unknown job; known: {", ".join(sorted(job_queue.handlers))}', param_hint='NAME')
+    db.session.commit()
+    click.echo(f'job {job.id} queued')
+
+
+@gamestore_cli.command('jobs-stats')
+def jobs_stats_command():
+    """Print queue depth and recent job timings as JSON."""
+    click.echo(json.dumps(job_queue.stats(), indent=2))
+
+
+@gamestore_cli.command('purge-jobs')
+@click.option('--older-than-hours', default=72, show_default=True, help='age of finished jobs to delete')
+def purge_jobs_command(older_than_hours):
+    """Delete done and dead jobs finished before the given age."""
+    deleted = job_queue.purge(datetime.utcnow() - timedelta(hours=older_than_hours))
+    click.echo(f'{deleted} jobs deleted')
+
+
+# Tablas que mueven "gamestore export/import", en orden de dependencias (FKs).
+# Los resúmenes de ventas no se exportan: se recalculan tras importar pedidos.
+BULK_TABLES = ('users', 'categories', 'products', 'product_images', 'orders', 'order_items', 'payments')
+
+
+def make_bulk_io(chunk_size, embed_images=False, imported_images=None):
+    """BulkIO over the app tables, with the product hooks (categories and image store)."""
+    categories = {}
+
+    def import_products(conn, rows):
+        now = datetime.utcnow()
+        for row in rows:
+            data = row.pop('_image', None)
+            if data:
+                mime = row.get('image_mime') or 'application/octet-stream'
+                row['image_hash'] = image_store.put(base64.b64decode(data), mime)
+                row['image_mime'] = mime
+                if imported_images is not None:
+                    imported_images.add((row['image_hash'], mime))
+            # Core inserts skip _sync_category_id: resolve the FK here (one lookup per name)
+            name = row.get('category')
+            if name and row.get('category_id') is None:
+                if name not in categories:
+                    categories[name] = category_id_for(conn, name)
+                row['category_id'] = categories[name]
+            row.setdefault('updated_at', now)
+        return rows
+
+    def export_products(rows):
+        if not embed_images:
+            return rows
+        for row in rows:
+            row['_image'] = None
+            if row.get('image_hash'):
+                path = image_store.path(row['image_hash'], extension_for(row.get('image_mime')))
+                if os.path.exists(path):
+                    with open(path, 'rb') as fh:
+                        row['_image'] = base64.b64encode(fh.read()).decode('ascii')
+        return rows
+
+    def report(table, rows, rate):
+        click.echo(f'\r{table}: {rows:,} rows ({rate:,.0f} rows/s)', nl=False, err=True)
+
+    return bulk.BulkIO(db.engine, {name: db.metadata.tables[name] for name in BULK_TABLES}, chunk_size=chunk_size,
+                       import_hooks={'products': import_products}, export_hooks={'products': export_products},
+                       progress=bulk.Progress(report))
+
+
+@gamestore_cli.command('export')
+@click.argument('tables', nargs=-1)
+@click.option('--out', 'out', default=None, help='file (one table, "-" = stdout) or directory [default: <table>.<format>]')
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default='csv', show_default=True)
+@click.option('--embed-images', is_flag=True, help='include the image store originals (base64 "_image" column)')
+@click.option('--chunk-size', default=5000, show_default=True)
+def export_command(tables, out, fmt, embed_images, chunk_size):
+    """Export tables (default: products; "all" = every table) as CSV/NDJSON."""
+    tables = BULK_TABLES if 'all' in tables else (tables or ('products',))
+    unknown = [t for t in tables if t not in BULK_TABLES]
+    if unknown:
+        raise click.BadParameter(f'unknown table(s) {", ".join(unknown)}; known: {", ".join(BULK_TABLES)}')
+    io_ = make_bulk_io(chunk_size, embed_images=embed_images)
+    ext = 'csv' if fmt == 'csv' else 'ndjson'
+    for table in tables:
+        if len(tables) == 1 and out and not os.path.isdir(out):
+            path = out
+        else:
+            path = os.path.join(out or '.', f'{table}.{ext}')
+        with bulk.open_text(path, 'w') as fh:
+            n = io_.export_table(table, fh, fmt)
+        click.echo(f'\r{table}: {n:,} rows -> {path} ({io_.progress.rate(table):,.0f} rows/s)', err=True)
+
+
+@gamestore_cli.command('import')
+@click.argument('paths', nargs=-1, required=True)
+@click.option('--table', default=None, help='target table [default: from the file name, e.g. products.csv]')
+@click.option('--format', 'fmt', type=click.Choice(bulk.FORMATS), default=None, help='[default: from the file name]')
+@click.option('--mode', type=click.Choice(bulk.MODES), default='upsert', show_default=True)
+@click.option('--key', default=None, help='comma-separated upsert key [default: primary key], e.g. sku')
+@click.option('--chunk-size', default=5000, show_default=True)
+def import_command(paths, table, fmt, mode, key, chunk_size):
+    """Import CSV/NDJSON files (or a directory written by "export") in chunks."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            # a directory from "gamestore export all": tables in dependency order
+            for name in BULK_TABLES:
+                for ext in ('csv', 'ndjson', 'csv.gz', 'ndjson.gz'):
+                    candidate = os.path.join(path, f'{name}.{ext}')
+                    if os.path.exists(candidate):
+                        files.append((name, candidate))
+        else:
+            files.append((table or os.path.basename(path).split('.')[0], path))
+    unknown = [name for name, _ in files if name not in BULK_TABLES]
+    if unknown:
+        raise click.BadParameter(f'unknown table(s) {", ".join(unknown)}; use --table ({", ".join(BULK_TABLES)})')
+    images = set()
+    io_ = make_bulk_io(chunk_size, imported_images=images)
+    t0 = time.perf_counter()
+    total = 0
+    for name, path in files:
+        n = io_.import_file(name, path, fmt=fmt, mode=mode, key=key.split(',') if key else None)
+        total += n
+        click.echo(f'\r{name}: {n:,} rows from {path} ({io_.progress.rate(name):,.0f} rows/s)', err=True)
+    imported = {name for name, _ in files}
+    io_.reset_sequences(imported)
+    if 'products' in imported:
+        catalog_changed()
+    for digest, mime in images:
+        enqueue_image_variants(digest, mime)
+    if imported & {'orders', 'order_items'}:
+        job_queue.enqueue('sales.rebuild', dedupe_key='all')
+    db.session.commit()
+    elapsed = time.perf_counter() - t0
+    click.echo(f'{total:,} rows imported in {elapsed:.1f}s ({total / elapsed if elapsed else 0:,.0f} rows/s)')
 
 @app.route('/api/products', methods=['POST'])
 def api_create_product():
@@ -823,29 +2212,51 @@ def api_create_product():
     img = data.get('img')
     if not title:
         return jsonify({'error': 'title required'}), 400
-    p = Product(title=title, price=price, img=img)
+    try:
+        stock = parse_stock(data.get('stock'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'stock must be a non-negative integer or null'}), 400
+    p = Product(title=title, price=price, img=img, stock=stock)
     db.session.add(p)
     db.session.commit()
+    catalog_changed()
     return jsonify(p.to_dict()), 201
 
 
 @app.route('/api/products/<int:pid>', methods=['GET', 'PUT', 'DELETE'])
 def api_product_detail(pid):
+    if request.method == 'GET':
+        # validate against the row's updated_at before loading the product
+        row = db.session.query(Product.updated_at).filter(Product.id == pid).first()
+        if not row:
+            abort(404)
+        updated_at = row[0]
+        etag = weak_etag('product', pid, updated_at or get_catalog_version()[0])
+        cache_opts = catalog_cache_options()
+        resp = not_modified(etag, updated_at, **cache_opts)
+        if resp is not None:
+            return resp
+        return set_cache_headers(jsonify(db.session.get(Product, pid).to_dict()), etag, updated_at, **cache_opts)
     p = Product.query.get(pid)
     if not p:
         abort(404)
-    if request.method == 'GET':
-        return jsonify(p.to_dict())
     if request.method == 'PUT':
         data = request.get_json() or {}
         p.title = data.get('title', p.title)
         p.price = data.get('price', p.price)
         p.img = data.get('img', p.img)
+        if 'stock' in data:
+            try:
+                p.stock = parse_stock(data['stock'])
+            except (TypeError, ValueError):
+                return jsonify({'error': 'stock must be a non-negative integer or null'}), 400
         db.session.commit()
+        catalog_changed()
         return jsonify(p.to_dict())
     if request.method == 'DELETE':
         db.session.delete(p)
         db.session.commit()
+        catalog_changed()
         return ('', 204)
 
 
@@ -861,64 +2272,181 @@ def checkout():
             return jsonify({'error': 'CSRF token missing or invalid'}), 400
         abort(400, 'CSRF token missing or invalid')
 
-    cart = session.get('cart', {}) or {}
+    as_json = (request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+               or request.accept_mimetypes.accept_json)
+    try:
+        key = checkout_idempotency_key()
+    except ValueError as e:
+        if as_json:
+            return jsonify({'error': str(e)}), 400
+        abort(400, str(e))
+    scope = _cart_key(create=True)
+    if key:
+        # already completed (the cart is empty by now): replay before looking at the cart
+        done = db.session.get(IdempotencyKey, (scope, key))
+        if done is not None:
+            return replay_checkout(done, as_json)
+
+    state = get_cart_state()
+    cart = state['cart']
     if not cart:
         # nothing to checkout
-        if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if as_json:
             return jsonify({'error': 'cart empty'}), 400
         flash('El carrito está vacío.')
         return redirect(url_for('view_cart'))
 
-    # Create order and order items
-    order = Order(user_id=session.get('user_id'))
-    db.session.add(order)
-    db.session.flush()  # get order.id
-
-    total = 0.0
-    for pid_str, qty in list(cart.items()):
-        try:
-            pid = int(pid_str)
-            qty = int(qty)
-        except Exception:
-            continue
-        product = Product.query.get(pid)
-        if not product:
-            continue
-        price = float(product.price or 0.0)
-        oi = OrderItem(order_id=order.id, product_id=product.id, quantity=qty, price=price)
-        db.session.add(oi)
-        total += price * qty
+    items, total = price_cart(cart)
+    method, details = checkout_payment_details()
+    if not items:
+        # only unknown/removed products left in the cart
+        if as_json:
+            return jsonify({'error': 'cart empty'}), 400
+        flash('El carrito está vacío.')
+        return redirect(url_for('view_cart'))
 
-    order.total = total
-    db.session.commit()
+    # Una sola transacción: clave de idempotencia, stock, pedido, líneas y resúmenes.
+    # The key row is inserted first: a concurrent duplicate blocks on it until this
+    # transaction ends and then gets an IntegrityError (replayed below).
+    try:
+        record = None
+        if key:
+            record = IdempotencyKey(scope=scope, key=key)
+            db.session.add(record)
+            db.session.flush()
+        short = reserve_stock(items)
+        if short:
+            db.session.rollback()
+            titles = [it['title'] for it in items if it['id'] in short]
+            if as_json:
+                return jsonify({'error': 'out of stock', 'product_ids': short}), 409
+            flash('Sin stock suficiente para: ' + ', '.join(titles))
+            return redirect(url_for('view_cart'))
+
+        # created_at set here (not by the server) so the sales rollup books the same day
+        order = Order(user_id=session.get('user_id'), total=total, created_at=datetime.utcnow(),
+                      cart_key=_cart_key(create=True))
+        db.session.add(order)
+        db.session.flush()  # get order.id
+        # one executemany INSERT for all line items
+        db.session.execute(db.insert(OrderItem), [
+            {'order_id': order.id, 'product_id': it['id'], 'quantity': it['qty'], 'price': it['price']}
+            for it in items
+        ])
+        payment = Payment(order_id=order.id, amount=total, method=method, status=payments.PENDING)
+        db.session.add(payment)
+        db.session.flush()
+        # the gateway is called by a job committed with the order (it survives a crash of this
+        # process); the sales rollups are updated once the payment is captured (payment_finished)
+        job_queue.enqueue('payments.process', {'payment_id': payment.id, 'details': details},
+                          dedupe_key=f'payment:{payment.id}')
+        body = {'ok': True, 'order_id': order.id, 'total': total, 'payment': {
+            'id': payment.id, 'status': payment.status,
+            'status_url': url_for('payment_status', payment_id=payment.id)}}
+        if record is not None:
+            record.order_id = order.id
+            record.status_code = 200
+            record.response = json.dumps(body)
+        # clear cart (favorites are kept), committed with the order; a failed payment
+        # puts the lines back (payment_finished)
+        state['cart'] = {}
+        save_cart_state(state)
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        done = db.session.get(IdempotencyKey, (scope, key)) if key else None
+        if done is None:
+            raise
+        return replay_checkout(done, as_json)
 
-    # clear cart
-    session.pop('cart', None)
+    # the stock changed: new catalog version (own short transaction, so the shared
+    # catalog_state row is not locked for the whole checkout)
+    catalog_changed()
+    remember_order(order.id)
 
     # Respond JSON for AJAX requests, otherwise render the final page
-    if request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest' or request.accept_mimetypes.accept_json:
-        return jsonify({'ok': True, 'order_id': order.id, 'total': total})
+    if as_json:
+        return jsonify(body)
 
     flash('Compra completada. Gracias por su compra.')
-    return render_template('CompraFinalizada.html', order=order)
+    return render_template('CompraFinalizada.html', order=order, payment=payment)
 
 
 @app.route('/pagar')
 def pagar_page():
     # Render payment screen, similar to view_cart but present payment form
-    cart = session.get('cart', {})
-    items = []
-    total = 0.0
-    for pid_str, qty in cart.items():
-        try:
-            pid = int(pid_str)
-            qty = int(qty)
-        except Exception:
-            continue
-        p = Product.query.get(pid)
-        if not p:
-            continue
-        subtotal = (p.price or 0.0) * qty
-        items.append({'id': p.id, 'title': p.title, 'price': p.price, 'img': p.img, 'qty': qty, 'subtotal': subtotal, 'category': getattr(p, 'category', None)})
-        total += subtotal
+    items, total = price_cart(get_cart_state()['cart'])
     return render_template('Pagar.html', cart_items=items, subtotal=total, total=total)
+
+
+def payment_json(payment):
+    return {'id': payment.id, 'order_id': payment.order_id, 'status': payment.status,
+            'amount': payment.amount, 'method': payment.method, 'error': payment.error,
+            'final': payment.status in payments.FINAL}
+
+
+@app.route('/payments/<int:payment_id>')
+def payment_status(payment_id):
+    """Payment state for the buyer. ``?wait=N`` long-polls up to N seconds
+    (capped by PAYMENT_POLL_MAX_WAIT) until the status differs from ``?status=``
+    (default: the current one) or the payment is final.
+    """
+    payment = db.session.get(Payment, payment_id)
+    order = db.session.get(Order, payment.order_id) if payment and payment.order_id else None
+    if order is None or not can_view_order(order):
+        return jsonify({'error': 'not found'}), 404
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), app.config['PAYMENT_POLL_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    if wait and payment.status not in payments.FINAL:
+        known = request.args.get('status') or payment.status
+        # end the read transaction so each check sees the worker's latest commit
+        db.session.rollback()
+
+        def read_status():
+            status = db.session.execute(
+                db.select(Payment.status).where(Payment.id == payment_id)).scalar_one()
+            db.session.rollback()
+            return status
+
+        payment_processor.wait_for_change(read_status, known, wait)
+        db.session.refresh(payment)
+    resp = jsonify(payment_json(payment))
+    resp.headers['Cache-Control'] = 'no-store'
+    return resp
+
+
+def init_extensions():
+    """Bind the database extension and its engine hooks to the module-level ``app``.
+
+    Not an application factory: ``app``, its configuration and its routes are
+    built at module level (one app per process), and this runs when the
+    module is imported, so wsgi.py, "flask --app app", alembic and the scripts
+    all get a ready app from ``import app``. It only binds the extension (the
+    engine connects on first use); the schema check and the embedded job
+    worker wait for the first request (init_on_first_request) and seeding is
+    the explicit "gamestore seed" command. Calling it again does nothing.
+    """
+    if 'sqlalchemy' not in app.extensions:
+        db.init_app(app)
+        with app.app_context():
+            db_config.configure_engine(db.engine)
+            request_metrics.instrument_engine(db.engine)
+            if app.config['QUERY_PROFILER']:
+                query_profiler.instrument_engine(db.engine)
+    return app
+
+
+init_extensions()
+
+
+if __name__ == '__main__':
+    # Solo desarrollo: servidor de Werkzeug en un proceso, con el depurador si FLASK_DEBUG=1.
+    # En producción: gunicorn -c gunicorn.conf.py wsgi:app (ver README_SERVING.md).
+    # Esquema al día y datos de ejemplo antes de arrancar el servidor.
+    with app.app_context():
+        init_db()
+        seed_sample_data()
+    app.run(debug=os.environ.get('FLASK_DEBUG') == '1', host=os.environ.get('HOST', '0.0.0.0'),
+            port=int(os.environ.get('PORT', '5000')))
@@ -1,5 +1,5 @@
-import { Chart } from "@/components/ui/chart"
 // Dashboard Analytics - Chart.js Implementation
+// Datos de /admin/api/reports/* (resúmenes de ventas precalculados)
 
 document.addEventListener("DOMContentLoaded", () => {
   // Wait for Chart.js to load from CDN
@@ -11,18 +11,42 @@ document.addEventListener("DOMContentLoaded", () => {
   }
 })
 
+const SALES_PERIODS = {
+  week: { days: 7, granularity: "day" },
+  month: { days: 30, granularity: "day" },
+  year: { days: 365, granularity: "month" },
+}
+
+function isoDay(d) {
+  return d.toISOString().slice(0, 10)
+}
+
+function reportUrl(path, days, params = {}) {
+  const to = new Date()
+  const from = new Date(to.getTime() - (days - 1) * 86400000)
+  const query = new URLSearchParams({ from: isoDay(from), to: isoDay(to), ...params })
+  return `/admin/api/reports/${path}?${query}`
+}
+
+function fetchReport(url) {
+  return fetch(url, { credentials: "same-origin" }).then((r) => {
+    if (!r.ok) throw new Error(`${url}: ${r.status}`)
+    return r.json()
+  })
+}
+
 function initSalesChart() {
   const ctx = document.getElementById("salesChart")
   if (!ctx) return
 
-  new Chart(ctx, {
+  const chart = new Chart(ctx, {
     type: "line",
     data: {
-      labels: ["Sem 1", "Sem 2", "Sem 3", "Sem 4"],
+      labels: [],
       datasets: [
         {
           label: "Ventas",
-          data: [12000, 19000, 15000, 25000],
+          data: [],
           borderColor: "#a21caf",
           backgroundColor: "rgba(162, 28, 175, 0.1)",
           tension: 0.4,
@@ -48,20 +72,37 @@ function initSalesChart() {
       },
     },
   })
+
+  const select = document.getElementById("salesPeriod")
+  const load = () => {
+    const period = SALES_PERIODS[(select && select.value) || "month"] || SALES_PERIODS.month
+    fetchReport(reportUrl("revenue", period.days, { granularity: period.granularity }))
+      .then((data) => {
+        chart.data.labels = data.series.map((p) => p.period)
+        chart.data.datasets[0].data = data.series.map((p) => p.revenue)
+        chart.update()
+        const today = data.series[data.series.length - 1]
+        const stat = document.querySelector('[data-stat="daily-sales"]')
+        if (stat && today && period.granularity === "day") stat.textContent = "$" + today.revenue.toLocaleString()
+      })
+      .catch((err) => console.error(err))
+  }
+  if (select) select.addEventListener("change", load)
+  load()
 }
 
 function initTopProductsChart() {
   const ctx = document.getElementById("topProductsChart")
   if (!ctx) return
 
-  new Chart(ctx, {
+  const chart = new Chart(ctx, {
     type: "bar",
     data: {
-      labels: ["PS5", "Xbox Series X", "Nintendo Switch", "DualSense", "FIFA 24"],
+      labels: [],
       datasets: [
         {
           label: "Unidades Vendidas",
-          data: [45, 38, 52, 67, 89],
+          data: [],
           backgroundColor: ["#a21caf", "#c026d3", "#d946ef", "#e879f9", "#f0abfc"],
         },
       ],
@@ -81,4 +122,12 @@ function initTopProductsChart() {
       },
     },
   })
+
+  fetchReport(reportUrl("top-products", 30, { limit: 5 }))
+    .then((data) => {
+      chart.data.labels = data.products.map((p) => p.title || `#${p.product_id}`)
+      chart.data.datasets[0].data = data.products.map((p) => p.units)
+      chart.update()
+    })
+    .catch((err) => console.error(err))
 }
@@ -149,6 +149,50 @@
 
         // Checkout handler: if we're on the Cart page, go to payment screen; if on payment screen, perform the POST.
         var checkout = document.getElementById('checkoutBtn');
+        // One Idempotency-Key per checkout attempt: retries and the form fallback reuse it,
+        // so a double submit replays the first order instead of creating another one.
+        // A declined payment ends that attempt: the next one gets a new key (see below).
+        function newCheckoutKey(){
+            return (window.crypto && window.crypto.randomUUID) ? window.crypto.randomUUID()
+                : String(Date.now()) + '-' + Math.random().toString(16).slice(2);
+        }
+        var checkoutKey = newCheckoutKey();
+        // Payment method and the last four card digits only: the full card number never leaves the page.
+        function paymentDetails(){
+            var method = document.querySelector('input[name="metodo-pago"]:checked, input[name="payment-method"]:checked');
+            var card = document.getElementById('no_tarjeta');
+            var digits = card ? card.value.replace(/\D/g, '') : '';
+            return {payment_method: method ? method.value : 'card', card_last4: digits.slice(-4)};
+        }
+        function submitCheckoutForm(){
+            var f = document.createElement('form');
+            f.method = 'POST'; f.action = '/checkout';
+            var fields = paymentDetails();
+            fields.csrf_token = csrf;
+            fields.idempotency_key = checkoutKey;
+            Object.keys(fields).forEach(function(name){
+                var inp = document.createElement('input'); inp.type = 'hidden'; inp.name = name; inp.value = fields[name]; f.appendChild(inp);
+            });
+            document.body.appendChild(f);
+            f.submit();
+        }
+        // Long-poll the payment status until the worker captures or fails it.
+        function watchPayment(url, status, done){
+            fetch(url + '?wait=20&status=' + encodeURIComponent(status || ''), {headers: {'Accept': 'application/json'}})
+                .then(function(r){ return r.json(); })
+                .then(function(p){
+                    if(p.final){ done(p); return; }
+                    watchPayment(url, p.status, done);
+                })
+                .catch(function(){ setTimeout(function(){ watchPayment(url, status, done); }, 2000); });
+        }
+        var paymentStatusEl = document.querySelector('[data-payment-url]');
+        if(paymentStatusEl){
+            var statusText = paymentStatusEl.querySelector('.estado-pago-texto') || paymentStatusEl;
+            watchPayment(paymentStatusEl.getAttribute('data-payment-url'), paymentStatusEl.getAttribute('data-payment-status'), function(p){
+                statusText.textContent = p.status === 'captured' ? 'Pago confirmado' : 'Pago rechazado' + (p.error ? ' (' + p.error + ')' : '');
+            });
+        }
         if(checkout){
             checkout.addEventListener('click', function(e){
                 e.preventDefault();
@@ -166,8 +210,8 @@
                 showToast('Procesando pago...');
                 fetch('/checkout', {
                     method: 'POST',
-                    headers: {'Content-Type':'application/json','X-CSRF-Token': csrf},
-                    body: JSON.stringify({csrf_token: csrf})
+                    headers: {'Content-Type':'application/json','X-CSRF-Token': csrf, 'Idempotency-Key': checkoutKey},
+                    body: JSON.stringify(Object.assign({csrf_token: csrf}, paymentDetails()))
                 }).then(function(r){
                     // Try to parse JSON, but handle non-JSON gracefully
                     return r.text().then(function(text){
@@ -181,8 +225,23 @@
                     checkout.disabled = false;
                     checkout.classList.remove('loading');
                     if(j && j.ok){
-                        showToast('Pedido creado: ' + j.order_id);
-                        setTimeout(function(){ window.location = '/'; }, 800);
+                        showToast('Pedido creado: ' + j.order_id + ' — procesando pago...');
+                        if(!j.payment){
+                            setTimeout(function(){ window.location = '/'; }, 800);
+                            return;
+                        }
+                        checkout.disabled = true;
+                        watchPayment(j.payment.status_url, j.payment.status, function(p){
+                            if(p.status === 'captured'){
+                                showToast('Pago confirmado');
+                                setTimeout(function(){ window.location = '/pedidos'; }, 800);
+                            }else{
+                                showToast('Pago rechazado' + (p.error ? ': ' + p.error : ''), 5000);
+                                // reusing the key would only replay the failed order
+                                checkoutKey = newCheckoutKey();
+                                checkout.disabled = false;
+                            }
+                        });
                         return;
                     }
                     if(j && j.error){
@@ -193,11 +252,7 @@
                     if(j && j.__raw_text){
                         showToast('Respuesta recibida — intentando completar pago...');
                         // create and submit a form as a fallback
-                        var f = document.createElement('form');
-                        f.method = 'POST'; f.action = '/checkout';
-                        var inp = document.createElement('input'); inp.type = 'hidden'; inp.name = 'csrf_token'; inp.value = csrf; f.appendChild(inp);
-                        document.body.appendChild(f);
-                        f.submit();
+                        submitCheckoutForm();
                         return;
                     }
                     showToast('Error creando el pedido');
@@ -206,11 +261,7 @@
                     checkout.disabled = false;
                     checkout.classList.remove('loading');
                     showToast('Error en checkout — intentando por formulario');
-                    var f = document.createElement('form');
-                    f.method = 'POST'; f.action = '/checkout';
-                    var inp = document.createElement('input'); inp.type = 'hidden'; inp.name = 'csrf_token'; inp.value = csrf; f.appendChild(inp);
-                    document.body.appendChild(f);
-                    f.submit();
+                    submitCheckoutForm();
                 });
             });
         }
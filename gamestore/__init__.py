@@ -0,0 +1 @@
+"""Support modules for the GameStore Flask application (see app.py)."""
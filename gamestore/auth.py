@@ -0,0 +1,294 @@
+"""Password hashing off the request threads and login throttling.
+
+Password hashes are deliberately slow (scrypt by default: ~100 ms of CPU
+and 32 MB of memory each). ``PasswordHasher`` runs them on a small pool
+(threads by default -- hashlib's KDFs release the GIL -- or processes) with a
+hard limit on the hashes waiting: when the pool and its queue are full the
+call fails at once with ``HasherBusy`` instead of piling up request threads,
+so a burst of logins can use at most ``workers`` cores and never the whole
+server. It also reports when a stored hash was made with other parameters
+than the configured ones, so the login can rehash it with the password it
+just checked.
+
+``LoginThrottle`` applies token buckets per IP and per username before any
+hashing happens: each attempt takes a token, tokens come back at a fixed
+rate up to the bucket's capacity (the allowed burst). Buckets live in a
+``ThrottleStore``:
+
+* ``MemoryThrottleStore`` -- per process (LRU-bounded); with N worker
+  processes an attacker gets up to N times the limit.
+* ``SqlThrottleStore`` -- one row per bucket, updated with a single
+  conditional UPDATE, shared by every process and machine.
+"""
+import math
+import multiprocessing
+import secrets
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from dataclasses import dataclass
+
+from sqlalchemy import case, delete, select, update
+from werkzeug.security import check_password_hash, generate_password_hash
+
+POOLS = ('thread', 'process')
+
+
+class HasherBusy(RuntimeError):
+    """Every hashing slot and queue place is taken, or the hash timed out; the caller should answer 503."""
+
+
+def method_prefix(stored_hash):
+    """'scrypt:32768:8:1' from 'scrypt:32768:8:1$salt$hash' (the parameters a hash was made with)."""
+    return (stored_hash or '').split('$', 1)[0]
+
+
+class PasswordHasher:
+    """Werkzeug hashes computed on a bounded pool (see the module docstring)."""
+
+    def __init__(self, method='scrypt', workers=2, max_queue=8, pool='thread', timeout=10.0):
+        if pool not in POOLS:
+            raise ValueError(f'pool must be one of {POOLS}')
+        self.method = method
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pool = pool
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + max_queue)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._prefix = None
+        self._dummy = None
+        self.in_flight = 0
+        self.metrics = defaultdict(int)
+        self.seconds = 0.0
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored_hash, password):
+        """True if ``password`` matches; an unknown user (None) costs the same time and fails."""
+        if not stored_hash:
+            self._run(check_password_hash, self._dummy_hash(), password)
+            return False
+        return self._run(check_password_hash, stored_hash, password)
+
+    def needs_rehash(self, stored_hash):
+        """True when ``stored_hash`` was not made with the configured method/parameters."""
+        if self._prefix is None:
+            # once per process, on the calling thread: going through the pool could fail
+            # with HasherBusy after the password was already accepted
+            self._prefix = method_prefix(generate_password_hash(secrets.token_hex(16), self.method))
+        return method_prefix(stored_hash) != self._prefix
+
+    def stats(self):
+        return {'method': self.method, 'pool': self.pool, 'workers': self.workers, 'max_queue': self.max_queue,
+                'in_flight': self.in_flight, **self.metrics,
+                'avg_ms': round(self.seconds * 1000 / self.metrics['completed'], 1) if self.metrics['completed'] else 0}
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+
+    def _dummy_hash(self):
+        if self._dummy is None:
+            self._dummy = self._run(generate_password_hash, secrets.token_hex(16), self.method)
+        return self._dummy
+
+    def _pool(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.pool == 'process':
+                        # spawn: forking a process that runs request threads is unsafe
+                        self._executor = ProcessPoolExecutor(self.workers,
+                                                             mp_context=multiprocessing.get_context('spawn'))
+                    else:
+                        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='passwords')
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.metrics['rejected'] += 1
+            raise HasherBusy('password hashing queue is full')
+        with self._lock:
+            self.in_flight += 1
+        start = time.perf_counter()
+        try:
+            future = self._pool().submit(fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+        try:
+            result = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            # the hash keeps its slot until it really ends (done callback)
+            with self._lock:
+                self.metrics['timed_out'] += 1
+            raise HasherBusy(f'password hashing took more than {self.timeout:g} s')
+        with self._lock:
+            self.metrics['completed'] += 1
+            self.seconds += time.perf_counter() - start
+        return result
+
+    def _release(self, future=None):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+
+def tune_scrypt(target_ms, r=8, p=1, start_n=2 ** 12, max_n=2 ** 20):
+    """Largest scrypt ``n`` (power of two) hashing within ``target_ms`` here: 'scrypt:n:r:p'."""
+    best, n = start_n, start_n
+    while n <= max_n:
+        method = f'scrypt:{n}:{r}:{p}'
+        t0 = time.perf_counter()
+        generate_password_hash('tune-password', method)
+        if (time.perf_counter() - t0) * 1000 > target_ms:
+            break
+        best = n
+        n *= 2
+    return f'scrypt:{best}:{r}:{p}'
+
+
+# -- throttling ------------------------------------------------------------------
+
+@dataclass
+class Bucket:
+    """``capacity`` attempts at once, then one more every ``1 / per_second`` seconds."""
+    capacity: float
+    per_second: float
+
+    @classmethod
+    def per_minute(cls, burst, per_minute):
+        return cls(float(burst), per_minute / 60.0)
+
+
+class ThrottleStore:
+    """Interface for token bucket backends."""
+
+    def take(self, key, bucket, now=None):
+        """Take one token from ``key``'s bucket: 0.0 if allowed, else seconds until a token is back."""
+        raise NotImplementedError
+
+
+class MemoryThrottleStore(ThrottleStore):
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, bucket, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            tokens, updated = self._data.get(key, (bucket.capacity, now))
+            tokens = min(bucket.capacity, tokens + (now - updated) * bucket.per_second)
+            if tokens < 1:
+                self._data[key] = (tokens, now)
+                self._data.move_to_end(key)
+                return (1 - tokens) / bucket.per_second
+            self._data[key] = (tokens - 1, now)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                # the oldest buckets are the fullest ones: dropping them refills them
+                self._data.popitem(last=False)
+        return 0.0
+
+
+class SqlThrottleStore(ThrottleStore):
+    """Buckets in a model with ``key``, ``tokens`` and ``updated_at`` (epoch seconds).
+
+    Runs on its own connection so it never commits the caller's session.
+    """
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def take(self, key, bucket, now=None):
+        now = time.time() if now is None else now
+        t = self.model.__table__
+        refilled = t.c.tokens + (now - t.c.updated_at) * bucket.per_second
+        refilled = case((refilled > bucket.capacity, bucket.capacity), else_=refilled)
+        with self.db.engine.begin() as conn:
+            for _ in range(2):
+                taken = conn.execute(update(t).where(t.c.key == key, refilled >= 1)
+                                     .values(tokens=refilled - 1, updated_at=now))
+                if taken.rowcount:
+                    return 0.0
+                row = conn.execute(select(t.c.tokens, t.c.updated_at).where(t.c.key == key)).first()
+                if row is not None:
+                    tokens = min(bucket.capacity, row.tokens + (now - row.updated_at) * bucket.per_second)
+                    return (1 - tokens) / bucket.per_second
+                if _insert_missing(conn, t, {'key': key, 'tokens': bucket.capacity - 1, 'updated_at': now}):
+                    return 0.0
+                # another process created the bucket meanwhile: take from it
+        return 0.0
+
+    def purge(self, buckets, now=None):
+        """Delete rows whose bucket has refilled completely (same as no row); returns the count."""
+        now = time.time() if now is None else now
+        t = self.model.__table__
+        slowest = min(b.per_second for b in buckets)
+        capacity = max(b.capacity for b in buckets)
+        with self.db.engine.begin() as conn:
+            return conn.execute(delete(t).where(t.c.updated_at < now - capacity / slowest)).rowcount
+
+
+def _insert_missing(conn, table, values):
+    """INSERT that does nothing if the key exists; True when the row was inserted."""
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        return conn.execute(dialect_insert(table).values(**values).on_conflict_do_nothing()).rowcount == 1
+    from sqlalchemy.exc import IntegrityError
+    try:
+        with conn.begin_nested():
+            conn.execute(table.insert().values(**values))
+        return True
+    except IntegrityError:
+        return False
+
+
+class LoginThrottle:
+    """Token buckets per IP and per username, checked before any password is hashed."""
+
+    def __init__(self, store, per_user, per_ip):
+        self.store = store
+        self.per_user = per_user
+        self.per_ip = per_ip
+        self.metrics = defaultdict(int)
+
+    def check(self, username=None, ip=None):
+        """0.0 if the attempt may go ahead, else seconds to wait (for Retry-After).
+
+        The IP bucket is checked first, so attempts already refused for their
+        address do not drain the bucket of the account they target.
+        """
+        if ip:
+            wait = self.store.take(f'ip:{ip}', self.per_ip)
+            if wait:
+                self.metrics['ip_throttled'] += 1
+                return wait
+        if username:
+            wait = self.store.take(f'user:{username.strip().lower()[:150]}', self.per_user)
+            if wait:
+                self.metrics['user_throttled'] += 1
+                return wait
+        self.metrics['allowed'] += 1
+        return 0.0
+
+    def buckets(self):
+        return (self.per_user, self.per_ip)
+
+
+def retry_after(seconds):
+    """Retry-After header value (whole seconds, at least 1)."""
+    return str(max(1, math.ceil(seconds)))
@@ -0,0 +1,399 @@
+"""Bulk import/export of tables as CSV or NDJSON.
+
+Files are streamed in chunks of ``chunk_size`` rows in both directions, so
+memory stays flat whatever the file size. Every chunk is written in its own
+transaction with one statement per chunk:
+
+* PostgreSQL: ``COPY`` into a temporary staging table, then
+  ``INSERT ... SELECT ... ON CONFLICT (key) DO UPDATE`` (plain ``COPY`` into
+  the table with ``mode='insert'``);
+* SQLite: ``executemany`` of ``INSERT ... ON CONFLICT (key) DO UPDATE``;
+* keys without a unique index (or other databases): one ``SELECT ... IN`` per
+  chunk to find existing rows, then an ``executemany`` UPDATE and INSERT.
+
+Rows without a value for the key are inserted; when a key appears more than
+once in a chunk the last row wins (on every backend). An interrupted import leaves
+the chunks already written committed; running it again upserts the rest.
+
+Values: binary columns are base64 text, dates ISO 8601, and in CSV an empty
+field is NULL. Columns starting with ``_`` are extras for the table hooks
+(e.g. ``_image`` on products), anything else unknown is an error.
+
+Hooks let the app adapt rows per table: ``export_hooks[table](rows)`` and
+``import_hooks[table](connection, rows)`` get and return a list of dicts.
+
+``insert_tuples`` is the fast path for rows the caller built itself (e.g.
+scripts/generate_dataset.py): tuples already of the column types, appended
+without coercion, hooks or conflict handling.
+"""
+import base64
+import csv
+import gzip
+import io
+import json
+import sys
+import time
+from datetime import date, datetime
+
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, LargeBinary, Numeric, bindparam, inspect, select, tuple_
+
+FORMATS = ('csv', 'ndjson')
+MODES = ('upsert', 'insert')
+
+csv.field_size_limit(sys.maxsize)
+
+
+def format_for(path, default='csv'):
+    """'csv' or 'ndjson' from a file name (``.csv``, ``.ndjson``, ``.jsonl``, optionally ``.gz``)."""
+    name = str(path).lower()
+    if name.endswith('.gz'):
+        name = name[:-3]
+    if name.endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def open_text(path, mode='r'):
+    """Open ``path`` as text ('-' is stdin/stdout, ``.gz`` is gzip-compressed)."""
+    if str(path) == '-':
+        stream = sys.stdin if 'r' in mode else sys.stdout
+        return io.TextIOWrapper(stream.buffer, encoding='utf-8', newline='') if hasattr(stream, 'buffer') else stream
+    if str(path).endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def read_rows(fh, fmt):
+    """Yield dicts from a CSV (with header) or NDJSON stream."""
+    if fmt == 'csv':
+        yield from csv.DictReader(fh)
+        return
+    for line in fh:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def chunked(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode(value):
+    """Python value -> JSON/CSV friendly value."""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def converter(column):
+    """Function turning a CSV/JSON value into the Python type of ``column``."""
+    kind = column.type
+    if isinstance(kind, Boolean):
+        return lambda v: v if isinstance(v, bool) else str(v).strip().lower() in ('1', 'true', 't', 'yes', 'y')
+    if isinstance(kind, Integer):
+        return lambda v: v if isinstance(v, int) else int(float(v))
+    if isinstance(kind, (Float, Numeric)):
+        return float
+    if isinstance(kind, DateTime):
+        return lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(str(v))
+    if isinstance(kind, Date):
+        return lambda v: v if isinstance(v, date) else date.fromisoformat(str(v)[:10])
+    if isinstance(kind, LargeBinary):
+        return lambda v: v if isinstance(v, bytes) else base64.b64decode(v)
+    return str
+
+
+class Progress:
+    """Rows done and rows/s per table; ``report(table, rows, rate)`` is called after every chunk."""
+
+    def __init__(self, report=None):
+        self.report = report
+        self.rows = {}
+        self.seconds = {}
+
+    def start(self, table):
+        self.rows[table] = 0
+        self._started = time.perf_counter()
+
+    def add(self, table, n):
+        self.rows[table] += n
+        self.seconds[table] = time.perf_counter() - self._started
+        if self.report:
+            self.report(table, self.rows[table], self.rate(table))
+
+    def rate(self, table):
+        seconds = self.seconds.get(table) or 0
+        return self.rows.get(table, 0) / seconds if seconds else 0.0
+
+
+class BulkIO:
+    """Import/export for ``tables`` (name -> Table) over ``engine``."""
+
+    def __init__(self, engine, tables, chunk_size=5000, import_hooks=None, export_hooks=None, progress=None):
+        self.engine = engine
+        self.tables = tables
+        self.chunk_size = chunk_size
+        self.import_hooks = import_hooks or {}
+        self.export_hooks = export_hooks or {}
+        self.progress = progress or Progress()
+        self._plans = {}
+
+    # -- export ----------------------------------------------------------------
+
+    def export_table(self, name, fh, fmt, columns=None):
+        """Stream table ``name`` into ``fh``; returns the number of rows."""
+        table = self.tables[name]
+        cols = [table.c[c] for c in columns] if columns else list(table.c)
+        stmt = select(*cols).order_by(*table.primary_key.columns)
+        hook = self.export_hooks.get(name)
+        writer = None
+        self.progress.start(name)
+        with self.engine.connect() as conn:
+            result = conn.execution_options(yield_per=self.chunk_size).execute(stmt)
+            for chunk in result.partitions(self.chunk_size):
+                rows = [dict(r._mapping) for r in chunk]
+                if hook:
+                    rows = hook(rows)
+                if fmt == 'csv':
+                    if writer is None:
+                        header = list(rows[0]) if rows else [c.name for c in cols]
+                        writer = csv.DictWriter(fh, fieldnames=header, extrasaction='ignore')
+                        writer.writeheader()
+                    writer.writerows({k: encode(v) for k, v in row.items()} for row in rows)
+                else:
+                    fh.writelines(json.dumps({k: encode(v) for k, v in row.items()}, ensure_ascii=False) + '\n'
+                                  for row in rows)
+                self.progress.add(name, len(rows))
+        if fmt == 'csv' and writer is None:
+            csv.writer(fh).writerow([c.name for c in cols])
+        return self.progress.rows[name]
+
+    # -- import ----------------------------------------------------------------
+
+    def import_rows(self, name, rows, mode='upsert', key=None):
+        """Write an iterable of dicts into table ``name``; returns the number of rows."""
+        self.progress.start(name)
+        for chunk in chunked(rows, self.chunk_size):
+            with self.engine.begin() as conn:
+                self.write_chunk(conn, name, chunk, mode=mode, key=key)
+            self.progress.add(name, len(chunk))
+        return self.progress.rows.get(name, 0)
+
+    def write_chunk(self, conn, name, rows, mode='upsert', key=None):
+        """Write one chunk of dicts in the caller's transaction (e.g. next to a checkpoint)."""
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}')
+        table = self.tables[name]
+        key = list(key or [c.name for c in table.primary_key.columns])
+        converters, strategy = self._plan(table, tuple(key))
+        rows = [self._coerce(name, row, converters) for row in rows]
+        hook = self.import_hooks.get(name)
+        if hook:
+            rows = hook(conn, rows)
+        if mode == 'upsert':
+            rows = _last_per_key(rows, key)
+        fresh = []
+        for columns, group in _by_columns(rows):
+            keyed = [row for row in group if all(row.get(k) is not None for k in key)]
+            if len(keyed) < len(group):
+                fresh.append((columns, [row for row in group if any(row.get(k) is None for k in key)]))
+            if keyed and mode == 'upsert':
+                strategy(conn, table, columns, keyed, key)
+            elif keyed:
+                self._insert(conn, table, columns, keyed)
+        # after the keyed rows, so a generated id cannot take a key the chunk still has to write
+        for columns, group in fresh:
+            self._insert(conn, table, [c for c in columns if c not in key], group)
+
+    def insert_tuples(self, conn, name, columns, rows):
+        """Append ``rows`` (tuples in ``columns`` order, already typed) to table ``name``."""
+        if not rows:
+            return
+        table = self.tables[name]
+        if self.engine.dialect.name == 'postgresql':
+            _copy_values(conn, table.name, columns, rows)
+            return
+        dialect = conn.dialect
+        marker = {'qmark': '?', 'format': '%s', 'pyformat': '%s'}.get(dialect.paramstyle)
+        if marker is None:
+            conn.execute(table.insert(), [dict(zip(columns, r)) for r in rows])
+            return
+        # the dialect's own bind conversions (e.g. datetime -> text on SQLite), only where there is one
+        processors = [(i, p) for i, p in enumerate(
+            table.c[c].type.dialect_impl(dialect).bind_processor(dialect) for c in columns) if p]
+        if processors:
+            converted = []
+            for r in rows:
+                r = list(r)
+                for i, p in processors:
+                    if r[i] is not None:
+                        r[i] = p(r[i])
+                converted.append(tuple(r))
+            rows = converted
+        q = dialect.identifier_preparer.quote
+        conn.exec_driver_sql(f"INSERT INTO {q(table.name)} ({', '.join(q(c) for c in columns)}) "
+                             f"VALUES ({', '.join([marker] * len(columns))})", rows)
+
+    def import_file(self, name, path, fmt=None, mode='upsert', key=None):
+        fmt = fmt or format_for(path)
+        with open_text(path) as fh:
+            return self.import_rows(name, read_rows(fh, fmt), mode=mode, key=key)
+
+    def reset_sequences(self, names):
+        """PostgreSQL: move each serial primary key sequence past the imported ids."""
+        if self.engine.dialect.name != 'postgresql':
+            return
+        with self.engine.begin() as conn:
+            for name in names:
+                pk = list(self.tables[name].primary_key.columns)
+                if len(pk) != 1 or not isinstance(pk[0].type, Integer):
+                    continue
+                conn.exec_driver_sql(
+                    f"SELECT setval(pg_get_serial_sequence('{name}', '{pk[0].name}'), "
+                    f"COALESCE((SELECT MAX({pk[0].name}) FROM {name}), 0) + 1, false)")
+
+    def _coerce(self, name, row, converters):
+        out = {}
+        for k, v in row.items():
+            if k.startswith('_'):
+                out[k] = v
+                continue
+            if k not in converters:
+                raise ValueError(f'{name}: unknown column {k!r}')
+            column, convert = converters[k]
+            if v is None or (v == '' and (column.nullable or convert is not str)):
+                out[k] = None
+            else:
+                out[k] = convert(v)
+        return out
+
+    def _plan(self, table, key):
+        """Column converters and write strategy for (table, key), computed once."""
+        cache = self._plans
+        if (table.name, key) not in cache:
+            converters = {c.name: (c, converter(c)) for c in table.c}
+            dialect = self.engine.dialect.name
+            if dialect in ('sqlite', 'postgresql') and self._is_unique(table, list(key)):
+                strategy = self._copy_upsert if dialect == 'postgresql' else self._on_conflict
+            else:
+                strategy = self._merge
+            cache[(table.name, key)] = (converters, strategy)
+        return cache[(table.name, key)]
+
+    def _is_unique(self, table, key):
+        if set(key) == {c.name for c in table.primary_key.columns}:
+            return True
+        insp = inspect(self.engine)
+        unique = [set(ix['column_names']) for ix in insp.get_indexes(table.name) if ix.get('unique')]
+        unique += [set(uc['column_names']) for uc in insp.get_unique_constraints(table.name)]
+        return set(key) in unique
+
+    def _insert(self, conn, table, columns, rows):
+        if self.engine.dialect.name == 'postgresql':
+            _copy(conn, table.name, columns, rows)
+            return
+        conn.execute(table.insert(), [{c: r.get(c) for c in columns} for r in rows])
+
+    def _on_conflict(self, conn, table, columns, rows, key):
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+        stmt = sqlite_insert(table)
+        update = {c: stmt.excluded[c] for c in columns if c not in key}
+        stmt = stmt.on_conflict_do_update(index_elements=key, set_=update) if update else stmt.on_conflict_do_nothing()
+        conn.execute(stmt, [{c: r.get(c) for c in columns} for r in rows])
+
+    def _copy_upsert(self, conn, table, columns, rows, key):
+        q = conn.dialect.identifier_preparer.quote
+        stage = f'_bulk_{table.name}'
+        cols = ', '.join(q(c) for c in columns)
+        conn.exec_driver_sql(f'CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {q(table.name)} INCLUDING DEFAULTS) '
+                             f'ON COMMIT DROP')
+        # it lives until the commit: empty it, or the rows of the chunk's other column groups are upserted again
+        conn.exec_driver_sql(f'TRUNCATE {stage}')
+        _copy(conn, stage, columns, rows)
+        update = ', '.join(f'{q(c)} = EXCLUDED.{q(c)}' for c in columns if c not in key)
+        conflict = f'DO UPDATE SET {update}' if update else 'DO NOTHING'
+        conn.exec_driver_sql(f'INSERT INTO {q(table.name)} ({cols}) SELECT {cols} FROM {stage} '
+                             f'ON CONFLICT ({", ".join(q(k) for k in key)}) {conflict}')
+
+    def _merge(self, conn, table, columns, rows, key):
+        key_cols = [table.c[k] for k in key]
+        wanted = {tuple(r[k] for k in key) for r in rows}
+        existing = set()
+        probe = tuple_(*key_cols) if len(key_cols) > 1 else key_cols[0]
+        values = list(wanted) if len(key_cols) > 1 else [k[0] for k in wanted]
+        for part in chunked(values, 500):
+            existing.update(tuple(r) for r in conn.execute(select(*key_cols).where(probe.in_(part))))
+        updates = [r for r in rows if tuple(r[k] for k in key) in existing]
+        inserts = [r for r in rows if tuple(r[k] for k in key) not in existing]
+        data_cols = [c for c in columns if c not in key]
+        if updates and data_cols:
+            stmt = (table.update()
+                    .where(*[table.c[k] == bindparam(f'k_{k}') for k in key])
+                    .values({c: bindparam(f'v_{c}') for c in data_cols}))
+            conn.execute(stmt, [{**{f'k_{k}': r[k] for k in key}, **{f'v_{c}': r.get(c) for c in data_cols}}
+                                for r in updates])
+        if inserts:
+            conn.execute(table.insert(), [{c: r.get(c) for c in columns} for r in inserts])
+
+
+def _last_per_key(rows, key):
+    """Drop the earlier rows of a key repeated in the chunk (an upsert cannot touch a row twice)."""
+    keys = [tuple(row.get(c) for c in key) for row in rows]
+    last = {k: i for i, k in enumerate(keys) if None not in k}
+    if len(last) == sum(1 for k in keys if None not in k):
+        return rows
+    return [row for i, (row, k) in enumerate(zip(rows, keys)) if None in k or last[k] == i]
+
+
+def _by_columns(rows):
+    """Group rows by their column set (NDJSON rows may differ); extras are dropped."""
+    groups = {}
+    for row in rows:
+        columns = tuple(k for k in row if not k.startswith('_'))
+        groups.setdefault(columns, []).append(row)
+    return list(groups.items())
+
+
+def _copy(conn, table_name, columns, rows):
+    """COPY ``rows`` (dicts) into ``table_name`` through the DBAPI connection (psycopg2 or psycopg 3)."""
+    _copy_values(conn, table_name, columns, ([r.get(c) for c in columns] for r in rows))
+
+
+def _copy_values(conn, table_name, columns, rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for r in rows:
+        writer.writerow([_copy_value(v) for v in r])
+    q = conn.dialect.identifier_preparer.quote
+    sql = f"COPY {q(table_name)} ({', '.join(q(c) for c in columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    raw = conn.connection.driver_connection
+    with raw.cursor() as cur:
+        if hasattr(cur, 'copy_expert'):
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+        else:
+            with cur.copy(sql) as copy:
+                copy.write(buf.getvalue())
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
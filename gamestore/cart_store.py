@@ -0,0 +1,124 @@
+"""Server-side storage for shopping carts and favorites.
+
+The signed session cookie only carries an opaque cart id (anonymous visitors)
+or the user id; the cart itself lives in one of these backends:
+
+* ``MemoryCartStore`` -- in-process LRU, for development and single-process
+  deployments. Contents are lost on restart.
+* ``SqlCartStore`` -- one row per cart in the ``cart_states`` table, shared by
+  all workers and persistent for logged-in users. Writes join the caller's
+  transaction (the route commits); ``purge`` deletes anonymous carts nobody
+  touched for a while (``flask gamestore purge-carts``).
+
+Any key/value service with get/set/delete (e.g. Redis with ``GET``/``SET
+EX``/``DEL`` on the JSON document) can be plugged in by implementing the
+three methods of ``CartStore``.
+
+A stored state is a dict ``{'cart': {pid_str: qty}, 'favorites': [pid_str]}``.
+"""
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+
+def empty_state():
+    return {'cart': {}, 'favorites': []}
+
+
+def merge_states(into, other):
+    """Add the quantities and favorites of ``other`` to ``into`` (in place)."""
+    cart = into.setdefault('cart', {})
+    for pid, qty in (other.get('cart') or {}).items():
+        cart[pid] = cart.get(pid, 0) + qty
+    favs = into.setdefault('favorites', [])
+    for pid in other.get('favorites') or []:
+        if pid not in favs:
+            favs.append(pid)
+    return into
+
+
+class CartStore:
+    """Interface for cart backends. Keys are opaque strings."""
+
+    def load(self, key):
+        """Return the stored state for ``key`` or None."""
+        raise NotImplementedError
+
+    def save(self, key, state):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def purge(self, older_than):
+        """Delete anonymous carts not saved since ``older_than`` (a datetime); returns how many."""
+        raise NotImplementedError
+
+
+class MemoryCartStore(CartStore):
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            raw = self._data.get(key)
+            if raw is None:
+                return None
+            self._data.move_to_end(key)
+        # stored serialised so callers never share mutable state between requests
+        return json.loads(raw)
+
+    def save(self, key, state):
+        raw = json.dumps(state)
+        with self._lock:
+            self._data[key] = raw
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def purge(self, older_than):
+        # bounded by max_entries: the least recently used carts are already dropped
+        return 0
+
+
+class SqlCartStore(CartStore):
+    """Stores states as JSON in a model with ``key``, ``data`` and ``updated_at``."""
+
+    def __init__(self, db, model):
+        self.db = db
+        self.model = model
+
+    def load(self, key):
+        row = self.db.session.get(self.model, key)
+        if row is None:
+            return None
+        try:
+            return json.loads(row.data)
+        except ValueError:
+            return None
+
+    def save(self, key, state):
+        row = self.db.session.get(self.model, key)
+        if row is None:
+            row = self.model(key=key)
+            self.db.session.add(row)
+        row.data = json.dumps(state)
+        row.updated_at = datetime.utcnow()
+
+    def delete(self, key):
+        self.db.session.query(self.model).filter_by(key=key).delete(synchronize_session=False)
+
+    def purge(self, older_than):
+        # user carts stay: they are the logged-in user's saved cart
+        deleted = (self.db.session.query(self.model)
+                   .filter(self.model.key.like('anon:%'), self.model.updated_at < older_than)
+                   .delete(synchronize_session=False))
+        self.db.session.commit()
+        return deleted
@@ -0,0 +1,192 @@
+"""Database engine configuration driven by environment variables.
+
+``engine_options()`` builds ``SQLALCHEMY_ENGINE_OPTIONS`` for the configured
+URL and ``configure_engine()`` installs the per-connection setup once the
+engine exists.
+
+PostgreSQL (and other server databases):
+
+    DB_POOL_SIZE             persistent connections per process   (10)
+    DB_MAX_OVERFLOW          extra connections under burst        (20)
+    DB_POOL_TIMEOUT          seconds to wait for a connection     (30)
+    DB_POOL_RECYCLE          reconnect after N seconds            (1800)
+    DB_POOL_PRE_PING         test connections on checkout         (1)
+    DB_STATEMENT_TIMEOUT_MS  server-side statement_timeout        (30000, 0 = off)
+    DB_LOCK_TIMEOUT_MS       server-side lock_timeout             (0 = off)
+
+SQLite (pragmas applied on every new connection):
+
+    SQLITE_JOURNAL_MODE      WAL lets readers and one writer work concurrently (WAL)
+    SQLITE_SYNCHRONOUS       NORMAL is durable enough in WAL mode  (NORMAL)
+    SQLITE_BUSY_TIMEOUT_MS   wait instead of "database is locked"  (5000)
+    SQLITE_MMAP_SIZE         bytes of memory-mapped I/O            (268435456)
+    SQLITE_CACHE_SIZE        page cache; negative = KiB            (-65536)
+
+Both kinds of database use ``InstrumentedQueuePool`` so checkout counts and
+time spent waiting for a free connection are visible in ``pool_metrics``.
+"""
+import os
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+def _env_int(env, name, default):
+    value = env.get(name)
+    if value in (None, ''):
+        return default
+    return int(value)
+
+
+def _is_sqlite(url):
+    return url.startswith('sqlite')
+
+
+def _is_sqlite_memory(url):
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+
+class PoolMetrics:
+    """Process-wide counters for the connection pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.wait_count = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.wait_count += 1
+            self.wait_seconds_total += seconds
+            if seconds > self.wait_seconds_max:
+                self.wait_seconds_max = seconds
+            if timed_out:
+                self.timeouts += 1
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool=None):
+        with self._lock:
+            data = {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'invalidations': self.invalidations,
+                'timeouts': self.timeouts,
+                'wait_count': self.wait_count,
+                'wait_seconds_total': round(self.wait_seconds_total, 6),
+                'wait_seconds_max': round(self.wait_seconds_max, 6),
+            }
+        if pool is not None and hasattr(pool, 'checkedout'):
+            data.update({
+                'pool_size': pool.size(),
+                'checked_out': pool.checkedout(),
+                'checked_in': pool.checkedin(),
+                'overflow': pool.overflow(),
+            })
+        return data
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that measures how long callers wait for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record_wait(time.perf_counter() - start)
+        return conn
+
+
+def engine_options(database_url, env=os.environ):
+    """SQLALCHEMY_ENGINE_OPTIONS for ``database_url``."""
+    if _is_sqlite(database_url):
+        if _is_sqlite_memory(database_url):
+            # every connection would get its own empty database; keep the default pool
+            return {}
+        return {
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': _env_int(env, 'DB_POOL_SIZE', 5),
+            'max_overflow': _env_int(env, 'DB_MAX_OVERFLOW', 10),
+            'pool_timeout': _env_int(env, 'DB_POOL_TIMEOUT', 30),
+        }
+
+    options = {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': _env_int(env, 'DB_POOL_SIZE', 10),
+        'max_overflow': _env_int(env, 'DB_MAX_OVERFLOW', 20),
+        'pool_timeout': _env_int(env, 'DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int(env, 'DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': bool(_env_int(env, 'DB_POOL_PRE_PING', 1)),
+    }
+    if database_url.startswith('postgres'):
+        server_options = []
+        statement_timeout = _env_int(env, 'DB_STATEMENT_TIMEOUT_MS', 30000)
+        if statement_timeout:
+            server_options.append(f'-c statement_timeout={statement_timeout}')
+        lock_timeout = _env_int(env, 'DB_LOCK_TIMEOUT_MS', 0)
+        if lock_timeout:
+            server_options.append(f'-c lock_timeout={lock_timeout}')
+        if server_options:
+            options['connect_args'] = {'options': ' '.join(server_options)}
+    return options
+
+
+def sqlite_pragmas(env=os.environ):
+    return [
+        ('journal_mode', env.get('SQLITE_JOURNAL_MODE', 'WAL')),
+        ('synchronous', env.get('SQLITE_SYNCHRONOUS', 'NORMAL')),
+        ('busy_timeout', _env_int(env, 'SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        ('mmap_size', _env_int(env, 'SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        ('cache_size', _env_int(env, 'SQLITE_CACHE_SIZE', -64 * 1024)),
+    ]
+
+
+def configure_engine(engine, env=os.environ):
+    """Install pragmas (SQLite) and pool metric listeners on ``engine``."""
+    if engine.dialect.name == 'sqlite' and not _is_sqlite_memory(str(engine.url)):
+        pragmas = sqlite_pragmas(env)
+
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_conn, connection_record):
+            cur = dbapi_conn.cursor()
+            try:
+                for name, value in pragmas:
+                    cur.execute(f'PRAGMA {name}={value}')
+            finally:
+                cur.close()
+
+    @event.listens_for(engine, 'connect')
+    def _on_connect(dbapi_conn, connection_record):
+        pool_metrics.incr('connects')
+
+    @event.listens_for(engine, 'checkout')
+    def _on_checkout(dbapi_conn, connection_record, connection_proxy):
+        pool_metrics.incr('checkouts')
+
+    @event.listens_for(engine, 'checkin')
+    def _on_checkin(dbapi_conn, connection_record):
+        pool_metrics.incr('checkins')
+
+    @event.listens_for(engine, 'invalidate')
+    def _on_invalidate(dbapi_conn, connection_record, exception):
+        pool_metrics.incr('invalidations')
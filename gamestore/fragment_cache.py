@@ -0,0 +1,86 @@
+"""In-process cache for rendered page fragments and query results.
+
+Entries expire after ``ttl`` seconds and the least recently used ones are
+evicted beyond ``max_entries``. Every entry also records the cache *version*
+at the time it was stored; catalog writes call ``bump()`` so everything
+cached before the change is treated as a miss on the next lookup.
+
+Only shared (per-catalog) markup belongs here. Per-visitor bits such as the
+CSRF token or favorite markers are added after the lookup.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class FragmentCache:
+    def __init__(self, max_entries=256, ttl=300, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self):
+        """Invalidate every cached entry (called from catalog write paths)."""
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+
+    def sync(self, version):
+        """Adopt an externally tracked version (e.g. shared by all workers)."""
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._entries.clear()
+
+    def get(self, key):
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                version, expires, value = entry
+                if version == self.version and expires > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def set(self, key, value, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                # the catalog changed while the value was being built
+                return
+            self._entries[key] = (self.version, self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            version = self.version
+            value = factory()
+            self.set(key, value, version=version)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'version': self.version,
+            }
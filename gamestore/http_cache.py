@@ -0,0 +1,47 @@
+"""Conditional GET helpers for catalog responses.
+
+Views compute a validator *before* doing any real work (usually from the
+catalog version, see ``get_catalog_version`` in app.py) and call
+``not_modified()``; when the client already has that representation a bare
+``304`` is returned and the query/render is skipped entirely.
+"""
+import hashlib
+
+from flask import Response, request
+
+
+def weak_etag(*parts):
+    """Short opaque validator derived from ``parts``."""
+    raw = '\x1f'.join(str(p) for p in parts).encode('utf-8')
+    return hashlib.sha1(raw).hexdigest()[:24]
+
+
+def not_modified(etag, last_modified=None, **cache):
+    """Return a 304 response if the request's validators match, else None.
+
+    ``If-None-Match`` takes precedence; ``If-Modified-Since`` is only used when
+    the client sent no ETag (RFC 9110, section 13.2.2).
+    """
+    if request.if_none_match:
+        matched = request.if_none_match.contains_weak(etag)
+    elif last_modified is not None and request.if_modified_since is not None:
+        matched = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        matched = False
+    if not matched:
+        return None
+    return set_cache_headers(Response(status=304), etag, last_modified, **cache)
+
+
+def set_cache_headers(resp, etag, last_modified=None, max_age=0, stale_while_revalidate=60, private=False):
+    """Attach a weak ETag, Last-Modified and a revalidation-friendly Cache-Control."""
+    resp.set_etag(etag, weak=True)
+    if last_modified is not None:
+        resp.last_modified = last_modified
+    directives = ['private' if private else 'public', f'max-age={int(max_age)}']
+    if stale_while_revalidate:
+        directives.append(f'stale-while-revalidate={int(stale_while_revalidate)}')
+    resp.headers['Cache-Control'] = ', '.join(directives)
+    if private:
+        resp.vary.add('Cookie')
+    return resp
@@ -0,0 +1,135 @@
+"""Content-addressed image storage on disk.
+
+Product images are stored as files named after the SHA-256 of their bytes, so
+the same upload is only kept once and a stored file never changes. That lets
+us serve them with a strong ETag (the digest itself) and long-lived
+``immutable`` cache headers, and lets the WSGI server stream them with
+``sendfile`` instead of pulling the bytes through the ORM.
+
+Layout::
+
+    <root>/<digest[:2]>/<digest>.<ext>            original upload
+    <root>/<digest[:2]>/<digest>_<size>.<fmt>     resized variant (image_variants)
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from flask import request, send_file, make_response
+
+# one year: the URL changes whenever the content changes
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+EXTENSIONS = {
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/jpg': 'jpg',
+    'image/webp': 'webp',
+}
+MIMETYPES = {
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'webp': 'image/webp',
+}
+
+_NAME_RE = re.compile(r'^([0-9a-f]{64})(?:_([a-z]+))?\.([a-z0-9]+)$')
+
+
+def extension_for(mimetype):
+    return EXTENSIONS.get((mimetype or '').lower(), 'bin')
+
+
+def parse_name(name):
+    """Split '<digest>[_<size>].<ext>' into (digest, size, ext).
+
+    ``size`` is None for the original upload. Returns None if malformed.
+    """
+    m = _NAME_RE.match(name or '')
+    if not m:
+        return None
+    return m.group(1), m.group(2), m.group(3)
+
+
+class ImageStore:
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], f'{digest}.{ext}')
+
+    def variant_path(self, digest, size, fmt):
+        return os.path.join(self.root, digest[:2], f'{digest}_{size}.{fmt}')
+
+    def exists(self, digest, ext):
+        return os.path.exists(self.path(digest, ext))
+
+    def variant_exists(self, digest, size, fmt):
+        return os.path.exists(self.variant_path(digest, size, fmt))
+
+    def put(self, data, mimetype):
+        """Store ``data`` (once per distinct content) and return its hex digest."""
+        digest = hashlib.sha256(data).hexdigest()
+        target = self.path(digest, extension_for(mimetype))
+        if not os.path.exists(target):
+            write_atomic(target, data)
+        return digest
+
+    def put_variant(self, digest, size, fmt, data):
+        write_atomic(self.variant_path(digest, size, fmt), data)
+
+    def send(self, digest, ext, size=None, max_age=IMMUTABLE_MAX_AGE, immutable=True):
+        """Build a response for a stored image (or one of its variants).
+
+        A matching ``If-None-Match`` is answered with ``304`` before the file
+        is even opened. Otherwise the file is handed to ``send_file`` so the
+        server can use ``wsgi.file_wrapper``/``sendfile`` and Range requests.
+        Returns None when the file is missing.
+        """
+        if size:
+            path = self.variant_path(digest, size, ext)
+            etag = f'{digest}-{size}-{ext}'
+        else:
+            path = self.path(digest, ext)
+            etag = digest
+        if request.if_none_match.contains(etag):
+            resp = make_response('', 304)
+            resp.set_etag(etag)
+            _cache_headers(resp, max_age, immutable)
+            return resp
+        if not os.path.exists(path):
+            return None
+        resp = send_file(path, mimetype=MIMETYPES.get(ext, 'application/octet-stream'),
+                         etag=etag, conditional=True, max_age=max_age)
+        _cache_headers(resp, max_age, immutable)
+        return resp
+
+
+def write_atomic(target, data):
+    """Write ``data`` to ``target`` through a temporary file and a rename.
+
+    Concurrent writers of the same content are harmless and readers never
+    observe a partially written file.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(data)
+        os.replace(tmp, target)
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _cache_headers(resp, max_age, immutable):
+    resp.cache_control.public = True
+    resp.cache_control.max_age = max_age
+    if immutable:
+        resp.cache_control.immutable = True
+    else:
+        resp.cache_control.no_cache = None
+        resp.cache_control.must_revalidate = True
@@ -0,0 +1,89 @@
+"""Resized image variants generated at upload time.
+
+Every uploaded product image gets a few downscaled copies (``SIZES``) in WebP
+and JPEG, written next to the original in the image store. Resizing runs as a
+background job ('images.variants', see gamestore/jobs.py) so the admin
+request that uploaded the image returns immediately; until a variant exists
+callers fall back to the original.
+
+Pillow is optional: without it no variants are produced and the originals are
+served as before.
+"""
+import io
+
+# Pillow is imported on first use (see _pil), not when the app is imported.
+Image = False
+
+# name -> longest side in pixels
+SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 1200,
+}
+FORMATS = ('webp', 'jpg')
+
+_SAVE_OPTIONS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+
+def _pil():
+    global Image
+    if Image is False:
+        try:
+            from PIL import Image as pil_image
+        except ImportError:  # pragma: no cover - depends on the environment
+            pil_image = None
+        Image = pil_image
+    return Image
+
+
+def available():
+    return _pil() is not None
+
+
+def negotiate_format(accept_mimetypes):
+    """Pick the variant format for a request's ``Accept`` header.
+
+    WebP is only chosen when the client lists it explicitly; a bare ``*/*``
+    gets JPEG, which every client can decode.
+    """
+    for value, quality in accept_mimetypes:
+        if value == 'image/webp' and quality > 0:
+            return 'webp'
+    return 'jpg'
+
+
+def render_variants(store, digest, ext):
+    """Create every missing size/format variant of a stored original."""
+    if _pil() is None:
+        return 0
+    created = 0
+    with Image.open(store.path(digest, ext)) as original:
+        original.load()
+        for size, edge in SIZES.items():
+            img = original.copy()
+            # thumbnail() keeps the aspect ratio and never upscales
+            img.thumbnail((edge, edge), Image.LANCZOS)
+            for fmt in FORMATS:
+                if store.variant_exists(digest, size, fmt):
+                    continue
+                out = img
+                if fmt == 'jpg' and out.mode not in ('RGB', 'L'):
+                    out = _flatten(out)
+                elif fmt == 'webp' and out.mode not in ('RGB', 'RGBA'):
+                    out = out.convert('RGBA')
+                buf = io.BytesIO()
+                out.save(buf, **_SAVE_OPTIONS[fmt])
+                store.put_variant(digest, size, fmt, buf.getvalue())
+                created += 1
+    return created
+
+
+def _flatten(img):
+    """Composite transparent images onto white for JPEG output."""
+    rgba = img.convert('RGBA')
+    bg = Image.new('RGB', rgba.size, (255, 255, 255))
+    bg.paste(rgba, mask=rgba.split()[3])
+    return bg
@@ -0,0 +1,372 @@
+"""Durable background jobs backed by a SQL table (no external broker).
+
+Request handlers call ``JobQueue.enqueue()`` inside their own transaction, so
+a job exists exactly when the data it refers to was committed. Workers claim
+due jobs with a single UPDATE (``FOR UPDATE SKIP LOCKED`` on PostgreSQL),
+run the registered handler in an app context and mark the job done in the
+same transaction as the handler's own writes. Failures are retried with
+exponential backoff until ``max_attempts``, then the job is left ``dead`` for
+inspection. Jobs whose worker died are put back after ``visibility_timeout``.
+
+    queued --claim--> running --ok--> done
+       ^                 |
+       +---retry (backoff)+--too many attempts--> dead
+
+Workers run as a separate process (``flask gamestore worker``, optionally
+several processes with a thread pool each) or embedded in the web process
+for development.
+"""
+import atexit
+import json
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, update
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+DEAD = 'dead'
+STATUSES = (QUEUED, RUNNING, DONE, DEAD)
+
+log = logging.getLogger(__name__)
+
+
+class UnknownJob(LookupError):
+    pass
+
+
+def backoff(attempt, base=2.0, cap=600.0):
+    """Seconds before retry number ``attempt`` (1-based): base * 2^(n-1), capped, +-20% jitter."""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobQueue:
+    """Enqueue, claim and settle jobs; ``model`` is the ``jobs`` table model."""
+
+    def __init__(self, db, model, max_attempts=5, backoff_base=2.0, visibility_timeout=300):
+        self.db = db
+        self.model = model
+        self.table = model.__table__
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.visibility_timeout = visibility_timeout
+        self.handlers = {}
+
+    def task(self, name):
+        """Decorator registering ``fn(payload)`` as the handler of jobs called ``name``."""
+        def register(fn):
+            self.handlers[name] = fn
+            return fn
+        return register
+
+    def enqueue(self, name, payload=None, delay=0, max_attempts=None, dedupe_key=None):
+        """Add a job to the current session (the caller commits).
+
+        With ``dedupe_key`` nothing is added while a queued/running job with the
+        same name and key exists. Returns the job, or None when deduplicated.
+        """
+        if name not in self.handlers:
+            raise UnknownJob(name)
+        session = self.db.session
+        if dedupe_key is not None:
+            pending = session.execute(
+                select(self.table.c.id).where(self.table.c.name == name, self.table.c.dedupe_key == dedupe_key,
+                                              self.table.c.status.in_((QUEUED, RUNNING))).limit(1)).first()
+            if pending is not None:
+                return None
+        now = datetime.utcnow()
+        job = self.model(name=name, payload=json.dumps(payload or {}), status=QUEUED, attempts=0,
+                         max_attempts=max_attempts or self.max_attempts, dedupe_key=dedupe_key,
+                         run_at=now + timedelta(seconds=delay), created_at=now)
+        session.add(job)
+        return job
+
+    def claim(self, token, limit):
+        """Mark up to ``limit`` due jobs as running for ``token``; returns (id, name, payload, attempts) rows."""
+        t = self.table
+        now = datetime.utcnow()
+        session = self.db.session
+        due = select(t.c.id).where(t.c.status == QUEUED, t.c.run_at <= now).order_by(t.c.run_at, t.c.id).limit(limit)
+        if session.get_bind().dialect.name == 'postgresql':
+            due = due.with_for_update(skip_locked=True)
+        # one statement: the status check and the claim cannot interleave with another worker
+        session.execute(update(t).where(t.c.id.in_(due.scalar_subquery()), t.c.status == QUEUED)
+                        .values(status=RUNNING, locked_by=token, locked_at=now, attempts=t.c.attempts + 1)
+                        .execution_options(synchronize_session=False))
+        rows = session.execute(select(t.c.id, t.c.name, t.c.payload, t.c.attempts, t.c.max_attempts)
+                               .where(t.c.status == RUNNING, t.c.locked_by == token)).all()
+        session.commit()
+        return rows
+
+    def complete(self, job_id, token):
+        """Mark a claimed job done (in the caller's transaction, next to the handler's writes)."""
+        t = self.table
+        self.db.session.execute(update(t).where(t.c.id == job_id, t.c.locked_by == token)
+                                .values(status=DONE, finished_at=datetime.utcnow(), last_error=None)
+                                .execution_options(synchronize_session=False))
+
+    def fail(self, job_id, token, attempts, max_attempts, error):
+        """Schedule a retry with backoff, or bury the job after ``max_attempts``. Returns the new status."""
+        t = self.table
+        now = datetime.utcnow()
+        if attempts >= max_attempts:
+            values = {'status': DEAD, 'finished_at': now}
+        else:
+            values = {'status': QUEUED, 'run_at': now + timedelta(seconds=backoff(attempts, self.backoff_base)),
+                      'locked_by': None}
+        self.db.session.execute(update(t).where(t.c.id == job_id, t.c.locked_by == token)
+                                .values(last_error=str(error)[:2000], **values)
+                                .execution_options(synchronize_session=False))
+        self.db.session.commit()
+        return values['status']
+
+    def release(self, job_ids, token):
+        """Give back claimed jobs that never started (worker stopping); the attempt is not counted."""
+        if not job_ids:
+            return
+        t = self.table
+        self.db.session.execute(update(t).where(t.c.id.in_(job_ids), t.c.locked_by == token, t.c.status == RUNNING)
+                                .values(status=QUEUED, locked_by=None, locked_at=None, attempts=t.c.attempts - 1)
+                                .execution_options(synchronize_session=False))
+        self.db.session.commit()
+
+    def requeue_stale(self):
+        """Put back jobs left running by a worker that died; returns how many.
+
+        The lost run counts as an attempt: a job that has used its
+        ``max_attempts`` (e.g. one that crashes its worker every time) is
+        buried instead.
+        """
+        t = self.table
+        now = datetime.utcnow()
+        stale = (t.c.status == RUNNING, t.c.locked_at < now - timedelta(seconds=self.visibility_timeout))
+        error = f'worker lost (running for more than {self.visibility_timeout:g} s)'
+        session = self.db.session
+        buried = session.execute(update(t).where(*stale, t.c.attempts >= t.c.max_attempts)
+                                 .values(status=DEAD, finished_at=now, last_error=error)
+                                 .execution_options(synchronize_session=False)).rowcount
+        result = session.execute(update(t).where(*stale)
+                                 .values(status=QUEUED, locked_by=None, run_at=now, last_error=error)
+                                 .execution_options(synchronize_session=False))
+        session.commit()
+        if buried:
+            log.error('%d stale jobs reached their max attempts and are dead', buried)
+        return result.rowcount
+
+    def purge(self, older_than):
+        """Delete done/dead jobs finished before ``older_than`` (a datetime)."""
+        t = self.table
+        result = self.db.session.execute(t.delete().where(t.c.status.in_((DONE, DEAD)), t.c.finished_at < older_than))
+        self.db.session.commit()
+        return result.rowcount
+
+    def stats(self, window=timedelta(hours=1)):
+        """Queue depth per job name/status plus run time and wait of recently finished jobs."""
+        t = self.table
+        session = self.db.session
+        now = datetime.utcnow()
+        counts = defaultdict(lambda: dict.fromkeys(STATUSES, 0))
+        for name, status, n in session.execute(select(t.c.name, t.c.status, func.count()).group_by(t.c.name, t.c.status)):
+            counts[name][status] = n
+        oldest = session.execute(select(func.min(t.c.run_at)).where(t.c.status == QUEUED, t.c.run_at <= now)).scalar()
+        recent = session.execute(
+            select(t.c.name, t.c.status, t.c.run_at, t.c.locked_at, t.c.finished_at, t.c.attempts)
+            .where(t.c.finished_at >= now - window).order_by(t.c.finished_at.desc()).limit(10000)).all()
+        session.rollback()
+        by_name = defaultdict(lambda: {'finished': 0, 'dead': 0, 'retried': 0, 'run_ms': [], 'wait_ms': []})
+        for name, status, run_at, locked_at, finished_at, attempts in recent:
+            s = by_name[name]
+            s['finished'] += 1
+            s['dead'] += status == DEAD
+            s['retried'] += attempts > 1
+            if locked_at is not None:
+                s['run_ms'].append((finished_at - locked_at).total_seconds() * 1000)
+                s['wait_ms'].append(max(0.0, (locked_at - run_at).total_seconds() * 1000))
+        recent_stats = {}
+        for name, s in by_name.items():
+            recent_stats[name] = {
+                'finished': s['finished'], 'dead': s['dead'], 'retried': s['retried'],
+                'per_minute': round(s['finished'] / (window.total_seconds() / 60), 2),
+                'run_ms_p50': _percentile(s['run_ms'], 0.5), 'run_ms_p95': _percentile(s['run_ms'], 0.95),
+                'wait_ms_p50': _percentile(s['wait_ms'], 0.5), 'wait_ms_p95': _percentile(s['wait_ms'], 0.95),
+            }
+        return {
+            'counts': dict(counts),
+            'oldest_due_seconds': round((now - oldest).total_seconds(), 1) if oldest else 0.0,
+            'recent': recent_stats,
+        }
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * pct))], 1)
+
+
+class Worker:
+    """Claims jobs and runs them on a thread pool until ``stop()``.
+
+    ``periodic`` callables run (in an app context) with the stale-job check:
+    at start and then every ``stale_check_every`` seconds.
+    """
+
+    def __init__(self, app, queue, threads=4, poll_interval=1.0, name=None, periodic=()):
+        self.app = app
+        self.periodic = tuple(periodic)
+        self.queue = queue
+        self.threads = threads
+        self.poll_interval = poll_interval
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='jobs')
+        self._slots = threading.Semaphore(threads)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.metrics = defaultdict(lambda: {'succeeded': 0, 'retried': 0, 'dead': 0, 'seconds': 0.0})
+
+    def stop(self):
+        self._stop.set()
+
+    def run(self, stale_check_every=60.0):
+        log.info('job worker %s started with %d threads', self.name, self.threads)
+        next_stale_check = 0.0
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    if time.monotonic() >= next_stale_check:
+                        requeued = self.queue.requeue_stale()
+                        if requeued:
+                            log.warning('%d stale jobs put back in the queue', requeued)
+                        for task in self.periodic:
+                            task()
+                        next_stale_check = time.monotonic() + stale_check_every
+                    claimed = self._claim()
+                except Exception:
+                    log.exception('job worker %s could not poll the queue', self.name)
+                    self.queue.db.session.rollback()
+                    claimed = 0
+                finally:
+                    self.queue.db.session.remove()
+            if not claimed:
+                self._stop.wait(self.poll_interval)
+        self._executor.shutdown(wait=True)
+        log.info('job worker %s stopped', self.name)
+
+    def _claim(self):
+        if self._stop.is_set():
+            return 0
+        free = 0
+        while self._slots.acquire(blocking=False):
+            free += 1
+        if not free:
+            # every thread is busy: wait for one instead of polling the table
+            self._slots.acquire(timeout=self.poll_interval)
+            self._slots.release()
+            return 1
+        token = f'{self.name}:{uuid.uuid4().hex[:12]}'
+        rows = self.queue.claim(token, free)
+        for _ in range(free - len(rows)):
+            self._slots.release()
+        for n, row in enumerate(rows):
+            try:
+                if self._stop.is_set():
+                    raise RuntimeError('worker stopping')
+                self._executor.submit(self._run, token, row)
+            except RuntimeError:
+                # stopping, or the pool is already shut down (interpreter exit):
+                # hand the rest back now instead of after the visibility timeout
+                self._stop.set()
+                left = rows[n:]
+                for _ in left:
+                    self._slots.release()
+                self.queue.release([r[0] for r in left], token)
+                return n
+        return len(rows)
+
+    def _run(self, token, row):
+        job_id, name, payload, attempts, max_attempts = row
+        start = time.perf_counter()
+        outcome = 'succeeded'
+        session = self.queue.db.session
+        try:
+            with self.app.app_context():
+                try:
+                    handler = self.queue.handlers.get(name)
+                    if handler is None:
+                        raise UnknownJob(name)
+                    handler(json.loads(payload or '{}'))
+                    self.queue.complete(job_id, token)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    status = self.queue.fail(job_id, token, attempts, max_attempts, f'{type(e).__name__}: {e}')
+                    outcome = 'dead' if status == DEAD else 'retried'
+                    log.log(logging.ERROR if status == DEAD else logging.WARNING,
+                            'job %s (%s) attempt %d/%d failed: %s', job_id, name, attempts, max_attempts, e)
+                finally:
+                    session.remove()
+        finally:
+            with self._lock:
+                m = self.metrics[name]
+                m[outcome] += 1
+                m['seconds'] += time.perf_counter() - start
+            self._slots.release()
+
+    def start_in_background(self):
+        """Run the loop on a daemon thread (embedded worker in the web process)."""
+        thread = threading.Thread(target=self.run, name='jobs-worker', daemon=True)
+        thread.start()
+        atexit.register(self.stop)
+        return thread
+
+
+def run_processes(make_worker, processes):
+    """Run ``processes`` worker processes (each with its own thread pool) until SIGTERM/SIGINT.
+
+    ``make_worker()`` is called in every child after the fork; it must build
+    fresh database connections (e.g. dispose the parent's engine).
+    """
+    if processes <= 1:
+        worker = make_worker()
+        _stop_on_signals(worker)
+        worker.run()
+        return
+
+    def child():
+        worker = make_worker()
+        _stop_on_signals(worker)
+        worker.run()
+
+    ctx = multiprocessing.get_context('fork')
+    children = [ctx.Process(target=child, name=f'jobs-{i}') for i in range(processes)]
+    for p in children:
+        p.start()
+
+    def forward(signum, frame):
+        for p in children:
+            if p.is_alive():
+                os.kill(p.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for p in children:
+        p.join()
+
+
+def _stop_on_signals(worker):
+    def handler(signum, frame):
+        worker.stop()
+    signal.signal(signal.SIGTERM, handler)
+    signal.signal(signal.SIGINT, handler)
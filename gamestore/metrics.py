@@ -0,0 +1,388 @@
+"""Request and database metrics in the Prometheus text format.
+
+``RequestMetrics`` wraps the WSGI app (``middleware``) and listens to the
+engine's cursor events (``instrument_engine``). Per request it records, by
+Flask endpoint:
+
+* latency, request and response size histograms and a request counter by
+  method and status;
+* the SQL statements executed and the time spent in them (histograms per
+  request; statements outside a request, e.g. from background threads, go
+  to a separate counter);
+* requests in flight and the connection pool of ``gamestore.db_config``.
+
+Everything is kept in a few dicts under one lock, so a request costs a
+handful of dict updates and two ``bisect`` calls: cheap enough to leave on.
+
+Pre-fork servers: every worker process has its own numbers. With
+``multiproc_dir`` set, each process writes its snapshot to
+``<dir>/<pid>.json`` every ``flush_seconds`` (and on exit), and ``render()``
+adds up the files of the other processes, so any worker can answer the
+scrape for all of them (other workers' numbers lag by up to
+``flush_seconds``). ``mark_process_dead`` -- called from gunicorn's
+``child_exit`` -- moves a dead worker's counters into ``dead.json`` and
+drops its gauges, so totals never go backwards.
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Prometheus' defaults, plus 25 ms and 250 ms for the fast pages
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+DB_TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# name -> (type, help, buckets)
+FAMILIES = {
+    'gamestore_http_requests_total': ('counter', 'HTTP requests by endpoint, method and status.', None),
+    'gamestore_http_request_duration_seconds': ('histogram', 'Request latency by endpoint.', LATENCY_BUCKETS),
+    'gamestore_http_request_size_bytes': ('histogram', 'Request body size by endpoint.', SIZE_BUCKETS),
+    'gamestore_http_response_size_bytes': ('histogram', 'Response body size by endpoint.', SIZE_BUCKETS),
+    'gamestore_http_requests_in_flight': ('gauge', 'Requests being served.', None),
+    'gamestore_db_queries_per_request': ('histogram', 'SQL statements executed per request.', QUERY_BUCKETS),
+    'gamestore_db_seconds_per_request': ('histogram', 'Time spent in SQL statements per request.',
+                                         DB_TIME_BUCKETS),
+    'gamestore_db_queries_total': ('counter', 'SQL statements, in requests or in the background.', None),
+    'gamestore_db_query_seconds_total': ('counter', 'Time spent in SQL statements.', None),
+    'gamestore_db_pool_checked_out': ('gauge', 'Connections in use.', None),
+    'gamestore_db_pool_size': ('gauge', 'Persistent connections of the pool.', None),
+    'gamestore_db_pool_overflow': ('gauge', 'Connections opened above the pool size.', None),
+    'gamestore_db_pool_checkouts_total': ('counter', 'Connections taken from the pool.', None),
+    'gamestore_db_pool_connects_total': ('counter', 'New database connections.', None),
+    'gamestore_db_pool_timeouts_total': ('counter', 'Waits for a connection that timed out.', None),
+    'gamestore_db_pool_wait_seconds_total': ('counter', 'Time spent waiting for a free connection.', None),
+    'gamestore_processes': ('gauge', 'Live processes included in these metrics.', None),
+}
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+GAUGES = {name for name, (kind, _, _) in FAMILIES.items() if kind == 'gauge'}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+_REQUEST_QUERIES = _key('gamestore_db_queries_total', {'context': 'request'})
+_REQUEST_QUERY_SECONDS = _key('gamestore_db_query_seconds_total', {'context': 'request'})
+_BACKGROUND_QUERIES = _key('gamestore_db_queries_total', {'context': 'background'})
+_BACKGROUND_QUERY_SECONDS = _key('gamestore_db_query_seconds_total', {'context': 'background'})
+
+
+def _dump_key(key):
+    return json.dumps([key[0], list(key[1])])
+
+
+class RequestMetrics:
+    def __init__(self, enabled=True, multiproc_dir=None, flush_seconds=5.0):
+        self.enabled = enabled
+        self.multiproc_dir = multiproc_dir
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._values = {}       # counters and gauges: key -> value
+        self._histograms = {}   # key -> [bucket counts..., sum, count]
+        self._local = threading.local()
+        self._engine = None
+        self._flusher = None
+        self.in_flight = 0
+
+    # -- recording ---------------------------------------------------------------
+
+    def current(self):
+        """(queries, seconds) of the request running in this thread, or None outside requests."""
+        local = self._local
+        if not getattr(local, 'active', False):
+            return None
+        return local.queries, local.db_seconds
+
+    def label(self, endpoint):
+        """Name the request running in this thread (the Flask endpoint, once the URL is matched)."""
+        self._local.endpoint = endpoint
+
+    # both take a key from _key() and run under self._lock
+    def _inc(self, key, amount=1):
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def _observe(self, key, value):
+        buckets = FAMILIES[key[0]][2]
+        data = self._histograms.get(key)
+        if data is None:
+            data = self._histograms[key] = [0] * (len(buckets) + 2)
+        data[bisect.bisect_left(buckets, value)] += 1
+        data[-2] += value
+        data[-1] += 1
+
+    def _begin(self):
+        local = self._local
+        local.active, local.queries, local.db_seconds, local.endpoint = True, 0, 0.0, None
+        with self._lock:
+            self.in_flight += 1
+        if self.multiproc_dir and self._flusher is None:
+            self._start_flusher()
+
+    def _finish(self, method, status, started, request_size, response_size):
+        elapsed = time.perf_counter() - started
+        local = self._local
+        local.active = False
+        endpoint = ('endpoint', local.endpoint or 'unmatched')
+        if method not in METHODS:
+            method = 'other'  # arbitrary methods would add label values without bound
+        labels = (endpoint,)  # already in _key()'s sorted order
+        with self._lock:
+            self.in_flight -= 1
+            self._inc(('gamestore_http_requests_total', (endpoint, ('method', method), ('status', status))))
+            self._observe(('gamestore_http_request_duration_seconds', labels), elapsed)
+            self._observe(('gamestore_http_request_size_bytes', labels), request_size)
+            if response_size is not None:
+                self._observe(('gamestore_http_response_size_bytes', labels), response_size)
+            self._observe(('gamestore_db_queries_per_request', labels), local.queries)
+            self._observe(('gamestore_db_seconds_per_request', labels), local.db_seconds)
+            if local.queries:
+                self._inc(_REQUEST_QUERIES, local.queries)
+                self._inc(_REQUEST_QUERY_SECONDS, local.db_seconds)
+
+    def middleware(self, wsgi_app):
+        """WSGI wrapper timing each request until its body has been sent."""
+        if not self.enabled:
+            return wsgi_app
+        metrics = self
+
+        def instrumented(environ, start_response):
+            started = time.perf_counter()
+            metrics._begin()
+            sent = {'status': '500', 'size': None}
+
+            def _start_response(status, headers, exc_info=None):
+                sent['status'] = status.split(' ', 1)[0]
+                for name, value in headers:
+                    if name.lower() == 'content-length':
+                        sent['size'] = int(value)
+                return start_response(status, headers, exc_info)
+
+            try:
+                request_size = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                request_size = 0
+            try:
+                body = wsgi_app(environ, _start_response)
+            except BaseException:
+                metrics._finish(environ.get('REQUEST_METHOD', ''), '500', started, request_size, None)
+                raise
+            file_wrapper = environ.get('wsgi.file_wrapper')
+            if isinstance(file_wrapper, type) and isinstance(body, file_wrapper):
+                # keep the server's sendfile() path: the time until the headers is recorded
+                metrics._finish(environ.get('REQUEST_METHOD', ''), sent['status'], started,
+                                request_size, sent['size'])
+                return body
+            method, size = environ.get('REQUEST_METHOD', ''), sent['size']
+            return _Body(body, lambda streamed: metrics._finish(
+                method, sent['status'], started, request_size, size if size is not None else streamed),
+                count=size is None)
+        return instrumented
+
+    def instrument_engine(self, engine):
+        """Count statements and their time; ``engine.pool`` also feeds the pool gauges."""
+        from sqlalchemy import event
+        self._engine = engine
+        if not self.enabled:
+            return
+        metrics = self
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            context.metrics_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context.metrics_started
+            local = metrics._local
+            if getattr(local, 'active', False):
+                # added to the totals once, when the request finishes
+                local.queries += 1
+                local.db_seconds += elapsed
+                return
+            with metrics._lock:
+                metrics._inc(_BACKGROUND_QUERIES)
+                metrics._inc(_BACKGROUND_QUERY_SECONDS, elapsed)
+
+    # -- snapshots and multi-process aggregation ---------------------------------
+
+    def snapshot(self):
+        """This process' numbers as JSON-able data (counters, gauges, histograms)."""
+        with self._lock:
+            values = {_dump_key(k): v for k, v in self._values.items()}
+            histograms = {_dump_key(k): list(v) for k, v in self._histograms.items()}
+            in_flight = self.in_flight
+        values[_dump_key(_key('gamestore_http_requests_in_flight', {}))] = in_flight
+        values[_dump_key(_key('gamestore_processes', {}))] = 1
+        if self._engine is not None:
+            from gamestore.db_config import pool_metrics
+            pool = pool_metrics.snapshot(self._engine.pool)
+            for name, field in (('gamestore_db_pool_checked_out', 'checked_out'),
+                                ('gamestore_db_pool_size', 'pool_size'),
+                                ('gamestore_db_pool_overflow', 'overflow'),
+                                ('gamestore_db_pool_checkouts_total', 'checkouts'),
+                                ('gamestore_db_pool_connects_total', 'connects'),
+                                ('gamestore_db_pool_timeouts_total', 'timeouts'),
+                                ('gamestore_db_pool_wait_seconds_total', 'wait_seconds_total')):
+                if field in pool:
+                    values[_dump_key(_key(name, {}))] = pool[field]
+        return {'pid': os.getpid(), 'values': values, 'histograms': histograms}
+
+    def flush(self):
+        """Write this process' snapshot for the other workers (no-op without multiproc_dir)."""
+        if self.multiproc_dir and self.enabled:
+            _write(os.path.join(self.multiproc_dir, f'{os.getpid()}.json'), self.snapshot())
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+        os.makedirs(self.multiproc_dir, exist_ok=True)
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except OSError:
+                pass
+
+    def collect(self):
+        """Snapshots to expose: this process, plus the other processes' files."""
+        snapshots = [self.snapshot()]
+        if self.multiproc_dir:
+            own = os.path.join(self.multiproc_dir, f'{os.getpid()}.json')
+            for path in glob.glob(os.path.join(self.multiproc_dir, '*.json')):
+                if path != own:
+                    data = _read(path)
+                    if data is not None:
+                        snapshots.append(data)
+        return snapshots
+
+    def render(self):
+        return render(merge(self.collect()))
+
+
+class _Body:
+    """Response iterable that reports the bytes sent when the server closes it.
+
+    Chunks are only counted (``count``) when there was no Content-Length.
+    """
+
+    def __init__(self, body, on_close, count=True):
+        self._body = body
+        self._on_close = on_close
+        self._count = count
+        self._sent = 0
+
+    def __iter__(self):
+        if not self._count:
+            return iter(self._body)
+        return self._counting()
+
+    def _counting(self):
+        for chunk in self._body:
+            self._sent += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            if hasattr(self._body, 'close'):
+                self._body.close()
+        finally:
+            self._on_close(self._sent)
+
+
+def merge(snapshots):
+    """Add up snapshots of several processes (same buckets everywhere)."""
+    values, histograms = {}, {}
+    for snap in snapshots:
+        for key, value in snap['values'].items():
+            values[key] = values.get(key, 0) + value
+        for key, data in snap['histograms'].items():
+            total = histograms.get(key)
+            histograms[key] = list(data) if total is None else [a + b for a, b in zip(total, data)]
+    return {'values': values, 'histograms': histograms}
+
+
+def _labels(pairs, extra=()):
+    pairs = list(pairs) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(merged):
+    """Prometheus text exposition format (version 0.0.4)."""
+    by_family = {}
+    for key, value in merged['values'].items():
+        name, pairs = json.loads(key)
+        by_family.setdefault(name, []).append((pairs, value))
+    for key, data in merged['histograms'].items():
+        name, pairs = json.loads(key)
+        by_family.setdefault(name, []).append((pairs, data))
+    lines = []
+    for name, (kind, help_text, buckets) in FAMILIES.items():
+        samples = by_family.get(name)
+        if not samples:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for pairs, value in sorted(samples, key=lambda s: s[0]):
+            if kind != 'histogram':
+                lines.append(f'{name}{_labels(pairs)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(pairs, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(pairs)} {_number(float(value[-2]))}')
+            lines.append(f'{name}_count{_labels(pairs)} {value[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, data):
+    tmp = f'{path}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None  # being replaced or removed meanwhile
+
+
+def mark_process_dead(pid, multiproc_dir):
+    """Fold a dead worker's counters and histograms into dead.json and drop its gauges."""
+    path = os.path.join(multiproc_dir, f'{pid}.json')
+    data = _read(path)
+    if data is None:
+        return
+    data['values'] = {k: v for k, v in data['values'].items() if json.loads(k)[0] not in GAUGES}
+    dead_path = os.path.join(multiproc_dir, 'dead.json')
+    dead = _read(dead_path)
+    _write(dead_path, merge([data] + ([dead] if dead else [])) | {'pid': 'dead'})
+    os.remove(path)
+
+
+def clear(multiproc_dir):
+    """Remove the files of a previous run (call once before the workers start)."""
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, '*.json')):
+        os.remove(path)
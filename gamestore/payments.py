@@ -0,0 +1,260 @@
+"""Asynchronous payment processing.
+
+Checkout only records a ``pending`` payment and, in the same transaction,
+queues a ``payments.process`` job (gamestore/jobs.py) that talks to the
+gateway, so no request thread waits on it:
+
+    pending --authorise--> authorised --capture--> captured
+        \\                       \\
+         +--> failed             +--> failed
+
+Every step is committed on its own, so the status endpoint (polled or
+long-polled by the browser) always shows the latest state. The job is as
+durable as the order: if the process running it dies, the job queue hands it
+to another worker after its visibility timeout, and ``expire`` fails the
+payments that stay unfinished for too long (putting their stock back). An
+authorised payment that fails (capture refused, or expired) is voided at the
+gateway so the hold on the customer's card is released.
+Gateways implement ``PaymentGateway``; ``FakeGateway`` simulates latency and
+failures for development and load tests. PAYMENT_GATEWAY selects one:
+
+    fake                 FakeGateway (PAYMENT_FAKE_LATENCY_MS, PAYMENT_FAKE_FAILURE_RATE)
+    package.module:Class any PaymentGateway subclass, built with no arguments
+
+Card numbers never reach the server: the browser sends only the payment
+method and the last four digits, which travel to the gateway in the job
+payload (deleted with the job by purge-jobs).
+"""
+import importlib
+import logging
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import select, update
+
+PENDING = 'pending'
+AUTHORISED = 'authorised'
+CAPTURED = 'captured'
+FAILED = 'failed'
+
+TRANSITIONS = {
+    PENDING: (AUTHORISED, FAILED),
+    AUTHORISED: (CAPTURED, FAILED),
+    CAPTURED: (),
+    FAILED: (),
+}
+FINAL = (CAPTURED, FAILED)
+
+log = logging.getLogger(__name__)
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def transition(payment, status, error=None):
+    """Move ``payment`` to ``status`` (caller commits)."""
+    if status not in TRANSITIONS.get(payment.status, ()):
+        raise InvalidTransition(f'payment {payment.id}: {payment.status} -> {status}')
+    payment.status = status
+    payment.error = error
+    payment.updated_at = datetime.utcnow()
+
+
+@dataclass
+class GatewayResult:
+    ok: bool
+    reference: str = None
+    error: str = None
+
+
+class PaymentGateway:
+    """Interface for payment providers. Calls may block; they run in workers."""
+
+    def authorise(self, payment_id, amount, method, details):
+        """Reserve ``amount``; returns a GatewayResult with the provider reference."""
+        raise NotImplementedError
+
+    def capture(self, reference, amount):
+        """Collect a previously authorised amount."""
+        raise NotImplementedError
+
+    def void(self, reference):
+        """Cancel an authorisation that will not be captured (releases the hold)."""
+        raise NotImplementedError
+
+
+class FakeGateway(PaymentGateway):
+    """Local stand-in: sleeps ``latency`` seconds per call and fails some payments.
+
+    ``failure_rate`` is the probability that an authorisation is declined;
+    cards ending in 0002 are always declined (handy for manual testing).
+    """
+
+    def __init__(self, latency=0.5, failure_rate=0.0, seed=None, sleep=time.sleep):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._sleep = sleep
+
+    def _wait(self):
+        if self.latency:
+            self._sleep(self.latency)
+
+    def authorise(self, payment_id, amount, method, details):
+        self._wait()
+        with self._lock:
+            declined = self._random.random() < self.failure_rate
+        if declined or (details or {}).get('card_last4') == '0002':
+            return GatewayResult(ok=False, error='card declined')
+        return GatewayResult(ok=True, reference=f'fake_{uuid.uuid4().hex[:16]}')
+
+    def capture(self, reference, amount):
+        self._wait()
+        return GatewayResult(ok=True, reference=reference)
+
+    def void(self, reference):
+        self._wait()
+        return GatewayResult(ok=True, reference=reference)
+
+
+def gateway_from_config(name, env):
+    if name in (None, '', 'fake'):
+        return FakeGateway(latency=int(env.get('PAYMENT_FAKE_LATENCY_MS', '500')) / 1000.0,
+                           failure_rate=float(env.get('PAYMENT_FAKE_FAILURE_RATE', '0')))
+    module, _, attr = name.partition(':')
+    return getattr(importlib.import_module(module), attr)()
+
+
+class PaymentProcessor:
+    """Walks payments through the gateway; ``process`` runs as a background job.
+
+    ``on_final(payment)`` is called (inside the worker's transaction, before
+    the commit) when a payment is captured or fails, e.g. to update the order.
+    Every transition is a conditional UPDATE on the expected status, so a
+    retried job, a second worker or ``expire`` never apply the same one twice.
+    """
+
+    def __init__(self, app, db, model, gateway, on_final=None):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.gateway = gateway
+        self.on_final = on_final
+        self._changed = threading.Condition()
+        self._version = 0
+
+    def _notify(self):
+        with self._changed:
+            self._version += 1
+            self._changed.notify_all()
+
+    def process(self, payment_id, details=None):
+        session = self.db.session
+        payment = session.get(self.model, payment_id)
+        if payment is None or payment.status in FINAL:
+            return
+        status, amount, method, reference = payment.status, payment.amount, payment.method, payment.gateway_ref
+        # no connection is held while the gateway call blocks
+        session.rollback()
+        if status == PENDING:
+            result = self.gateway.authorise(payment_id, amount, method, details or {})
+            if not result.ok:
+                self._advance(payment_id, (PENDING,), FAILED, error=result.error or 'declined')
+                return
+            reference = result.reference
+            if not self._advance(payment_id, (PENDING,), AUTHORISED, gateway_ref=reference):
+                return
+        result = self.gateway.capture(reference, amount)
+        if not result.ok:
+            if self._advance(payment_id, (AUTHORISED,), FAILED, error=result.error or 'capture failed'):
+                self._void(payment_id, reference)
+            return
+        if not self._advance(payment_id, (AUTHORISED,), CAPTURED):
+            log.error('payment %s was captured (%s) after it had failed; it needs a refund', payment_id, reference)
+
+    def _void(self, payment_id, reference):
+        # the payment is already failed: a void error is logged, not retried (the hold
+        # then lapses at the gateway on its own)
+        try:
+            result = self.gateway.void(reference)
+        except Exception:
+            log.exception('payment %s: could not void %s', payment_id, reference)
+            return
+        if not result.ok:
+            log.error('payment %s: void of %s refused: %s', payment_id, reference, result.error)
+
+    def _advance(self, payment_id, expected, status, error=None, **values):
+        """Commit ``expected`` -> ``status``; False if the payment moved on meanwhile."""
+        for current in expected:
+            if status not in TRANSITIONS[current]:
+                raise InvalidTransition(f'payment {payment_id}: {current} -> {status}')
+        session = self.db.session
+        model = self.model
+        moved = session.execute(
+            update(model).where(model.id == payment_id, model.status.in_(expected))
+            .values(status=status, error=error, updated_at=datetime.utcnow(), **values)
+            .execution_options(synchronize_session=False)).rowcount
+        if not moved:
+            session.rollback()
+            return False
+        if status in FINAL and self.on_final:
+            self.on_final(session.get(model, payment_id, populate_existing=True))
+        session.commit()
+        self._notify()
+        return True
+
+    def unfinished(self, updated_before=None):
+        """Ids of pending/authorised payments (only those untouched since ``updated_before``)."""
+        model = self.model
+        query = select(model.id).where(model.status.in_((PENDING, AUTHORISED)))
+        if updated_before is not None:
+            query = query.where(model.updated_at < updated_before)
+        ids = list(self.db.session.execute(query.order_by(model.id)).scalars())
+        self.db.session.rollback()
+        return ids
+
+    def expire(self, updated_before, error='expired'):
+        """Fail the payments stuck before ``updated_before`` (on_final releases the order); returns how many.
+
+        Authorised ones are voided at the gateway once failed.
+        """
+        model = self.model
+        rows = self.db.session.execute(
+            select(model.id, model.status, model.gateway_ref)
+            .where(model.status.in_((PENDING, AUTHORISED)), model.updated_at < updated_before)
+            .order_by(model.id)).all()
+        self.db.session.rollback()
+        expired = 0
+        for payment_id, status, reference in rows:
+            if not self._advance(payment_id, (status,), FAILED, error=error):
+                continue
+            expired += 1
+            if status == AUTHORISED and reference:
+                self._void(payment_id, reference)
+        if expired:
+            log.warning('%d unfinished payments expired', expired)
+        return expired
+
+    def wait_for_change(self, read_status, known, timeout):
+        """Long-poll helper: return the status once it differs from ``known``.
+
+        ``read_status()`` reads the current status from the database; it is
+        re-checked whenever a local worker reports progress and at least every
+        half second (the payment may be processed by another process).
+        """
+        deadline = time.monotonic() + timeout
+        status = read_status()
+        while status == known and status not in FINAL:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            with self._changed:
+                self._changed.wait(min(remaining, 0.5))
+            status = read_status()
+        return status
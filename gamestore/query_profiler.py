@@ -0,0 +1,185 @@
+"""Slow-query log and N+1 detector for development and staging.
+
+``QueryProfiler.instrument_engine`` listens to the engine's cursor events:
+
+* statements slower than ``slow_ms`` are logged (logger ``gamestore.sql``)
+  with their duration, parameters and, for SELECTs, the database's plan
+  (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` elsewhere), taken on a raw
+  cursor so it is not itself profiled;
+* within a request (``begin`` / ``end``), statements are grouped by
+  fingerprint -- the SQL with literals and IN-lists collapsed -- and a
+  fingerprint run ``n_plus_one`` times or more is logged as a probable N+1
+  loop, with the line of app code that issued it;
+* a request running more than ``request_budget`` statements is logged, or raises
+  ``QueryBudgetExceeded`` when ``raise_on_budget`` is set (for tests).
+
+``end`` returns the request's totals so the app can send them back as the
+``X-DB-Queries`` / ``X-DB-Time`` headers. ``budget()`` applies the same
+check to any block of code, e.g. in a test.
+"""
+import logging
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+log = logging.getLogger('gamestore.sql')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAMS_LIST = re.compile(r'\(\s*(?:\?|%\(\w+\)s|:\w+|\$\d+|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|:\w+|\$\d+|%s))*\s*\)')
+_SPACE = re.compile(r'\s+')
+# frames from these packages are skipped when looking for the caller
+_LIBRARY_PATHS = ('sqlalchemy', 'flask_sqlalchemy', 'query_profiler', 'jinja2', 'werkzeug', 'flask')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """More statements than the budget allows (raised only with raise_on_budget)."""
+
+
+def fingerprint(statement):
+    """Statement with literals and parameter lists collapsed: same query, same fingerprint."""
+    sql = _STRING.sub('?', statement)
+    sql = _NUMBER.sub('?', sql)
+    sql = _PARAMS_LIST.sub('(?+)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def caller():
+    """'file:line in function' of the first frame outside the libraries (the app code)."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        path = frame.f_code.co_filename
+        if 'site-packages' not in path and not any(f'/{p}/' in path or path.endswith(f'/{p}.py')
+                                                     for p in _LIBRARY_PATHS):
+            return f'{path}:{frame.f_lineno} in {frame.f_code.co_name}'
+        frame = frame.f_back
+    return '?'
+
+
+def _short(value, limit=300):
+    text = str(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+class _RequestState:
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.seconds = 0.0
+        self.fingerprints = Counter()
+        self.reported = set()
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms=100, explain=True, n_plus_one=5, request_budget=0, raise_on_budget=False):
+        self.slow_ms = slow_ms
+        self.explain = explain
+        self.n_plus_one = n_plus_one
+        self.request_budget = request_budget
+        self.raise_on_budget = raise_on_budget
+        self._local = threading.local()
+        self.slow_count = 0
+        self.n_plus_one_count = 0
+
+    # -- per request -------------------------------------------------------------
+
+    def begin(self, name):
+        self._local.state = _RequestState(name)
+
+    def end(self):
+        """Finish the request: (queries, seconds); checks the budget."""
+        state = getattr(self._local, 'state', None)
+        self._local.state = None
+        if state is None:
+            return 0, 0.0
+        self._check_budget(state, self.request_budget)
+        return state.queries, state.seconds
+
+    @contextmanager
+    def budget(self, max_queries, name='block'):
+        """Raise QueryBudgetExceeded if the block runs more than ``max_queries`` statements."""
+        outer = getattr(self._local, 'state', None)
+        state = self._local.state = _RequestState(name)
+        try:
+            yield state
+        finally:
+            self._local.state = outer
+            if outer is not None:
+                outer.queries += state.queries
+                outer.seconds += state.seconds
+        if state.queries > max_queries:
+            raise QueryBudgetExceeded(self._budget_message(state, max_queries))
+
+    def _budget_message(self, state, max_queries):
+        top = ', '.join(f'{n}x {_short(fp, 80)}' for fp, n in state.fingerprints.most_common(3))
+        return (f'{state.name}: {state.queries} SQL statements (budget {max_queries}, '
+                f'{state.seconds * 1000:.1f} ms); most repeated: {top}')
+
+    def _check_budget(self, state, max_queries):
+        if not max_queries or state.queries <= max_queries:
+            return
+        message = self._budget_message(state, max_queries)
+        if self.raise_on_budget:
+            raise QueryBudgetExceeded(message)
+        log.warning('Query budget exceeded: %s', message)
+
+    # -- engine events -----------------------------------------------------------
+
+    def instrument_engine(self, engine):
+        from sqlalchemy import event
+        profiler = self
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def _before(conn, cursor, statement, parameters, context, executemany):
+            context.profiler_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def _after(conn, cursor, statement, parameters, context, executemany):
+            elapsed = time.perf_counter() - context.profiler_started
+            profiler._record(cursor, statement, parameters, executemany, elapsed)
+
+    def _record(self, cursor, statement, parameters, executemany, elapsed):
+        state = getattr(self._local, 'state', None)
+        if state is not None:
+            state.queries += 1
+            state.seconds += elapsed
+            fp = fingerprint(statement)
+            state.fingerprints[fp] += 1
+            if state.fingerprints[fp] == self.n_plus_one and fp not in state.reported:
+                state.reported.add(fp)
+                self.n_plus_one_count += 1
+                log.warning('Possible N+1 in %s: the same statement ran %d times, from %s: %s',
+                            state.name, self.n_plus_one, caller(), _short(fp))
+        if self.slow_ms and elapsed * 1000 >= self.slow_ms:
+            self.slow_count += 1
+            plan = self._explain(cursor, statement, parameters) if self.explain and not executemany else None
+            log.warning('Slow query (%.1f ms) in %s from %s: %s\n  params: %s%s',
+                        elapsed * 1000, state.name if state is not None else 'background', caller(),
+                        _short(statement, 2000), _short(parameters),
+                        ''.join(f'\n  plan: {line}' for line in plan) if plan else '')
+
+    def _explain(self, cursor, statement, parameters):
+        """Plan lines for a SELECT, on a new cursor of the same DBAPI connection."""
+        if not statement.lstrip()[:6].upper().startswith(('SELECT', 'WITH')):
+            return None
+        dbapi_conn = cursor.connection
+        is_sqlite = type(dbapi_conn).__module__.startswith('sqlite3')
+        explain = dbapi_conn.cursor()
+        try:
+            explain.execute(('EXPLAIN QUERY PLAN ' if is_sqlite else 'EXPLAIN ') + statement, parameters)
+            rows = explain.fetchall()
+        except Exception as e:  # plans are best effort
+            return [f'(EXPLAIN failed: {e})']
+        finally:
+            explain.close()
+        if is_sqlite:
+            # (id, parent, notused, detail)
+            return [row[-1] for row in rows]
+        return [row[0] for row in rows]
+
+    def stats(self):
+        return {'slow_ms': self.slow_ms, 'slow_queries': self.slow_count,
+                'n_plus_one_warnings': self.n_plus_one_count, 'request_budget': self.request_budget}
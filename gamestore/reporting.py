@@ -0,0 +1,264 @@
+"""Pre-aggregated sales figures for the admin reports and dashboard.
+
+Three rollup tables are kept up to date by ``record_order``, run by the
+'sales.record_order' job queued when the order's payment is captured (a
+declined or expired payment is never counted):
+
+* ``sales_daily``          -- one row per day: orders, units, revenue
+* ``sales_product_daily``  -- one row per (day, product)
+* ``sales_category_daily`` -- one row per (day, category)
+
+Report queries only read these tables, so their cost grows with the number of
+days (times products/categories sold) in the range, never with the number of
+orders. ``rebuild()`` recomputes a date range from the paid
+``orders``/``order_items`` for backfills or after fixing data; it streams the rows in chunks and
+aggregates them with NumPy when it is installed (pure Python otherwise).
+"""
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, update
+
+# NumPy is optional and only used by rebuild(): imported on first use (see _numpy)
+# so importing the app does not pay for it.
+np = False
+
+GRANULARITIES = ('day', 'week', 'month')
+
+# orders.status values that count as a sale (the same ones record_order sees)
+SALE_STATUSES = ('paid',)
+
+
+def to_day(value):
+    """``date`` for a date/datetime/ISO string (SQLite returns date() as text)."""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def bucket(day, granularity):
+    """First day of the day/week (Monday)/month ``day`` falls in."""
+    if granularity == 'week':
+        return day - timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _upsert(session, table, keys, values):
+    """Add ``values`` to the counters of the row identified by ``keys``."""
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(**keys, **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: table.c[name] + stmt.excluded[name] for name in values})
+        session.execute(stmt)
+        return
+    cond = [table.c[k] == v for k, v in keys.items()]
+    result = session.execute(update(table).where(*cond).values(
+        **{name: table.c[name] + v for name, v in values.items()}))
+    if result.rowcount == 0:
+        session.execute(insert(table).values(**keys, **values))
+
+
+class SalesRollup:
+    """Reads and maintains the rollups; models are the three rollup tables."""
+
+    def __init__(self, db, daily, product_daily, category_daily):
+        self.db = db
+        self.daily = daily.__table__
+        self.product_daily = product_daily.__table__
+        self.category_daily = category_daily.__table__
+
+    # -- maintenance ---------------------------------------------------------
+
+    def record_order(self, day, lines):
+        """Add one order to the rollups (caller commits).
+
+        ``lines`` are dicts with ``product_id``, ``category_id``, ``qty`` and
+        ``price``, as in the checkout line items.
+        """
+        session = self.db.session
+        units = sum(l['qty'] for l in lines)
+        revenue = sum(l['qty'] * l['price'] for l in lines)
+        _upsert(session, self.daily, {'day': day}, {'orders': 1, 'units': units, 'revenue': revenue})
+        per_product = defaultdict(lambda: [0, 0.0])
+        per_category = defaultdict(lambda: [0, 0.0])
+        for l in lines:
+            amount = l['qty'] * l['price']
+            per_product[l['product_id']][0] += l['qty']
+            per_product[l['product_id']][1] += amount
+            if l.get('category_id') is not None:
+                per_category[l['category_id']][0] += l['qty']
+                per_category[l['category_id']][1] += amount
+        for pid, (u, r) in per_product.items():
+            _upsert(session, self.product_daily, {'day': day, 'product_id': pid}, {'units': u, 'revenue': r})
+        for cid, (u, r) in per_category.items():
+            _upsert(session, self.category_daily, {'day': day, 'category_id': cid}, {'units': u, 'revenue': r})
+
+    def rebuild(self, orders, order_items, products, start=None, end=None, chunk_size=50000):
+        """Recompute the rollups for ``start``..``end`` (inclusive, None = open).
+
+        ``orders``/``order_items``/``products`` are the source tables; only
+        orders in SALE_STATUSES are counted. Returns the number of order items
+        read.
+        """
+        day_col = func.date(orders.c.created_at)
+        cond = [orders.c.status.in_(SALE_STATUSES)]
+        if start is not None:
+            cond.append(orders.c.created_at >= datetime.combine(start, datetime.min.time()))
+        if end is not None:
+            cond.append(orders.c.created_at < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        item_rows = (select(day_col, order_items.c.product_id, products.c.category_id,
+                            order_items.c.quantity, order_items.c.price)
+                     .select_from(order_items.join(orders, orders.c.id == order_items.c.order_id)
+                                  .outerjoin(products, products.c.id == order_items.c.product_id))
+                     .where(*cond))
+        order_rows = select(day_col, func.count()).select_from(orders).where(*cond).group_by(day_col)
+
+        session = self.db.session
+        daily = defaultdict(lambda: [0, 0, 0.0])
+        by_product = defaultdict(lambda: [0, 0.0])
+        by_category = defaultdict(lambda: [0, 0.0])
+        count = 0
+        result = session.execute(item_rows.execution_options(yield_per=chunk_size))
+        for chunk in result.partitions(chunk_size):
+            count += len(chunk)
+            _aggregate(chunk, daily, by_product, by_category)
+        for day, n in session.execute(order_rows):
+            daily[to_day(day)][0] += n
+
+        for table in (self.daily, self.product_daily, self.category_daily):
+            stmt = delete(table)
+            if start is not None:
+                stmt = stmt.where(table.c.day >= start)
+            if end is not None:
+                stmt = stmt.where(table.c.day <= end)
+            session.execute(stmt)
+        if daily:
+            session.execute(insert(self.daily), [
+                {'day': d, 'orders': o, 'units': u, 'revenue': r} for d, (o, u, r) in daily.items()])
+        if by_product:
+            session.execute(insert(self.product_daily), [
+                {'day': d, 'product_id': p, 'units': u, 'revenue': r} for (d, p), (u, r) in by_product.items()])
+        if by_category:
+            session.execute(insert(self.category_daily), [
+                {'day': d, 'category_id': c, 'units': u, 'revenue': r} for (d, c), (u, r) in by_category.items()])
+        session.commit()
+        return count
+
+    # -- reports ---------------------------------------------------------------
+
+    def revenue(self, start, end, granularity='day'):
+        """Orders, units and revenue per day/week/month, including empty periods."""
+        t = self.daily
+        rows = self.db.session.execute(
+            select(t.c.day, t.c.orders, t.c.units, t.c.revenue)
+            .where(t.c.day >= start, t.c.day <= end).order_by(t.c.day)).all()
+        periods = {}
+        day = start
+        while day <= end:
+            periods.setdefault(bucket(day, granularity), [0, 0, 0.0])
+            day += timedelta(days=1)
+        for day, orders, units, revenue in rows:
+            p = periods[bucket(to_day(day), granularity)]
+            p[0] += orders
+            p[1] += units
+            p[2] += revenue
+        return [{'period': k.isoformat(), 'orders': o, 'units': u, 'revenue': round(r, 2)}
+                for k, (o, u, r) in periods.items()]
+
+    def top_products(self, products, start, end, limit=10, by='units'):
+        t = self.product_daily
+        units = func.sum(t.c.units).label('units')
+        revenue = func.sum(t.c.revenue).label('revenue')
+        order = units if by == 'units' else revenue
+        rows = self.db.session.execute(
+            select(t.c.product_id, products.c.title, units, revenue)
+            .select_from(t.outerjoin(products, products.c.id == t.c.product_id))
+            .where(t.c.day >= start, t.c.day <= end)
+            .group_by(t.c.product_id, products.c.title)
+            .order_by(order.desc(), t.c.product_id).limit(limit)).all()
+        return [{'product_id': pid, 'title': title, 'units': int(u or 0), 'revenue': round(r or 0.0, 2)}
+                for pid, title, u, r in rows]
+
+    def categories(self, categories, start, end):
+        t = self.category_daily
+        units = func.sum(t.c.units).label('units')
+        revenue = func.sum(t.c.revenue).label('revenue')
+        rows = self.db.session.execute(
+            select(t.c.category_id, categories.c.name, units, revenue)
+            .select_from(t.outerjoin(categories, categories.c.id == t.c.category_id))
+            .where(t.c.day >= start, t.c.day <= end)
+            .group_by(t.c.category_id, categories.c.name)
+            .order_by(revenue.desc())).all()
+        total = sum(r or 0.0 for *_, r in rows)
+        return [{'category_id': cid, 'name': name, 'units': int(u or 0), 'revenue': round(r or 0.0, 2),
+                 'share': round((r or 0.0) / total, 4) if total else 0.0}
+                for cid, name, u, r in rows]
+
+
+def _aggregate(chunk, daily, by_product, by_category):
+    """Fold rows of (day, product_id, category_id, qty, price) into the accumulators."""
+    if len(chunk) > 1 and _numpy() is not None:
+        _aggregate_numpy(chunk, daily, by_product, by_category)
+        return
+    for day, pid, cid, qty, price in chunk:
+        day = to_day(day)
+        qty = qty or 0
+        amount = qty * (price or 0.0)
+        daily[day][1] += qty
+        daily[day][2] += amount
+        if pid is not None:
+            by_product[(day, pid)][0] += qty
+            by_product[(day, pid)][1] += amount
+        if cid is not None:
+            by_category[(day, cid)][0] += qty
+            by_category[(day, cid)][1] += amount
+
+
+def _numpy():
+    global np
+    if np is False:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        np = numpy
+    return np
+
+
+def _aggregate_numpy(chunk, daily, by_product, by_category):
+    days, day_idx = np.unique(np.array([str(r[0])[:10] for r in chunk]), return_inverse=True)
+    days = [date.fromisoformat(d) for d in days]
+    pids = np.array([-1 if r[1] is None else r[1] for r in chunk], dtype=np.int64)
+    cids = np.array([-1 if r[2] is None else r[2] for r in chunk], dtype=np.int64)
+    qty = np.array([r[3] or 0 for r in chunk], dtype=np.int64)
+    amount = qty * np.array([r[4] or 0.0 for r in chunk], dtype=np.float64)
+
+    n_days = len(days)
+    day_units = np.bincount(day_idx, weights=qty, minlength=n_days)
+    day_revenue = np.bincount(day_idx, weights=amount, minlength=n_days)
+    for i, day in enumerate(days):
+        daily[day][1] += int(day_units[i])
+        daily[day][2] += float(day_revenue[i])
+
+    for ids, target in ((pids, by_product), (cids, by_category)):
+        valid = ids >= 0
+        if not valid.any():
+            continue
+        keys, inverse = np.unique(np.stack([day_idx[valid], ids[valid]], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        units = np.bincount(inverse, weights=qty[valid], minlength=len(keys))
+        revenue = np.bincount(inverse, weights=amount[valid], minlength=len(keys))
+        for (d, ident), u, r in zip(keys.tolist(), units.tolist(), revenue.tolist()):
+            acc = target[(days[d], ident)]
+            acc[0] += int(u)
+            acc[1] += r
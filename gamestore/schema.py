@@ -0,0 +1,128 @@
+"""Schema readiness, checked once per process.
+
+The database schema is owned by the Alembic revisions in ``alembic/versions``;
+request handlers never inspect or alter tables. On the first request
+``check_schema()`` compares the revision stamped in the database with the
+script heads; only ``flask gamestore init-db`` (run once per deploy, or by
+the gunicorn master at start) passes ``upgrade=True`` and runs ``alembic
+upgrade head`` (the revisions are idempotent, so databases created by the old
+``create_all()`` bootstrap are brought up to date in place). A ready status
+is cached; later calls return it without touching the database.
+
+Alembic itself is only imported to run an upgrade: the check reads
+``alembic_version`` and the revision scripts directly, so neither importing
+the app nor the first request of a worker process pays for loading it.
+"""
+import ast
+import os
+import re
+import threading
+from dataclasses import dataclass
+
+from sqlalchemy import inspect, text
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+ALEMBIC_INI = os.path.join(ROOT, 'alembic.ini')
+SCRIPT_LOCATION = os.path.join(ROOT, 'alembic')
+
+_REVISION = re.compile(r"^revision\s*=\s*(.+?)\s*$", re.M)
+_DOWN_REVISION = re.compile(r"^down_revision\s*=\s*(.+?)\s*$", re.M)
+
+
+class SchemaNotReady(RuntimeError):
+    pass
+
+
+@dataclass
+class SchemaStatus:
+    current: tuple = ()
+    heads: tuple = ()
+    upgraded: bool = False
+
+    @property
+    def ready(self):
+        return set(self.current) == set(self.heads)
+
+
+def alembic_config(connection=None):
+    """Alembic config usable from any working directory.
+
+    With ``connection`` the migrations run on it instead of opening a new
+    engine from the Flask app (see alembic/env.py).
+    """
+    from alembic.config import Config
+    cfg = Config(ALEMBIC_INI)
+    cfg.set_main_option('script_location', SCRIPT_LOCATION)
+    if connection is not None:
+        cfg.attributes['connection'] = connection
+    return cfg
+
+
+def head_revisions():
+    """Heads of the revision graph, read from the scripts' ``revision``/``down_revision`` lines.
+
+    Same answer as Alembic's ScriptDirectory without importing Alembic (which
+    costs more than the rest of the check).
+    """
+    revisions, parents = set(), set()
+    versions = os.path.join(SCRIPT_LOCATION, 'versions')
+    for name in os.listdir(versions):
+        if not name.endswith('.py'):
+            continue
+        with open(os.path.join(versions, name), encoding='utf-8') as fh:
+            source = fh.read()
+        found = _REVISION.search(source)
+        if found is None:
+            continue
+        revisions.add(ast.literal_eval(found.group(1)))
+        down = _DOWN_REVISION.search(source)
+        down = ast.literal_eval(down.group(1)) if down else None
+        if isinstance(down, str):
+            parents.add(down)
+        elif down:
+            parents.update(down)
+    return tuple(sorted(revisions - parents))
+
+
+def current_revisions(connection):
+    """Revisions stamped in ``alembic_version`` (empty for a database never migrated)."""
+    if not inspect(connection).has_table('alembic_version'):
+        return ()
+    return tuple(connection.execute(text('SELECT version_num FROM alembic_version')).scalars())
+
+
+_status = None
+_lock = threading.Lock()
+
+
+def check_schema(engine, upgrade=False):
+    """Return the (cached) SchemaStatus, upgrading to head first if allowed.
+
+    Raises SchemaNotReady when the database is behind and ``upgrade`` is false.
+    """
+    global _status
+    if _status is not None:
+        return _status
+    with _lock:
+        if _status is not None:
+            return _status
+        heads = head_revisions()
+        with engine.begin() as conn:
+            status = SchemaStatus(current=current_revisions(conn), heads=heads)
+            if not status.ready:
+                if not upgrade:
+                    raise SchemaNotReady(
+                        f'database schema is at {status.current or "(none)"}, expected {heads}; '
+                        'run "alembic upgrade head"')
+                from alembic import command
+                command.upgrade(alembic_config(conn), 'head')
+                status = SchemaStatus(current=current_revisions(conn), heads=heads, upgraded=True)
+        _status = status
+        return status
+
+
+def reset():
+    """Forget the cached status (tests, or after running migrations by hand)."""
+    global _status
+    with _lock:
+        _status = None
@@ -0,0 +1,148 @@
+"""Full-text product search.
+
+The index lives in the database and is kept in sync by the database itself,
+so every write path (admin forms, ``/api/products``, scripts) updates it
+without extra application code. It is created by the Alembic revision
+``e8c13d6f2a90_product_search_index``:
+
+* SQLite: an FTS5 external-content table ``products_fts`` maintained by
+  triggers on ``products``, tokenised with ``unicode61 remove_diacritics 2``.
+* PostgreSQL: a generated ``products.search_vector`` column (Spanish
+  configuration over unaccented text) with a GIN index.
+* Anything else (or SQLite built without FTS5): a bounded ``LIKE`` scan.
+
+Queries are normalised the same way (lower case, accents stripped) and every
+term is matched as a prefix, so "audifonos" and "audíf" both find
+"AUDÍFONOS GAMER".
+"""
+import math
+import re
+import unicodedata
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(value):
+    """Lower-case ``value`` and strip diacritics ('AUDÍFONOS' -> 'audifonos')."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def terms(query, limit=8):
+    """Split a user query into normalised search terms."""
+    return _WORD_RE.findall(normalize(query))[:limit]
+
+
+@dataclass
+class SearchResult:
+    ids: list = field(default_factory=list)
+    total: int = 0
+    page: int = 1
+    per_page: int = 24
+
+    @property
+    def pages(self):
+        return max(1, math.ceil(self.total / self.per_page)) if self.per_page else 1
+
+
+class LikeSearch:
+    """Fallback: substring match on title/category, bounded by the page size."""
+
+    name = 'like'
+
+    def __init__(self, db):
+        self.db = db
+
+    def rebuild(self):
+        pass
+
+    def search(self, query, page=1, per_page=24):
+        words = terms(query)
+        page = max(1, page)
+        if not words:
+            return SearchResult(page=page, per_page=per_page)
+        clauses = []
+        params = {'limit': per_page, 'offset': (page - 1) * per_page}
+        for i, w in enumerate(words):
+            clauses.append(f'(lower(title) LIKE :w{i} OR lower(category) LIKE :w{i})')
+            params[f'w{i}'] = f'%{w}%'
+        where = ' AND '.join(clauses)
+        sql = (f'SELECT id, count(*) OVER () AS total FROM products WHERE {where} '
+               'ORDER BY id DESC LIMIT :limit OFFSET :offset')
+        return self._run(sql, params, page, per_page)
+
+    def _run(self, sql, params, page, per_page):
+        rows = self.db.session.execute(text(sql), params).all()
+        total = rows[0][1] if rows else 0
+        return SearchResult(ids=[r[0] for r in rows], total=total, page=page, per_page=per_page)
+
+
+class SqliteFtsSearch(LikeSearch):
+    name = 'sqlite-fts5'
+
+    def rebuild(self):
+        with self.db.engine.begin() as conn:
+            conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+
+    def search(self, query, page=1, per_page=24):
+        words = terms(query)
+        page = max(1, page)
+        if not words:
+            return SearchResult(page=page, per_page=per_page)
+        # quoted prefix terms, implicitly AND-ed; quoting keeps FTS syntax out of user input
+        match = ' '.join(f'"{w}"*' for w in words)
+        # bm25 weights: a title hit counts more than a category hit
+        # (bm25() cannot be combined with a window function at the same query level)
+        sql = ('SELECT id, count(*) OVER () AS total FROM ('
+               'SELECT rowid AS id, bm25(products_fts, 10.0, 2.0) AS rank FROM products_fts '
+               'WHERE products_fts MATCH :match) '
+               'ORDER BY rank, id DESC LIMIT :limit OFFSET :offset')
+        params = {'match': match, 'limit': per_page, 'offset': (page - 1) * per_page}
+        return self._run(sql, params, page, per_page)
+
+
+class PostgresSearch(LikeSearch):
+    name = 'postgres-tsvector'
+
+    def search(self, query, page=1, per_page=24):
+        words = terms(query)
+        page = max(1, page)
+        if not words:
+            return SearchResult(page=page, per_page=per_page)
+        tsquery = ' & '.join(f'{w}:*' for w in words)
+        sql = ("SELECT id, count(*) OVER () AS total FROM products, to_tsquery('spanish', :q) query "
+               'WHERE search_vector @@ query '
+               'ORDER BY ts_rank_cd(search_vector, query) DESC, id DESC LIMIT :limit OFFSET :offset')
+        params = {'q': tsquery, 'limit': per_page, 'offset': (page - 1) * per_page}
+        return self._run(sql, params, page, per_page)
+
+
+def fts5_available(db):
+    try:
+        with db.engine.connect() as conn:
+            return bool(conn.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar()) \
+                or _can_create_fts5(conn)
+    except Exception:
+        return False
+
+
+def _can_create_fts5(conn):
+    try:
+        conn.execute(text('CREATE VIRTUAL TABLE temp._fts5_probe USING fts5(x)'))
+        conn.execute(text('DROP TABLE temp._fts5_probe'))
+        return True
+    except Exception:
+        return False
+
+
+def for_database(db):
+    """Choose the search backend for the configured database."""
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        return PostgresSearch(db)
+    if dialect == 'sqlite' and fts5_available(db):
+        return SqliteFtsSearch(db)
+    return LikeSearch(db)
@@ -0,0 +1,112 @@
+"""Gunicorn settings for production: gunicorn -c gunicorn.conf.py wsgi:app
+
+Pre-fork: the master process forks WEB_CONCURRENCY workers (default: 2 per
+CPU core + 1) and each serves requests on WEB_THREADS threads (gthread
+worker). Processes use every core; the threads cover the time spent waiting
+on the database and on long-polls (/payments/<id>?wait=).
+
+Signals to the master (its pid is in PIDFILE when set):
+  HUP         graceful reload: new workers start with the current code and
+              settings, old ones finish their requests first
+  TERM        graceful stop, waiting up to GRACEFUL_TIMEOUT seconds
+  TTIN/TTOU   one worker more/less
+With PRELOAD_APP=1 the app is imported once in the master (faster worker
+start, shared memory) but HUP no longer picks up new code; use USR2 + WINCH
+(see README_SERVING.md) to upgrade the master instead.
+
+/metrics adds up every worker: each writes its numbers to
+METRICS_MULTIPROC_DIR (default: a directory per master under the temp dir,
+emptied on start and removed on exit).
+
+With SCHEMA_AUTO_UPGRADE=1 (default on SQLite) the master upgrades the schema
+once (flask gamestore init-db --auto) before forking, and again on HUP; the
+workers never migrate.
+
+Every setting below can be overridden on the command line as usual.
+"""
+import multiprocessing
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+def _int(name, default):
+    return int(os.environ.get(name, default))
+
+
+bind = os.environ.get('BIND') or f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = _int('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1)
+worker_class = 'gthread'
+threads = _int('WEB_THREADS', 4)
+# gthread: keep-alive connections kept open per worker, and how long an idle one waits.
+# Keep KEEPALIVE above the idle timeout of the load balancer in front, or it reuses closed sockets.
+worker_connections = _int('WORKER_CONNECTIONS', 1000)
+keepalive = _int('KEEPALIVE', 5)
+backlog = _int('BACKLOG', 2048)
+# a worker silent for WORKER_TIMEOUT seconds is killed and replaced
+timeout = _int('WORKER_TIMEOUT', 30)
+graceful_timeout = _int('GRACEFUL_TIMEOUT', 30)
+# recycle workers after N requests (0 = never); the jitter avoids restarting them all at once
+max_requests = _int('MAX_REQUESTS', 0)
+max_requests_jitter = _int('MAX_REQUESTS_JITTER', 0)
+preload_app = os.environ.get('PRELOAD_APP', '0') == '1'
+pidfile = os.environ.get('PIDFILE') or None
+accesslog = os.environ.get('ACCESS_LOG', '-')
+errorlog = os.environ.get('ERROR_LOG', '-')
+loglevel = os.environ.get('LOG_LEVEL', 'info')
+# X-Forwarded-* are trusted from these addresses (the reverse proxy)
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+# set here so the workers (forked from this master) inherit it
+os.environ.setdefault('METRICS_MULTIPROC_DIR',
+                      os.path.join(tempfile.gettempdir(), f'gamestore-metrics-{os.getpid()}'))
+
+
+def _upgrade_schema(server):
+    # the schema is migrated once, here, never by the workers (they answer 503 while it
+    # is behind); a child process so the master does not import the app (HUP reloads it)
+    server.log.info('GameStore: init-db --auto')
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'gamestore', 'init-db', '--auto'],
+                   cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+
+
+def on_starting(server):
+    from gamestore import metrics
+    metrics.clear(os.environ['METRICS_MULTIPROC_DIR'])
+    _upgrade_schema(server)
+    cfg = server.cfg
+    server.log.info('GameStore: %d workers x %d threads on %s (%d CPUs, preload=%s)',
+                    cfg.workers, cfg.threads, ', '.join(cfg.bind), multiprocessing.cpu_count(), cfg.preload_app)
+
+
+def on_reload(server):
+    # HUP with new code may bring new migrations; if they fail the new workers stay unready
+    try:
+        _upgrade_schema(server)
+    except subprocess.CalledProcessError as e:
+        server.log.error('GameStore: schema upgrade failed (%s)', e)
+
+
+def post_fork(server, worker):
+    # with preload_app the engine was created in the master: each worker opens its own connections
+    if server.cfg.preload_app:
+        from app import app, db
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # stop the embedded job worker and let its running jobs (payments) finish before the process exits
+    from app import shutdown_background
+    shutdown_background()
+
+
+def child_exit(server, worker):
+    # master: keep the dead worker's counters in the /metrics totals, drop its gauges
+    from gamestore import metrics
+    metrics.mark_process_dead(worker.pid, os.environ['METRICS_MULTIPROC_DIR'])
+
+
+def on_exit(server):
+    shutil.rmtree(os.environ['METRICS_MULTIPROC_DIR'], ignore_errors=True)
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Login throughput and catalog latency while /login is under a password-guessing attack.
+
+Usage:
+  PYTHONPATH=. .venv/bin/python3 scripts/bench_login.py
+  PYTHONPATH=. .venv/bin/python3 scripts/bench_login.py --attackers 32 --ips 500 --duration 10
+  PYTHONPATH=. .venv/bin/python3 scripts/bench_login.py --no-throttle --hash-queue 1000   # unprotected
+
+Two phases of --duration seconds each against in-process test clients:
+1. baseline: --catalog-clients threads loop on GET --path and record latency;
+2. attack: the same catalog clients, plus --attackers threads posting wrong
+   passwords to /login for --users accounts from --ips addresses, plus a
+   legitimate login with the right password every 0.5 s (each one another
+   account and address, as real users are, so their own buckets never
+   throttle them).
+
+Reported: catalog p50/p99 in both phases, login attempts per second split
+into checked (a hash was computed), throttled (429) and busy (503, hashing
+pool full), and the legitimate logins that got through with their latency.
+--no-throttle raises the token buckets out of reach and --hash-queue sizes
+the hashing queue, so the protection can be compared with none. Without
+--database-url a throwaway SQLite file is used.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+BENCH_PASSWORD = 'bench-password'
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--database-url', help='scratch database (default: temporary SQLite file)')
+    ap.add_argument('--duration', type=float, default=5.0, help='seconds per phase')
+    ap.add_argument('--attackers', type=int, default=16, help='threads posting to /login')
+    ap.add_argument('--users', type=int, default=20, help='usernames the attack targets')
+    ap.add_argument('--ips', type=int, default=50, help='source addresses of the attack')
+    ap.add_argument('--catalog-clients', type=int, default=2, help='threads requesting --path')
+    ap.add_argument('--path', default='/api/products?limit=20', help='catalog URL to measure')
+    ap.add_argument('--hash-workers', type=int, default=2, help='PASSWORD_HASH_WORKERS')
+    ap.add_argument('--hash-queue', type=int, default=8, help='PASSWORD_HASH_QUEUE')
+    ap.add_argument('--hash-pool', choices=('thread', 'process'), default='thread', help='PASSWORD_HASH_POOL')
+    ap.add_argument('--throttle-store', choices=('memory', 'sql'), default='memory', help='LOGIN_THROTTLE_STORE')
+    ap.add_argument('--no-throttle', action='store_true', help='buckets too large to ever throttle')
+    ap.add_argument('--json', action='store_true', help='print the results as JSON')
+    return ap.parse_args()
+
+
+def setup_env(args):
+    tmpdir = tempfile.mkdtemp(prefix='gamestore-loginbench-')
+    os.environ['DATABASE_URL'] = args.database_url or 'sqlite:///' + os.path.join(tmpdir, 'loginbench.db')
+    os.environ.setdefault('IMAGE_STORE_DIR', os.path.join(tmpdir, 'images'))
+    os.environ['PASSWORD_HASH_WORKERS'] = str(args.hash_workers)
+    os.environ['PASSWORD_HASH_QUEUE'] = str(args.hash_queue)
+    os.environ['PASSWORD_HASH_POOL'] = args.hash_pool
+    os.environ['LOGIN_THROTTLE_STORE'] = args.throttle_store
+    os.environ['JOB_EMBEDDED_WORKER'] = '0'
+    if args.no_throttle:
+        for name in ('LOGIN_USER_BURST', 'LOGIN_IP_BURST'):
+            os.environ[name] = str(10 ** 9)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct))] if values else 0.0
+
+
+def latency(values):
+    return {'requests': len(values),
+            'p50_ms': round(statistics.median(values) * 1000, 1) if values else 0.0,
+            'p99_ms': round(percentile(values, 0.99) * 1000, 1)}
+
+
+def run_phase(app, args, attack):
+    stop = threading.Event()
+    catalog, legit, legit_ok = [], [], Counter()
+    attempts = Counter()
+
+    def catalog_client():
+        client = app.test_client()
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            client.get(args.path)
+            catalog.append(time.perf_counter() - t0)
+
+    def attacker(n):
+        client = app.test_client()
+        i = n
+        while not stop.is_set():
+            status = client.post('/login', data={'username': f'victim{i % args.users}', 'password': f'guess{i}'},
+                                 environ_base={'REMOTE_ADDR': f'203.0.{(i % args.ips) // 250}.{i % args.ips % 250}'}
+                                 ).status_code
+            attempts[{200: 'checked', 429: 'throttled', 503: 'busy'}.get(status, str(status))] += 1
+            i += args.attackers
+
+    def legit_user():
+        n = 0
+        while not stop.is_set():
+            client = app.test_client()
+            t0 = time.perf_counter()
+            status = client.post('/login', data={'username': f'bench-login{n}', 'password': BENCH_PASSWORD},
+                                 environ_base={'REMOTE_ADDR': f'10.0.{n // 250}.{n % 250 + 1}'}).status_code
+            n += 1
+            legit.append(time.perf_counter() - t0)
+            legit_ok['ok' if status in (302, 303) else str(status)] += 1
+            stop.wait(0.5)
+
+    threads = [threading.Thread(target=catalog_client) for _ in range(args.catalog_clients)]
+    if attack:
+        threads += [threading.Thread(target=attacker, args=(n,)) for n in range(args.attackers)]
+        threads.append(threading.Thread(target=legit_user))
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    result = {'catalog': latency(catalog)}
+    if attack:
+        total = sum(attempts.values())
+        result['login'] = {'attempts': total, 'attempts_per_s': round(total / args.duration, 1),
+                           'checked_per_s': round(attempts['checked'] / args.duration, 1), **attempts}
+        result['legitimate'] = {**latency(legit), **legit_ok}
+    return result
+
+
+def main():
+    args = parse_args()
+    setup_env(args)
+    import app as gamestore
+
+    app = gamestore.app
+    with app.app_context():
+        gamestore.init_db()
+        gamestore.seed_sample_data()
+        # one hash for every legitimate account: creating them stays cheap
+        password_hash = gamestore.password_hasher.hash(BENCH_PASSWORD)
+        existing = {u for (u,) in gamestore.db.session.query(gamestore.User.username)}
+        for n in range(int(args.duration * 2) + 2):
+            if f'bench-login{n}' not in existing:
+                gamestore.db.session.add(gamestore.User(username=f'bench-login{n}', password_hash=password_hash))
+        gamestore.db.session.commit()
+    app.test_client().get(args.path)  # warm up (lazy initialisation)
+
+    baseline = run_phase(app, args, attack=False)
+    attack = run_phase(app, args, attack=True)
+    report = {
+        'duration_s': args.duration,
+        'attackers': args.attackers, 'users': args.users, 'ips': args.ips,
+        'throttle': 'off' if args.no_throttle else args.throttle_store,
+        'hasher': gamestore.password_hasher.stats(),
+        'baseline': baseline,
+        'attack': attack,
+    }
+    gamestore.shutdown_background()
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+    hasher = report['hasher']
+    print(f"{args.attackers} attackers, {args.users} accounts, {args.ips} addresses, {args.duration:.0f}s per phase; "
+          f"hashing {hasher['method']} on {hasher['workers']} {hasher['pool']} workers + queue {hasher['max_queue']}, "
+          f"throttle {report['throttle']}")
+    for name in ('baseline', 'attack'):
+        c = report[name]['catalog']
+        print(f"catalog {name:<9} {c['requests']:>6} requests  p50 {c['p50_ms']:>7} ms  p99 {c['p99_ms']:>7} ms")
+    login = attack['login']
+    print(f"login attempts    {login['attempts_per_s']:>6}/s  checked {login['checked_per_s']}/s  "
+          f"throttled {login.get('throttled', 0)}  busy {login.get('busy', 0)}")
+    legit = attack['legitimate']
+    refused = ', '.join(f'{k}: {v}' for k, v in legit.items() if k.isdigit())
+    print(f"legitimate login  {legit.get('ok', 0)}/{legit['requests']} ok{f' ({refused})' if refused else ''}  "
+          f"p50 {legit['p50_ms']} ms  p99 {legit['p99_ms']} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -10,21 +10,28 @@ CREATE TABLE IF NOT EXISTS users (
     is_admin INTEGER NOT NULL DEFAULT 0
 );
 
+CREATE TABLE IF NOT EXISTS categories (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(120) NOT NULL UNIQUE
+);
+
 CREATE TABLE IF NOT EXISTS products (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     title VARCHAR(200) NOT NULL,
+    sku VARCHAR(64),
     price REAL NOT NULL DEFAULT 0,
     img VARCHAR(400),
     image_data BLOB,
     image_mime VARCHAR(120),
-    category VARCHAR(120)
-);
-CREATE INDEX IF NOT EXISTS idx_products_category ON products(category);
-
-CREATE TABLE IF NOT EXISTS categories (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name VARCHAR(120) NOT NULL UNIQUE
+    image_hash VARCHAR(64),
+    category VARCHAR(120),
+    stock INTEGER,
+    category_id INTEGER,
+    updated_at DATETIME,
+    FOREIGN KEY(category_id) REFERENCES categories(id) ON DELETE SET NULL
 );
+CREATE INDEX IF NOT EXISTS idx_products_category_id_id ON products(category_id, id DESC);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_products_sku ON products(sku);
 
 CREATE TABLE IF NOT EXISTS product_images (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -40,9 +47,10 @@ CREATE TABLE IF NOT EXISTS orders (
     total REAL NOT NULL DEFAULT 0,
     status VARCHAR(50) NOT NULL DEFAULT 'pending',
     created_at DATETIME DEFAULT (datetime('now')),
+    cart_key VARCHAR(80),
     FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE SET NULL
 );
-CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id);
+CREATE INDEX IF NOT EXISTS idx_orders_user_id_created_at ON orders(user_id, created_at DESC);
 
 CREATE TABLE IF NOT EXISTS order_items (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -62,9 +70,93 @@ CREATE TABLE IF NOT EXISTS payments (
     amount REAL NOT NULL,
     method VARCHAR(80),
     status VARCHAR(50) NOT NULL DEFAULT 'pending',
+    gateway_ref VARCHAR(120),
+    error VARCHAR(200),
+    created_at DATETIME,
+    updated_at DATETIME,
     FOREIGN KEY(order_id) REFERENCES orders(id) ON DELETE SET NULL
 );
 CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments(order_id);
+CREATE INDEX IF NOT EXISTS idx_payments_status_updated_at ON payments(status, updated_at);
+
+-- Global catalog version (bumped on every product write; HTTP validators)
+CREATE TABLE IF NOT EXISTS catalog_state (
+    id INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL DEFAULT 0,
+    updated_at DATETIME
+);
+
+-- Server-side carts/favorites ('user:<id>' or 'anon:<token>' keys, JSON data)
+CREATE TABLE IF NOT EXISTS cart_states (
+    key VARCHAR(80) PRIMARY KEY,
+    data TEXT NOT NULL DEFAULT '{}',
+    updated_at DATETIME DEFAULT (datetime('now'))
+);
+CREATE INDEX IF NOT EXISTS idx_cart_states_updated_at ON cart_states(updated_at);
+
+-- Sales rollups for reports (gamestore/reporting.py), maintained by checkout
+CREATE TABLE IF NOT EXISTS sales_daily (
+    day DATE PRIMARY KEY,
+    orders INTEGER NOT NULL DEFAULT 0,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS sales_product_daily (
+    day DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, product_id)
+);
+
+CREATE TABLE IF NOT EXISTS sales_category_daily (
+    day DATE NOT NULL,
+    category_id INTEGER NOT NULL,
+    units INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, category_id)
+);
+
+-- Checkout results by Idempotency-Key (replayed on duplicate submits)
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    scope VARCHAR(80) NOT NULL,
+    key VARCHAR(100) NOT NULL,
+    order_id INTEGER,
+    status_code INTEGER NOT NULL DEFAULT 200,
+    response TEXT,
+    created_at DATETIME NOT NULL,
+    PRIMARY KEY (scope, key)
+);
+CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys(created_at);
+
+-- Background jobs (gamestore/jobs.py)
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name VARCHAR(80) NOT NULL,
+    payload TEXT,
+    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 5,
+    run_at DATETIME NOT NULL,
+    locked_by VARCHAR(120),
+    locked_at DATETIME,
+    last_error TEXT,
+    dedupe_key VARCHAR(200),
+    created_at DATETIME NOT NULL,
+    finished_at DATETIME
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs(status, run_at);
+CREATE INDEX IF NOT EXISTS idx_jobs_name_dedupe_key ON jobs(name, dedupe_key);
+CREATE INDEX IF NOT EXISTS idx_jobs_finished_at ON jobs(finished_at);
+
+-- Login throttle buckets (gamestore/auth.py, LOGIN_THROTTLE_STORE=sql)
+CREATE TABLE IF NOT EXISTS login_throttle (
+    key VARCHAR(200) PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_login_throttle_updated_at ON login_throttle(updated_at);
 
 COMMIT;
 
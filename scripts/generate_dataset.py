@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Synthetic GameStore dataset at production scale: products, users, orders, order items and payments.
+
+Usage:
+  PYTHONPATH=. .venv/bin/python3 scripts/generate_dataset.py --database-url sqlite:////tmp/gamestore-big.db
+  PYTHONPATH=. .venv/bin/python3 scripts/generate_dataset.py --database-url sqlite:////tmp/gamestore-big.db \\
+      --products 1000000 --users 200000 --orders 4000000 --images 0.02
+  PYTHONPATH=. DATABASE_URL="postgresql://..." .venv/bin/python3 scripts/generate_dataset.py --products 100000
+
+The schema is upgraded first (init-db) and the rows are appended after the
+ones already there, with explicit ids, through the bulk import path
+(gamestore/bulk.py: COPY on PostgreSQL, executemany on SQLite) in chunks of
+--chunk-size rows, one transaction per chunk.
+
+Everything comes from --seed: the same seed against the same starting
+database writes the same rows (timestamps are relative to --until, not to
+the clock). What is generated:
+
+- products spread over the four categories (category and category_id set),
+  with titles, SKUs (SYN-<id>), prices and stock in each category's range;
+- users synth<id> sharing one password hash of --password (hashing each one
+  would take longer than the whole load; the hash's salt is the only value
+  that differs between two runs);
+- orders spread evenly over the --days before --until, each with a
+  geometric number of lines (mean --items-per-order) whose products follow a
+  Zipf law of exponent --zipf (a few best sellers, a long tail), and whose
+  users follow --user-zipf;
+- one payment per order: mostly captured (order 'paid'), some failed
+  ('payment_failed') and the most recent ones still pending.
+
+--images gives that fraction of the products a JPEG of realistic size
+(log-normal around --image-kb), drawn from a pool of --image-pool distinct
+images so the load stays fast: in the image store (default) or, with
+--image-mode blob, in products.image_data as legacy rows had it. Needs Pillow.
+
+Without --database-url, DATABASE_URL or a temporary SQLite file is used;
+SQLite runs with SQLITE_SYNCHRONOUS=OFF unless set, as this is a scratch load.
+"""
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+# categoría -> (peso en el catálogo, rango de precio)
+CATEGORIES = {
+    'Juegos': (0.55, (199, 1899)),
+    'Accesorios': (0.25, (149, 4500)),
+    'Controles': (0.12, (599, 3200)),
+    'Consolas': (0.08, (5999, 24999)),
+}
+WORDS = {
+    'Juegos': (
+        ('ZOMBIES', 'LEYENDAS', 'GUERRA', 'CARRERAS', 'FÚTBOL', 'DRAGONES', 'GALAXIA', 'SOMBRAS', 'PIRATAS',
+         'NINJA', 'CALL OF DUTY', 'MINECRAFT', 'ELDEN', 'HALO', 'CRASH', 'MORTAL', 'GOD OF WAR', 'FIFA'),
+        ('GAME', 'REBORN', 'ORIGINS', 'DELUXE', '2', '3', 'ONLINE', 'ULTIMATE', 'REMASTERED', 'ARENA', 'WARS'),
+        ('XBOX', 'PS5', 'PS4', 'SWITCH', 'PC'),
+    ),
+    'Accesorios': (
+        ('AUDÍFONOS', 'TECLADO', 'MOUSE', 'DIADEMA', 'CARGADOR', 'BASE', 'CABLE HDMI', 'MEMORIA', 'SILLA',
+         'MICRÓFONO', 'MOUSEPAD', 'WEBCAM'),
+        ('GAMER', 'RGB', 'INALÁMBRICO', 'PRO', 'USB-C', 'ESPORTS', 'ELITE', 'MECÁNICO'),
+        ('NEGRO', 'BLANCO', 'ROJO', 'AZUL', 'X', 'MAX', '2'),
+    ),
+    'Controles': (
+        ('CONTROL', 'GAMEPAD', 'JOYSTICK', 'VOLANTE', 'CONTROL ELITE'),
+        ('XBOX', 'PS5', 'DUALSENSE', 'SWITCH PRO', 'PC'),
+        ('NEGRO', 'BLANCO', 'ROJO', 'AZUL', 'CIAN', 'CAMUFLAJE', 'EDICIÓN ESPECIAL'),
+    ),
+    'Consolas': (
+        ('XBOX SERIES X', 'XBOX SERIES S', 'PLAYSTATION 5', 'PLAYSTATION 5 PRO', 'NINTENDO SWITCH 2',
+         'NINTENDO SWITCH OLED', 'STEAM DECK'),
+        ('512GB', '1TB', '2TB'),
+        ('', 'EDICIÓN ESPECIAL', 'BUNDLE', 'DIGITAL', 'SLIM'),
+    ),
+}
+# (estado del pago, estado del pedido, peso) para pedidos de más de un día
+PAYMENT_OUTCOMES = (('captured', 'paid', 0.93), ('failed', 'payment_failed', 0.07))
+PAYMENT_METHODS = (('card', 0.8), ('paypal', 0.15), ('transfer', 0.05))
+QUANTITIES = ((1, 0.85), (2, 0.11), (3, 0.03), (4, 0.01))
+IMAGE_MIME = 'image/jpeg'
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    ap.add_argument('--database-url', help='target database (default: DATABASE_URL or a temporary SQLite file)')
+    ap.add_argument('--products', type=int, default=10000)
+    ap.add_argument('--users', type=int, default=2000)
+    ap.add_argument('--orders', type=int, default=20000)
+    ap.add_argument('--items-per-order', type=float, default=2.5, help='mean order lines per order')
+    ap.add_argument('--max-items', type=int, default=20, help='order lines per order at most')
+    ap.add_argument('--zipf', type=float, default=1.1, help='exponent of product popularity')
+    ap.add_argument('--user-zipf', type=float, default=0.8, help='exponent of user activity')
+    ap.add_argument('--days', type=int, default=365, help='orders span this many days before --until')
+    ap.add_argument('--until', default='2026-01-01', help='date of the newest order (YYYY-MM-DD)')
+    ap.add_argument('--images', type=float, default=0.0, help='fraction of products with an image')
+    ap.add_argument('--image-mode', choices=('store', 'blob'), default='store')
+    ap.add_argument('--image-kb', type=float, default=120, help='median image size in KB')
+    ap.add_argument('--image-pool', type=int, default=64, help='distinct images generated')
+    ap.add_argument('--password', default='synthetic', help='password of every generated user')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--chunk-size', type=int, default=20000, help='rows per transaction')
+    ap.add_argument('--no-analyze', action='store_true', help='skip ANALYZE after the load')
+    ap.add_argument('--json', action='store_true', help='print the report as JSON')
+    return ap.parse_args()
+
+
+def setup_env(args):
+    url = args.database_url or os.environ.get('DATABASE_URL')
+    if not url:
+        url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='gamestore-dataset-'), 'dataset.db')
+    os.environ['DATABASE_URL'] = url
+    os.environ.setdefault('SQLITE_SYNCHRONOUS', 'OFF')
+    os.environ['JOB_EMBEDDED_WORKER'] = '0'
+    return url
+
+
+def rng_for(seed, table):
+    """One generator per table: changing --orders does not change the products."""
+    return random.Random(f'{seed}:{table}')
+
+
+def zipf_cum_weights(n, exponent):
+    return list(itertools.accumulate(1.0 / k ** exponent for k in range(1, n + 1)))
+
+
+def weighted(pairs):
+    values, weights = zip(*pairs)
+    return values, list(itertools.accumulate(weights))
+
+
+def pick(rng, values, cum):
+    """rng.choices(values, cum_weights=cum)[0] without its per-call overhead."""
+    return values[bisect.bisect(cum, rng.random() * cum[-1])]
+
+
+def next_id(conn, table):
+    return (conn.execute(table.select().with_only_columns(table.c.id).order_by(table.c.id.desc()).limit(1))
+            .scalar() or 0) + 1
+
+
+# -- images ------------------------------------------------------------------
+
+
+def make_images(args, rng):
+    """--image-pool JPEGs whose sizes follow a log-normal law around --image-kb."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise SystemExit('--images needs Pillow (pip install Pillow)')
+    import io
+
+    def encode(side):
+        # ruido sobre un degradado: comprime como una foto, no como un color plano
+        noise = Image.frombytes('RGB', (side, side), rng.randbytes(side * side * 3))
+        base = Image.linear_gradient('L').resize((side, side)).convert('RGB')
+        out = io.BytesIO()
+        Image.blend(base, noise, 0.35).save(out, 'JPEG', quality=85)
+        return out.getvalue()
+
+    bytes_per_pixel = len(encode(256)) / 256 ** 2
+    images = []
+    for _ in range(args.image_pool):
+        target = min(5 * 1024 * 1024, max(5 * 1024, rng.lognormvariate(math.log(args.image_kb * 1024), 0.6)))
+        images.append(encode(max(16, int(math.sqrt(target / bytes_per_pixel)))))
+    return images
+
+
+# -- rows --------------------------------------------------------------------
+
+COLUMNS = {
+    'products': ('id', 'title', 'sku', 'price', 'img', 'image_data', 'image_mime', 'image_hash', 'category',
+                 'category_id', 'stock', 'updated_at'),
+    'users': ('id', 'username', 'password_hash', 'is_admin'),
+    'orders': ('id', 'user_id', 'total', 'status', 'created_at'),
+    'order_items': ('id', 'order_id', 'product_id', 'quantity', 'price'),
+    'payments': ('id', 'order_id', 'amount', 'method', 'status', 'gateway_ref', 'error', 'created_at',
+                 'updated_at'),
+}
+
+
+def product_rows(args, first_id, categories, static_images, images, until, out_prices):
+    rng = rng_for(args.seed, 'products')
+    names, cum = weighted((name, CATEGORIES[name][0]) for name in CATEGORIES)
+    for pid in range(first_id, first_id + args.products):
+        name = pick(rng, names, cum)
+        low, high = CATEGORIES[name][1]
+        # log-uniforme: muchos productos baratos, pocos caros; precios terminados en 9
+        price = float(max(low, round(math.exp(rng.uniform(math.log(low), math.log(high))), -1) - 1))
+        out_prices.append(price)
+        first, second, third = WORDS[name]
+        title = ' '.join(w for w in (rng.choice(first), rng.choice(second), rng.choice(third)) if w)
+        img = rng.choice(static_images) if static_images else None
+        data = mime = digest = None
+        if images and rng.random() < args.images:
+            image = rng.choice(images)
+            img, mime = None, IMAGE_MIME
+            if isinstance(image, str):
+                digest = image
+            else:
+                data = image
+        stock = 0 if rng.random() < 0.03 else rng.randint(1, 300)
+        updated = until - timedelta(seconds=rng.randrange(args.days * 86400))
+        yield (pid, title, f'SYN-{pid:08d}', price, img, data, mime, digest, name, categories[name], stock, updated)
+
+
+def user_rows(args, first_id, password_hash):
+    for uid in range(first_id, first_id + args.users):
+        yield (uid, f'synth{uid}', password_hash, False)
+
+
+def order_chunks(args, ids, prices, until):
+    """(orders, order_items, payments) lists of about --chunk-size order lines each."""
+    rng = rng_for(args.seed, 'orders')
+    product_ids = list(range(ids['products'], ids['products'] + args.products))
+    rng.shuffle(product_ids)  # el rango de popularidad no sigue al id
+    product_cum = zipf_cum_weights(len(product_ids), args.zipf)
+    user_ids = list(range(ids['users'], ids['users'] + args.users))
+    rng.shuffle(user_ids)
+    user_cum = zipf_cum_weights(len(user_ids), args.user_zipf)
+    quantities, quantity_cum = weighted(QUANTITIES)
+    outcomes, outcome_cum = weighted((o[:2], o[2]) for o in PAYMENT_OUTCOMES)
+    methods, method_cum = weighted(PAYMENT_METHODS)
+    extra_lines = max(0.0, args.items_per_order - 1)
+    first_product = ids['products']
+    start = until - timedelta(days=args.days)
+    recent = until - timedelta(days=1)
+    step = args.days * 86400 / max(1, args.orders)
+    item_id = ids['order_items']
+
+    orders, items, pays = [], [], []
+    for n in range(args.orders):
+        oid = ids['orders'] + n
+        created = start + timedelta(seconds=(n + rng.random()) * step)
+        lines = 1 + (min(args.max_items - 1, int(rng.expovariate(math.log1p(1 / extra_lines)))) if extra_lines else 0)
+        picked = {}
+        for pid in rng.choices(product_ids, cum_weights=product_cum, k=lines):
+            # el carrito agrupa el mismo producto en una línea
+            picked[pid] = picked.get(pid, 0) + pick(rng, quantities, quantity_cum)
+        total = 0.0
+        for pid, quantity in picked.items():
+            price = prices[pid - first_product]
+            total += price * quantity
+            items.append((item_id, oid, pid, quantity, price))
+            item_id += 1
+        if created > recent and rng.random() < 0.5:
+            pay_status, order_status, ref = 'pending', 'pending', None
+        else:
+            pay_status, order_status = pick(rng, outcomes, outcome_cum)
+            ref = f'fake_{rng.getrandbits(64):016x}'
+        total = round(total, 2)
+        orders.append((oid, pick(rng, user_ids, user_cum), total, order_status, created))
+        pays.append((ids['payments'] + n, oid, total, pick(rng, methods, method_cum), pay_status,
+                     ref, 'card_declined' if pay_status == 'failed' else None,
+                     created, created + timedelta(seconds=rng.uniform(0.5, 5))))
+        if len(items) >= args.chunk_size:
+            yield orders, items, pays
+            orders, items, pays = [], [], []
+    if orders:
+        yield orders, items, pays
+
+
+# -- load --------------------------------------------------------------------
+
+
+def main():
+    args = parse_args()
+    url = setup_env(args)
+    import app as gamestore
+    from gamestore import bulk
+
+    app, db = gamestore.app, gamestore.db
+    until = datetime.fromisoformat(args.until)
+    names = tuple(COLUMNS)
+    tables = {name: db.metadata.tables[name] for name in names}
+    done = {}
+
+    def report(table, rows, rate):
+        if not args.json:
+            print(f'\r{table:<12} {rows:>10} rows  {rate:>9.0f} rows/s', end='', file=sys.stderr, flush=True)
+
+    started = time.perf_counter()
+    with app.app_context():
+        gamestore.init_db()
+        io_ = bulk.BulkIO(db.engine, tables, chunk_size=args.chunk_size, progress=bulk.Progress(report))
+        with db.engine.connect() as conn:
+            ids = {name: next_id(conn, tables[name]) for name in names}
+        categories = {c.name: c.id for c in gamestore.Category.query.filter(
+            gamestore.Category.name.in_(list(CATEGORIES)))}
+        missing = [name for name in CATEGORIES if name not in categories]
+        if missing:
+            raise SystemExit(f'missing categories {missing}: run init-db on this database first')
+        static_dir = Path(app.static_folder) / 'img' / 'Imagenes'
+        static_images = sorted(f'/static/img/Imagenes/{p.name}' for p in static_dir.glob('*')
+                               if p.suffix.lower() in ('.png', '.jpg', '.jpeg'))
+
+        images = []
+        if args.images > 0:
+            t0 = time.perf_counter()
+            images = make_images(args, rng_for(args.seed, 'images'))
+            done['images'] = {'distinct': len(images), 'mb': round(sum(map(len, images)) / 2 ** 20, 1),
+                              'seconds': round(time.perf_counter() - t0, 1)}
+            if args.image_mode == 'store':
+                digests = [gamestore.image_store.put(data, IMAGE_MIME) for data in images]
+                for digest in digests:
+                    gamestore.enqueue_image_variants(digest, IMAGE_MIME)
+                db.session.commit()
+                images = digests
+
+        def load(chunks):
+            """Write each chunk (one list of rows per table) in one transaction."""
+            tables_in = None
+            t0 = time.perf_counter()
+            for chunk in chunks:
+                if tables_in is None:
+                    tables_in = list(chunk)
+                    for name in tables_in:
+                        io_.progress.start(name)
+                with db.engine.begin() as conn:
+                    for name, rows in chunk.items():
+                        io_.insert_tuples(conn, name, COLUMNS[name], rows)
+                        io_.progress.add(name, len(rows))
+            seconds = time.perf_counter() - t0
+            for name in tables_in or ():
+                rows = io_.progress.rows[name]
+                done[name] = {'rows': rows, 'seconds': round(seconds, 1),
+                              'rows_per_s': round(rows / seconds) if seconds else rows}
+            if tables_in and not args.json:
+                print(file=sys.stderr)
+
+        prices = []
+        load({'products': rows} for rows in bulk.chunked(
+            product_rows(args, ids['products'], categories, static_images, images, until, prices), args.chunk_size))
+        password_hash = gamestore.password_hasher.hash(args.password)
+        load({'users': rows} for rows in bulk.chunked(user_rows(args, ids['users'], password_hash), args.chunk_size))
+        if args.products and args.users:
+            load(dict(zip(('orders', 'order_items', 'payments'), chunk))
+                 for chunk in order_chunks(args, ids, prices, until))
+
+        io_.reset_sequences(names)
+        if not args.no_analyze:
+            t0 = time.perf_counter()
+            with db.engine.begin() as conn:
+                conn.exec_driver_sql('ANALYZE')
+            done['analyze'] = {'seconds': round(time.perf_counter() - t0, 1)}
+        gamestore.catalog_changed()
+        if db.engine.dialect.name == 'sqlite':
+            # todo al archivo principal: el tamaño reportado es el real y se puede copiar tal cual
+            with db.engine.connect() as conn:
+                conn.exec_driver_sql('PRAGMA wal_checkpoint(TRUNCATE)')
+    gamestore.shutdown_background()
+
+    total = time.perf_counter() - started
+    result = {'database_url': url, 'seed': args.seed, 'seconds': round(total, 1), 'tables': done}
+    if url.startswith('sqlite:///'):
+        path = Path(url[len('sqlite:///'):])
+        if path.exists():
+            result['database_mb'] = round(path.stat().st_size / 2 ** 20, 1)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    for name, stats in done.items():
+        if 'rows' in stats:
+            print(f"{name:<12} {stats['rows']:>10} rows  {stats['seconds']:>7} s  {stats['rows_per_s']:>9} rows/s")
+        else:
+            print(f"{name:<12} {json.dumps(stats)}")
+    size = f", {result['database_mb']} MB" if 'database_mb' in result else ''
+    print(f'{total:.1f} s total{size} -> {url}')
+
+
+if __name__ == '__main__':
+    main()
@@ -5,9 +5,8 @@ Seed products into the app database by parsing product blocks in HTML templates.
 Usage:
   PYTHONPATH=. DATABASE_URL="postgresql://..." .venv/bin/python3 scripts/seed_products_from_templates.py
 
-The script finds product blocks that follow the project's markup and inserts
-products into the `products` table if a product with the same title doesn't
-already exist.
+The script finds product blocks that follow the project's markup and upserts
+them into the `products` table by title (price, image and category).
 """
 import os
 import re
@@ -82,7 +81,8 @@ for f, b in blocks:
             price = float(num)
         except Exception:
             price = 0.0
-    if title:
+    # skip Jinja loops such as {{ p.title }} (templates rendered from the DB)
+    if title and '{{' not in title:
         extracted.append({'title': title, 'price': price or 0.0, 'img': img or '/static/img/Imagenes/placeholder.svg', 'category': category or 'General', 'source': str(f)})
 
 print(f"Parsed {len(extracted)} product records (raw).")
@@ -98,40 +98,25 @@ for e in extracted:
 
 print(f"{len(products)} unique products to insert/update.")
 
-# Insert into DB using app context
+# Upsert into the DB in one chunk through the bulk engine (gamestore/bulk.py):
+# one SELECT for the existing titles, then executemany UPDATE/INSERT.
 try:
     # ensure app import picks up DATABASE_URL env var
     sys.path.insert(0, str(ROOT))
-    from app import app, db, Product
+    from app import app, db, Product, make_bulk_io, catalog_changed, ensure_schema
 except Exception as exc:
     print('Failed to import app/models:', exc)
     raise
 
 with app.app_context():
-    inserted = 0
-    updated = 0
-    for p in products:
-        existing = Product.query.filter_by(title=p['title']).first()
-        if existing:
-            # update fields if different
-            changed = False
-            if (existing.price or 0) != (p['price'] or 0):
-                existing.price = p['price']
-                changed = True
-            if (existing.img or '') != p['img']:
-                existing.img = p['img']
-                changed = True
-            if changed:
-                updated += 1
-        else:
-            prod = Product(title=p['title'], price=p['price'], img=p['img'])
-            db.session.add(prod)
-            inserted += 1
-    db.session.commit()
-
-    print(f"Inserted: {inserted}, Updated: {updated}")
-
+    ensure_schema()
+    before = Product.query.count()
+    io_ = make_bulk_io(chunk_size=5000)
+    rows = [{'title': p['title'], 'price': p['price'], 'img': p['img'], 'category': p['category']} for p in products]
+    io_.import_rows('products', rows, key=['title'])
+    catalog_changed()
     total = Product.query.count()
+    print(f"\nInserted: {total - before}, Updated: {len(products) - (total - before)}")
     print(f"Total products in DB now: {total}")
 
 print('Seeding finished.')
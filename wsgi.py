@@ -0,0 +1,12 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+See gunicorn.conf.py for workers, threads, keep-alive and reload, and
+README_SERVING.md for the deployment steps.
+
+The app is the module-level one in app.py (there is no application
+factory): importing it configures everything, binds the database and
+registers the routes, without connecting yet.
+"""
+from app import app